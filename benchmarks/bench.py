@@ -0,0 +1,197 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""
+    Benchmarks of the stages of the prediction (parse, accessibility, scan,
+    best line reduction, output) on synthetic helical bundles and beta barrels
+    of increasing size and on the PDB files of the data directory, and of the
+    startup of the command line (help and argument errors).
+
+    Usage:
+        bench.py [options]
+
+    Options:
+        -h, --help                   Show this
+        --sizes LIST                 Comma separated numbers of residues of the
+                                        synthetic proteins [default: 500,2000,8000].
+        -p LIST, --points LIST       Comma separated numbers of points on the
+                                        hemisphere [default: 250,1000].
+        -r LIST, --resolution LIST   Comma separated resolutions [default: 5,1].
+        -s LIST, --slice LIST        Comma separated slice thicknesses [default: 15].
+        --sasa ENGINE                Accessibility engine [default: shrake-rupley].
+        --repeat N                   Repetitions of each measure, the fastest
+                                        one is kept [default: 1].
+        --no-fixtures                Do not run the PDB files of the data directory.
+        -o PATH, --output PATH       JSON file of the results [default: benchmark.json].
+"""
+
+
+import glob
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from itertools import product
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from docopt import docopt
+import benchmarks.synthetic as synthetic
+import src.accessibility as accessibility
+import src.loader as loader
+import src.parallel as parallel
+import src.pdb as pdb
+import src.pipeline as pipeline
+import src.protein as protein
+import src.sphere as sphere
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT_DIR, "data")
+# Command lines of the startup benchmark
+STARTUP_COMMANDS = {"help": ["main.py", "--help"],
+                    "argument_error": ["main.py", "data/1uaz_tm.pdb", "--slice", "abc"]}
+
+
+def timed(repeat, func, *args):
+    """Run func repeat times
+
+        Returns:
+            tuple: (result of the last call, fastest wall time in seconds)
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def accessible_protein(atoms, sasa_engine):
+    """Accessibility and c_alphas of the structure, centered"""
+    naccess_rsa = accessibility.compute_rsa(atoms, sasa_engine)
+    accessible_residues = protein.keep_accessible_residues(naccess_rsa)
+    prot, center_of_mass = protein.build_protein(atoms, accessible_residues)
+    return protein.scale_ca_coords(prot, center_of_mass), center_of_mass
+
+
+def output(pdb_file, best_results, resolution, center_of_mass):
+    """Membranes, PDB file and PyMol script of the best line"""
+    pts_mb_1, pts_mb_2 = protein.generate_membranes(None, best_results, resolution)
+    new_pdb_file, pml_file = pdb.output_paths(pdb_file)
+    pdb.write_pdb(pdb_file, pts_mb_1, pts_mb_2, new_pdb_file)
+    return pdb.write_pml_script(best_results[0][0] + center_of_mass, new_pdb_file, pml_file)
+
+
+def bench_structure(name, kind, pdb_file, grid, sasa_engine, repeat):
+    """Benchmark all the parameters of the grid on one structure
+
+        Returns:
+            list: One result dictionary per (points, resolution, slice)
+    """
+    atoms, parse_time = timed(repeat, loader.load_structure, pdb_file)
+    (prot, center_of_mass), accessibility_time = timed(
+        repeat, lambda: accessible_protein(loader.load_structure(pdb_file), sasa_engine))
+    results = []
+    for nb_points, resolution, thickness in grid:
+        sphere_points = sphere.generate_points_on_sphere(nb_points)
+        lines, scan_time = timed(repeat, pipeline.scan_protein, prot, thickness,
+                                 resolution, sphere_points)
+        best_results, best_time = timed(repeat, protein.get_best_results, lines)
+        _, output_time = timed(repeat, output, pdb_file, best_results, resolution,
+                               center_of_mass)
+        stages = {"parse": parse_time, "accessibility": accessibility_time - parse_time,
+                  "scan": scan_time, "best_line": best_time, "output": output_time}
+        results.append({"structure": name, "kind": kind, "nb_atoms": len(atoms),
+                        "nb_accessible_residues": len(prot), "points": nb_points,
+                        "resolution": resolution, "slice": thickness,
+                        "stages": stages, "total": sum(stages.values()),
+                        "lines_per_second": nb_points / scan_time if scan_time else None})
+        print("{:<28s} {:>7d} {:>6d} {:>4g} {:>4g}   ".format(
+            name, len(prot), nb_points, resolution, thickness)
+            + "  ".join("{:>9.4f}".format(stages[stage]) for stage in stages))
+    return results
+
+
+def startup_times(repeat):
+    """Cold start of the command line: median wall time of new interpreters
+    running STARTUP_COMMANDS, and of an empty interpreter for reference
+
+        Returns:
+            dict: Seconds per command
+    """
+    commands = dict(STARTUP_COMMANDS, python=["-c", "pass"])
+    times = {}
+    for name, command in commands.items():
+        runs = []
+        for _ in range(max(repeat, 5)):
+            start = time.perf_counter()
+            subprocess.run([sys.executable] + command, cwd=ROOT_DIR,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            runs.append(time.perf_counter() - start)
+        times[name] = statistics.median(runs)
+    return times
+
+
+def parse_list(value, kind=int):
+    """Parse a comma separated list"""
+    return [kind(item) for item in value.split(",") if item]
+
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__)
+    grid = list(product(parse_list(arguments["--points"]),
+                        parse_list(arguments["--resolution"], float),
+                        parse_list(arguments["--slice"], float)))
+    repeat = int(arguments["--repeat"])
+    sasa_engine = arguments["--sasa"]
+
+    startup = startup_times(repeat)
+    print("Startup: " + "  ".join("{} {:.1f} ms".format(name, seconds * 1000)
+                                  for name, seconds in startup.items()) + "\n")
+
+    print("{:<28s} {:>7s} {:>6s} {:>4s} {:>4s}   ".format(
+        "structure", "res", "points", "res", "sl")
+        + "  ".join("{:>9s}".format(stage)
+                    for stage in ("parse", "access", "scan", "best", "output")))
+    results = []
+    work_dir = tempfile.mkdtemp()
+    try:
+        for kind, generator in synthetic.GENERATORS.items():
+            for size in parse_list(arguments["--sizes"]):
+                pdb_file = os.path.join(work_dir, "{}_{}.pdb".format(kind, size))
+                with open(pdb_file, "w") as file_out:
+                    loader.write_pdb_atoms(generator(size), file_out)
+                results += bench_structure("{}_{}".format(kind, size), kind, pdb_file,
+                                           grid, sasa_engine, repeat)
+        if not arguments["--no-fixtures"]:
+            # The outputs of main.py (<name>_new.pdb) are not fixtures
+            for fixture in sorted(path for path in glob.glob(os.path.join(DATA_DIR, "*.pdb"))
+                                  if not path.endswith("_new.pdb")):
+                pdb_file = os.path.join(work_dir, os.path.basename(fixture))
+                shutil.copy(fixture, pdb_file)
+                results += bench_structure(os.path.basename(fixture), "fixture", pdb_file,
+                                           grid, sasa_engine, repeat)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(arguments["--output"], "w") as file_out:
+        json.dump({"date": datetime.now().isoformat(),
+                   "python": platform.python_version(),
+                   "numpy": np.__version__,
+                   "platform": platform.platform(),
+                   "cpu_count": os.cpu_count(),
+                   "available_cpus": parallel.available_cpus(),
+                   "sasa_engine": sasa_engine,
+                   "repeat": repeat,
+                   "startup": startup,
+                   "results": results}, file_out, indent=2)
+    print("\nResults written to", arguments["--output"])
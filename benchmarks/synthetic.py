@@ -0,0 +1,96 @@
+"""
+.. module:: synthetic
+  :synopsis: This module generates synthetic transmembrane proteins for the
+                benchmarks: c_alpha clouds of helical bundles and beta barrels
+                of any size, with hydrophobic residues in the membrane area.
+
+.. moduleauthor:: Gabriel Cretin M2 BIB
+"""
+
+import math
+
+import numpy as np
+from src.loader import Atoms
+
+
+# Half thickness of the synthetic membrane, in angströms
+HALF_MEMBRANE = 15
+HYDROPHOBIC = ["LEU", "ILE", "VAL", "PHE", "ALA"]
+POLAR = ["LYS", "GLU", "ASP", "ARG", "SER", "GLN"]
+
+
+def residue_names(z, rng):
+    """Hydrophobic residues inside the membrane, polar ones outside"""
+    inside = np.abs(z) < HALF_MEMBRANE
+    return np.where(inside, rng.choice(HYDROPHOBIC, len(z)), rng.choice(POLAR, len(z)))
+
+
+def grid_centers(nb_units, spacing):
+    """Centers of nb_units units placed on a square grid in the xy plane"""
+    side = math.ceil(math.sqrt(nb_units))
+    return [(spacing * (index % side), spacing * (index // side)) for index in range(nb_units)]
+
+
+def helical_bundle(nb_residues, helix_length=40, seed=0):
+    """Bundle of transmembrane alpha helices, parallel to the z axis
+
+        Args:
+            nb_residues: Number of residues of the protein
+            helix_length: Number of residues of each helix
+            seed: Seed of the random residue names
+
+        Returns:
+            Atoms: The c_alphas of the protein
+    """
+    rng = np.random.default_rng(seed)
+    index = np.arange(helix_length)
+    # 1.5 angström rise and 100° per residue on a 2.3 angströms radius
+    helix = np.column_stack([2.3 * np.cos(np.radians(100 * index)),
+                             2.3 * np.sin(np.radians(100 * index)),
+                             1.5 * (index - helix_length / 2)])
+    nb_helices = math.ceil(nb_residues / helix_length)
+    coords = np.vstack([helix * (1, 1, (-1)**number) + (x, y, 0)
+                        for number, (x, y) in enumerate(grid_centers(nb_helices, 10))])
+    return make_atoms(coords[:nb_residues], rng)
+
+
+def beta_barrel(nb_residues, nb_strands=16, strand_length=12, seed=0):
+    """Beta barrels of tilted strands, several barrels for the large sizes
+
+        Args:
+            nb_residues: Number of residues of the protein
+            nb_strands: Number of strands of each barrel
+            strand_length: Number of residues of each strand
+            seed: Seed of the random residue names
+
+        Returns:
+            Atoms: The c_alphas of the protein
+    """
+    rng = np.random.default_rng(seed)
+    # 4.8 angströms between strands
+    radius = 4.8 * nb_strands / (2 * np.pi)
+    index = np.arange(strand_length)
+    strands = []
+    for strand in range(nb_strands):
+        # Strands are tilted by 40° and rise by 3.3 angströms per residue
+        angle = 2 * np.pi * strand / nb_strands + np.radians(40) * 3.3 * index / radius / 2
+        strands.append(np.column_stack([radius * np.cos(angle), radius * np.sin(angle),
+                                        3.3 * (index - strand_length / 2) * (-1)**strand]))
+    barrel = np.vstack(strands)
+    nb_barrels = math.ceil(nb_residues / len(barrel))
+    coords = np.vstack([barrel + (x, y, 0)
+                        for x, y in grid_centers(nb_barrels, 2 * radius + 10)])
+    return make_atoms(coords[:nb_residues], rng)
+
+
+def make_atoms(coords, rng):
+    """c_alpha Atoms of the coordinates, one chain every 9999 residues"""
+    nb_residues = len(coords)
+    number = np.arange(nb_residues)
+    chains = np.array([chr(ord("A") + chain % 26) for chain in number // 9999])
+    return Atoms(coords, ["CA"] * nb_residues, ["C"] * nb_residues,
+                 residue_names(coords[:, 2], rng), chains, number % 9999 + 1,
+                 [" "] * nb_residues, [False] * nb_residues)
+
+
+GENERATORS = {"helical_bundle": helical_bundle, "beta_barrel": beta_barrel}
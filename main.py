@@ -4,158 +4,159 @@
 
 """
     Usage:
-        main.py FILE [--naccess PATH] [--points NUM] [--resolution RES] [--slice SLICE]
+        main.py FILE [options]
+        main.py --batch SOURCE [options]
+        main.py --trajectory SOURCE [options]
+        main.py --daemon [options]
 
     Options:
         -h, --help                   Show this
+        -b SOURCE, --batch SOURCE    Process many structures: a directory, a glob
+                                        pattern or a manifest file (one path per line).
+                                        The structures are processed by a persistent
+                                        pool of workers, one protein per worker.
+        -t SOURCE, --trajectory SOURCE
+                                     Process every model of a multi-model PDB or
+                                        mmCIF file (NMR ensemble, MD frames), or of
+                                        a stream on the standard input ("-"). Each
+                                        frame is searched around the best direction
+                                        of the previous one, and one record per
+                                        frame is written.
+        --local-angle DEG            Angle of the patch of lines scanned around the
+                                        previous direction, in degrees [default: 10].
+        --local-points NUM           Number of lines of the patch [default: 50].
+        --rescan-drop FRAC           Relative drop of the hydrophobicity factor
+                                        triggering a full scan of the hemisphere
+                                        [default: 0.1].
+        --accessibility-once         Compute the accessible residues on the first
+                                        frame only.
+        -d, --daemon                 Run as a local service keeping warm workers:
+                                        the jobs (a path or the bytes of a
+                                        structure, and the parameters) are
+                                        submitted over localhost HTTP or a Unix
+                                        socket, and answered in JSON.
+        --port PORT                  Port of the HTTP server of the daemon, on
+                                        localhost (8765 without --socket).
+        --socket PATH                Unix socket of the daemon, one JSON job per line.
+        --max-queue NUM              Maximum number of jobs waiting for a worker
+                                        of the daemon, the next ones are
+                                        rejected [default: 16].
+        --timeout SEC                Maximum runtime of a job of the daemon, in
+                                        seconds [default: 300].
+        -o PATH, --output PATH       Output file of the batch mode, one record per
+                                        protein, of the trajectory mode, one record
+                                        per frame, or of the parameter sweep, one
+                                        record per combination [default: -].
+        -f FORMAT, --format FORMAT   Format of the batch output: "jsonl" or "csv"
+                                        [default: jsonl].
         -n PATH, --naccess PATH      Absolute path to local naccess binary
+        --prefix PREFIX              Prefix of the PDB file with the membranes and
+                                        of the PyMol script (PREFIX.pdb and
+                                        PREFIX.pml), FILE without extension
+                                        followed by _new by default.
+        -z, --gzip                   Compress the PDB file with the membranes.
+        --naccess-jobs NUM           In batch mode, run NACCESS in the background
+                                        with at most NUM concurrent runs: the
+                                        accessibility of the next structures is
+                                        computed while the previous ones are scanned.
+        --per-chain                  Run NACCESS once per chain, the chains
+                                        concurrently (large assemblies). The
+                                        interfaces between chains count as accessible.
+        -j NUM, --jobs NUM           Number of workers of the scan, of the batch
+                                        mode and of the daemon. All the cpus
+                                        available to the process (scheduler
+                                        affinity and CPU quota of the container)
+                                        by default.
+        --backend NAME               Backend of the scan of the lines: "serial",
+                                        "threads", "processes" or "auto" to choose
+                                        serial or processes from the number of
+                                        accessible residues times the number of
+                                        lines [default: auto].
+        --chunk-size NUM             Number of lines of a task of the "threads"
+                                        and "processes" backends, about 4 tasks
+                                        per worker by default.
+        --checkpoint DIR             Save the best lines of every finished range of
+                                        lines (--chunk-size lines, 1000 by default)
+                                        in a checkpoint file of DIR, keyed by the
+                                        protein and the parameters. A killed run
+                                        restarted with the same parameters only
+                                        scans the unfinished ranges. The file is
+                                        removed at the end of the scan. The
+                                        checkpoints are pickled: DIR must only
+                                        be writable by trusted users.
+        --profile PATH               Write the wall time, CPU time and increase of
+                                        the peak RSS of every stage, the lines and
+                                        slices evaluated per second and per worker
+                                        as a JSON document ("-" for the standard
+                                        output).
+        --profile-kernel PREFIX      Dump the cProfile statistics of the scan
+                                        kernel in PREFIX.<pid>, one file per process.
+        --sasa ENGINE                Engine computing the solvant accessibility
+                                        of the residues: "naccess" or the
+                                        built-in "shrake-rupley", which needs
+                                        no external binary [default: naccess].
+        --cache DIR                  Directory of the cache of accessible residues.
+                                        Runs on an already processed file skip
+                                        the accessibility calculations and the parsing.
+        --cache-size MB              Maximum size of the cache in megabytes. The
+                                        least recently used entries are removed
+                                        first [default: 1024].
         -p NUM, --points NUM         Number of points to generate on the
                                         hemisphere to criss-cross the protein.
                                         A high number will give better results,
                                         but longer calculations. [default: 250]
-        -r RES, --resolution RES     An integer in angströms setting the
+        -a, --adaptive               Adaptive search: a coarse scan of the hemisphere
+                                        with --points lines, then denser patches of
+                                        lines around the best directions until the
+                                        angular precision is reached.
+        --precision DEG              Angular precision of the adaptive search, in
+                                        degrees [default: 1.0].
+        --scale SCALE                Hydrophobicity scale scoring the slices: "types"
+                                        (distinct hydrophobic residue types per
+                                        residue), "binary" (fraction of hydrophobic
+                                        residues), "kyte-doolittle", "wimley-white"
+                                        or a file of "RES value" lines. Several
+                                        comma separated scales are scored in the
+                                        same pass, the membranes are written for
+                                        the first one (one scale with --trajectory)
+                                        [default: types].
+        -c NUM, --candidates NUM     Number of distinct candidate orientations
+                                        (at least 10 degrees apart) reported with
+                                        their membranes, to spot ambiguous
+                                        predictions [default: 1].
+        -r RES, --resolution RES     A number in angströms setting the
                                         resolution (sliding step) of the slicing.
                                         Setting a resolution to 1 will create slices along
                                         a processed line with a step of 1 angström.
+                                        Sub-angström resolutions (ex: 0.5) are allowed.
                                         A higher resolution will create less
                                         slices of the protein, and will then
                                         reduce the computing time [default: 5].
-        -s SLICE, --slice SLICE      An integer in angströms setting the thickness
+        -s SLICE, --slice SLICE      A number in angströms setting the thickness
                                         of a slice. A thick slice will potentially
                                         englobe more accessible residues and reduce
                                         the number of slices. This reduces the
                                         computations but is less resolutive. [default: 15]
+        --sweep-slice LIST           Parameter sweep: comma separated thicknesses
+                                        of the slices (ex: 10,15,20). The lines are
+                                        projected once for all the combinations.
+        --sweep-resolution LIST      Parameter sweep: comma separated resolutions
+                                        (ex: 1,2,5). Combined with every thickness
+                                        of --sweep-slice (or --slice).
 """
 
 
 # IMPORTS
+# Only the standard library and docopt are loaded at startup: the help and
+# the argument errors are printed at once, and the pool workers started with
+# spawn, which import this module, do not load the stages they do not run.
 
-from Bio.PDB import NACCESS
-from Bio.PDB import PDBParser
 from docopt import docopt
-from collections import abc
-from operator import itemgetter
 from datetime import datetime
-from multiprocessing import Pool, cpu_count
-from functools import partial
-from itertools import product
-from copy import deepcopy
-
-import copy
-import math
 import sys
 
-import numpy as np
-import matplotlib.pyplot as plt
-import src.protein as protein
-import src.sphere as sphere
-import src.vector as vector
-import src.pdb as pdb
-
-
-def loop(processed_lines, prot_dict, thickness, resolution, sphere_point):
-    """Main loop doing the calculations for 1 line of the sphere.
-
-        Args:
-            processed_lines: An array of dictionaries containing the processed lines
-            prot_dict: A dictionary compiling coordinates and more infos on
-                        every c_alphas of the protein
-            sphere_point: Coordinates of a point of the hemisphere.
-                            Iterative argument of type Vector(x, y, z). Changes
-                            on each iteration of the function for the parallelization
-            thickness: Number for the desired thickness of the slices, in angströms
-            resolution: Integer in angströms setting the step of sliding.
-
-        Returns:
-            The line processed during the current iteration,
-            appended to the array containing all other lines processed
-    """
-    # print("Point de la sphère: ", sphere_point)
-    # We set a plane far away from the protein (500 angströms)
-    plane_normal = vector.Vector(
-        sphere_point[0], sphere_point[1], sphere_point[2]) * 500
-
-    # Search the nearest and farthest c_alpha to the plane
-    # We keep all distances between c_alphas and the plane in a dictionary
-    # to simplify calculations when sliding the plane along the line.
-    dist_ca_to_plane = {}
-    for c_alpha, infos in prot_dict.items():
-        dist_ca_to_plane[c_alpha] = infos['3Dcoords'].dist_to_plane(
-            plane_normal)
-    min_res_id, shortest_distance = min(
-        dist_ca_to_plane.items(), key=itemgetter(1))
-    max_res_id, longest_distance = max(
-        dist_ca_to_plane.items(), key=itemgetter(1))
-
-    # We place the plane at the level of the nearest c_alpha.
-    # For this we subtract the shortest distance to all other
-    # c_alpha - plane distances
-    dist_ca_to_plane = {
-        res_id: dist - shortest_distance for res_id, dist in dist_ca_to_plane.items()}
-
-    # Calculate relative hydrophobicity of all c_alphas between this plane
-    # and a 15 angströms (by default) parallel plane.
-    # The slice is sliding along the plane's normal towards the farthest
-    # c_alpha with a step of 5 (by default) angströms each loop
-    nb_steps = math.ceil((longest_distance - shortest_distance) / resolution)
-
-    # Dictionary containing the current processed line's informations:
-    #   - Average hydrophobicity
-    #   - Relative hydrophobicity in all slices
-    #   - Number of steps
-    #   - Shortest distance between residues and the plane
-    line = {"slice_hydro": np.zeros((nb_steps, 1)),  # The index of the array = slice_step
-            "line_average_hydro": None,
-            "nb_steps": nb_steps,
-            "shortest_distance": shortest_distance}
-
-    # Process all the slices of the current line / direction
-    process_slices_of_line(dist_ca_to_plane, line,
-                           nb_steps, thickness, resolution)
-
-    # Calculate the hydrophobicity factor of the line
-    line_average_hydro = np.sum(line["slice_hydro"]) * nb_steps**2
-    assert isinstance(line_average_hydro, (float, int)
-                      ), "Error 5: The line average hydrophobicity should be an int or float"
-
-    # Stock the plane's normal vector and the average hydrophobicity in list as tuples:
-    # Example: [ (plane_normal_1, average_hydrophobicity_1), ... ]
-    line["line_average_hydro"] = tuple((plane_normal, line_average_hydro))
-    processed_lines.append(line)
-
-    return processed_lines
-
-
-def process_slices_of_line(dist_ca_to_plane, line, nb_steps, thickness, resolution):
-    """Calculate the relative hydrophobicity of all slices of the current line.
-        The slice slides along its line with a step of 1 angström
-
-        Args:
-            dist_ca_to_plane: Distances between all c_alphas and the plane.
-                                Distances are being updated for each iteration.
-            line: Dictionary compiling the line's slices hydrophobicity info and
-                    the average_hydrophobicity of the line
-            nb_steps: Number of slices to create along the current line to cover
-                        the whole protein
-            thickness: Number for the desired thickness of the slices, in angströms
-            resolution: Integer in angströms setting the step of sliding.
-        Returns:
-            Nothing. Updates values inplace.
-    """
-    # 1 step = 1 slice
-    for step in range(nb_steps):
-        residues_in_slice = []
-        # Check which c_alphas are in the 15 angströms slice
-        for res_id, dist in dist_ca_to_plane.items():
-            if 0.0 <= dist <= thickness:
-                residues_in_slice.append(prot_dict[res_id]["resName"])
-        # Calculate the relative hydrophobicity of the slice
-        line["slice_hydro"][step] = protein.slice_relative_hydrophobicity(
-            residues_in_slice, len(residues_in_slice))
-        # Slide the plane along the line. Step = 5 angströms by default
-        dist_ca_to_plane = {
-            res_id: dist - resolution for res_id, dist in dist_ca_to_plane.items()}
-    return None
+import src.options as options
+import src.profiling as profiling
 
 
 if __name__ == '__main__':
@@ -164,33 +165,97 @@ if __name__ == '__main__':
 
     # Parse command line
     arguments = docopt(__doc__, version='Transmembrane Protein Areas 1.0')
+    error = options.check_arguments(arguments)
+    if error:
+        sys.exit(error)
     pdb_file = arguments["FILE"]
-    thickness = int(arguments["--slice"])
-    resolution = int(arguments["--resolution"])
-
-    # Run NACCESS with the Biopython wrapper
-    pdb_struct = PDBParser(QUIET=True)
-    struct = pdb_struct.get_structure(pdb_file[:4].upper(), pdb_file)
-    model = struct[0]
-
-    # Use custom naccess installation path if specified in command line argument
-    if arguments["--naccess"]:
-        rsa_data, asa_data = NACCESS.run_naccess(model, pdb_file,
-                                                 naccess=arguments["--naccess"])
+    thickness = float(arguments["--slice"])
+    resolution = float(arguments["--resolution"])
+    nb_candidates = int(arguments["--candidates"])
+    sasa_engine = arguments["--sasa"]
+    jobs = int(arguments["--jobs"]) if arguments["--jobs"] else None
+
+    # Opt-in instrumentation of the stages
+    if arguments["--profile"] or arguments["--profile-kernel"]:
+        profiler = profiling.enable(arguments["--profile-kernel"])
     else:
-        rsa_data, asa_data = NACCESS.run_naccess(model, pdb_file)
-    # Parse the naccess output .rsa file to retrieve
-    # the relative % of solvant accessible area for each CA
-    naccess_rsa = NACCESS.process_rsa_data(rsa_data)
-    # Keep only residues having a relative accessibility > 30 (arbitrary)
-    accessible_residues = protein.keep_accessible_residues(naccess_rsa)
-
-    # The dict compiles informations on the protein residues.
+        profiler = profiling.current()
+
+    # The stages are loaded once the arguments are valid
+    with profiler.stage("imports"):
+        import src.protein as protein
+        import src.sphere as sphere
+        import src.search as search
+        import src.scales as scales
+        import src.executors as executors
+        import src.checkpoint as checkpoint
+        import src.pdb as pdb
+        import src.pipeline as pipeline
+        import src.batch as batch
+        import src.trajectory as trajectory
+
+    try:
+        scale_list = scales.get_scales(arguments["--scale"])
+    except (ValueError, OSError) as err:
+        sys.exit(str(err))
+    scale = scale_list[0]
+
+    if arguments["--daemon"]:
+        import src.daemon as daemon
+        port = int(arguments["--port"]) if arguments["--port"] else None
+        if port is None and arguments["--socket"] is None:
+            port = daemon.DEFAULT_PORT
+        print("Daemon listening on " + ", ".join(
+            (["http://{}:{}".format(daemon.HOST, port)] if port else [])
+            + ([arguments["--socket"]] if arguments["--socket"] else [])), file=sys.stderr)
+        daemon.serve(port=port, socket_path=arguments["--socket"], processes=jobs,
+                     max_queue=int(arguments["--max-queue"]),
+                     timeout=float(arguments["--timeout"]), sasa_engine=sasa_engine,
+                     naccess=arguments["--naccess"], cache_dir=arguments["--cache"],
+                     cache_size=float(arguments["--cache-size"]),
+                     per_chain=arguments["--per-chain"])
+        sys.exit(0)
+
+    if arguments["--batch"]:
+        # One persistent pool for all the structures, one record per protein
+        pdb_files = batch.list_structures(arguments["--batch"])
+        nb_ok, nb_errors = batch.run_batch(
+            pdb_files, arguments["--output"], arguments["--format"], processes=jobs,
+            nb_points=int(arguments["--points"]), thickness=thickness,
+            adaptive=arguments["--adaptive"], precision=float(arguments["--precision"]),
+            nb_candidates=nb_candidates, scale=scale_list,
+            resolution=resolution, sasa_engine=sasa_engine, naccess=arguments["--naccess"],
+            cache_dir=arguments["--cache"], cache_size=float(arguments["--cache-size"]),
+            per_chain=arguments["--per-chain"],
+            naccess_jobs=int(arguments["--naccess-jobs"] or 0))
+        print("\n{} structures processed, {} failed. Batch runtime: {}".format(
+            nb_ok, nb_errors, datetime.now() - startTime), file=sys.stderr)
+        sys.exit(0)
+
+    if arguments["--trajectory"]:
+        # Time series of the orientations, warm-started from frame to frame
+        nb_ok, nb_errors, nb_full_scans = trajectory.run_trajectory(
+            arguments["--trajectory"], arguments["--output"], arguments["--format"],
+            thickness=thickness, resolution=resolution, nb_points=int(arguments["--points"]),
+            local_angle=float(arguments["--local-angle"]),
+            local_points=int(arguments["--local-points"]),
+            rescan_drop=float(arguments["--rescan-drop"]), scale=scale,
+            sasa_engine=sasa_engine, naccess=arguments["--naccess"],
+            per_chain=arguments["--per-chain"],
+            accessibility_once=arguments["--accessibility-once"])
+        print("\n{} frames processed ({} full scans), {} failed. Runtime: {}".format(
+            nb_ok, nb_full_scans, nb_errors, datetime.now() - startTime), file=sys.stderr)
+        sys.exit(0)
+
+    # The Protein compiles informations on the protein residues as arrays.
     # It contains solvant accessible c_alpha coordinates,
-    # the residues names and their respective solvant accessibility area value
+    # the residues codes and their respective solvant accessibility area value
     # We also get the center of mass of the protein.
-    prot_dict, center_of_mass = protein.build_prot_dict(
-        pdb_file, accessible_residues)
+    # Warm runs read them from the cache and skip NACCESS and the parsing.
+    prot, center_of_mass = pipeline.load_protein(
+        pdb_file, sasa_engine, arguments["--naccess"],
+        arguments["--cache"], float(arguments["--cache-size"]),
+        per_chain=arguments["--per-chain"])
 
     # Generate n points on a hemisphere englobing the protein. By default n = 250.
     if arguments["--points"]:
@@ -203,42 +268,131 @@ if __name__ == '__main__':
     # We scale coordinates to be in a (0, 0, 0) centered
     # coordinates system to simplify further calculations
     # The coordinates are modified inplace.
-    prot_dict = protein.scale_ca_coords(prot_dict, center_of_mass)
-
-    ########################################
-    # Main calculations loop is parallelized
-    ########################################
-
-    # List containing the processed sphere lines
-    processed_lines = []
-    # Parallelization of the main loop
-    # The calculations for each line of the hemisphere is parallelized.
-    # This means that there are as many lines as available cpus processed simultaneously
-    pool = Pool(processes=cpu_count())
-    func = partial(loop, processed_lines, prot_dict, thickness, resolution)
-    processed_lines = pool.imap(func, sphere_points)
-    pool.close()
-    pool.join()
-
-    # Extract the "best" line, the one maximizing the average hydrophobicity
-    best_results = protein.get_best_results(processed_lines)
+    prot = protein.scale_ca_coords(prot, center_of_mass)
+
+    if arguments["--sweep-slice"] or arguments["--sweep-resolution"]:
+        if len(scale_list) > 1:
+            sys.exit("The parameter sweep accepts a single --scale")
+        # Parameter sweep: one best line per (thickness, resolution) combination,
+        # the projections of the lines are shared by all the combinations
+        records = pipeline.sweep(
+            pdb_file, prot, center_of_mass,
+            pipeline.parse_values(arguments["--sweep-slice"], thickness),
+            pipeline.parse_values(arguments["--sweep-resolution"], resolution),
+            sphere_points, processes=jobs, scale=scale)
+        print("\n{:>9s} {:>10s} {:>28s} {:>14s} {:>17s}".format(
+            "thickness", "resolution", "point", "hydrophobicity", "membranes"))
+        for record in records:
+            print("{:9} {:10} {:>28s} {:14.4f} {:>17s}".format(
+                record["thickness"], record["resolution"],
+                "({:.1f}, {:.1f}, {:.1f})".format(*record["point"]), record["hydrophobicity"],
+                "{:.1f} - {:.1f}".format(record["membrane_start"], record["membrane_end"])))
+        # The records are written only to a file, the table is on the standard output
+        if arguments["--output"] != "-":
+            batch.write_records(records, arguments["--output"], arguments["--format"],
+                                batch.SWEEP_FIELDS)
+        if arguments["--profile"]:
+            profiler.write(arguments["--profile"])
+        print("\n\nProgram runtime: ", datetime.now() - startTime)
+        sys.exit(0)
+
+    if arguments["--adaptive"]:
+        # Coarse scan of the hemisphere with --points lines, then denser
+        # patches of lines around the best directions
+        # The refined directions depend on the scale: one search per scale
+        scale_candidates = []
+        nb_lines = 0
+        with profiler.stage("scan"):
+            for one_scale in scale_list:
+                candidates, scale_lines = search.adaptive_search(
+                    prot, thickness, resolution, nb_points, float(arguments["--precision"]),
+                    nb_candidates=nb_candidates, scale=one_scale)
+                scale_candidates.append(candidates)
+                nb_lines += scale_lines
+    else:
+        ########################################
+        # Main calculations loop is parallelized
+        ########################################
+
+        # Parallelization of the main loop
+        # The small proteins are scanned serially, the others by a pool of
+        # processes sharing the protein in shared memory.
+        # The sphere points are split in ranges of lines. Each range is processed
+        # at once by the vectorized scan, as many ranges as available cpus simultaneously
+        # All the scales are scored in the same pass
+        chunk_size = int(arguments["--chunk-size"]) if arguments["--chunk-size"] else None
+        with profiler.stage("scan"):
+            if arguments["--checkpoint"]:
+                # The finished ranges of lines are saved as the scan goes,
+                # and the ones saved by a killed run are not scanned again
+                processed_lines, nb_resumed = checkpoint.checkpointed_scan(
+                    prot, thickness, resolution, sphere_points, scale_list,
+                    arguments["--checkpoint"], nb_candidates, arguments["--backend"], jobs,
+                    chunk_size)
+                if nb_resumed:
+                    print("{} lines resumed from the checkpoint".format(nb_resumed))
+            else:
+                processed_lines = executors.scan_scales(
+                    prot, thickness, resolution, sphere_points, scale_list,
+                    nb_candidates=nb_candidates, backend=arguments["--backend"], jobs=jobs,
+                    chunk_size=chunk_size)
+
+        # Extract the "best" line, the one maximizing the average hydrophobicity
+        with profiler.stage("best_line"):
+            scale_candidates = [protein.get_candidates(lines, nb_candidates)
+                                for lines in processed_lines]
+        nb_lines = nb_points
+    candidates = scale_candidates[0]
+    best_results = candidates[0]
 
     print("\n\n\n###################################\n\n")
     print("Best line/direction is between the center of mass and the following point:\n\t",
           "Point of the sphere: ", best_results[0][0] + center_of_mass,
           "\n\tCenter of mass: ", center_of_mass,
-          "\n\nHighest hydrophobicity factor: {:.4f}".format(best_results[0][1]), "\n")
+          "\n\nHighest hydrophobicity factor: {:.4f}".format(best_results[0][1]),
+          "\nNumber of lines evaluated: {}".format(nb_lines), "\n")
+    if nb_candidates > 1:
+        # Other orientations, at least 10 degrees apart: close hydrophobicity
+        # factors flag an ambiguous prediction
+        summary = pipeline.candidates_record(candidates, center_of_mass, resolution)
+        print("Candidate orientations:")
+        for rank, candidate in enumerate(summary["candidates"], start=1):
+            print("\t{}. Point: ({:.3f}, {:.3f}, {:.3f})  hydrophobicity factor: {:.4f}"
+                  "  membranes: {:.1f} - {:.1f}".format(
+                      rank, *candidate["point"], candidate["hydrophobicity"],
+                      candidate["membrane_start"], candidate["membrane_end"]))
+        if summary["ambiguity"] is not None:
+            print("Ambiguity (second / first factor): {:.3f}\n".format(summary["ambiguity"]))
+    if len(scale_list) > 1:
+        print("{:>16s} {:>28s} {:>14s} {:>17s}".format(
+            "scale", "point", "hydrophobicity", "membranes"))
+        for one_scale, candidates in zip(scale_list, scale_candidates):
+            summary = pipeline.candidate_summary(candidates[0], center_of_mass, resolution)
+            print("{:>16s} {:>28s} {:14.4f} {:>17s}".format(
+                one_scale.name, "({:.1f}, {:.1f}, {:.1f})".format(*summary["point"]),
+                summary["hydrophobicity"],
+                "{:.1f} - {:.1f}".format(summary["membrane_start"], summary["membrane_end"])))
+        print()
 
     # We generate the points simulating the membranes
-    pts_mb_1, pts_mb_2 = protein.generate_membranes(
-        processed_lines, best_results, resolution)
-
-    # Write the new PDB file containing the original PDB to which were appended
-    # the coordinates of DUM atoms to represent the membranes
-    new_pdb_file = pdb.write_pdb(pdb_file, pts_mb_1, pts_mb_2)
-
-    # Write a small PyMol script (pymol_visualize.pml) to visualize the best line
-    pdb.write_pml_script(best_results[0][0] + center_of_mass, new_pdb_file)
+    with profiler.stage("membranes"):
+        pts_mb_1, pts_mb_2 = protein.generate_membranes(
+            None, best_results, resolution)
+
+    with profiler.stage("output"):
+        new_pdb_file, pml_file = pdb.output_paths(pdb_file, arguments["--prefix"])
+        if arguments["--gzip"]:
+            new_pdb_file += ".gz"
+        # Write the new PDB file containing the original PDB to which were appended
+        # the coordinates of DUM atoms to represent the membranes
+        pdb.write_pdb(pdb_file, pts_mb_1, pts_mb_2, new_pdb_file)
+
+        # Write a small PyMol script (PREFIX.pml) to visualize the best line
+        pdb.write_pml_script(best_results[0][0] + center_of_mass, new_pdb_file, pml_file)
+    print("PDB file with the membranes: {}\nPyMol script: {}".format(new_pdb_file, pml_file))
+
+    if arguments["--profile"]:
+        profiler.write(arguments["--profile"])
 
     ################# RUNTIME STATS ##################################
     ##################################################################
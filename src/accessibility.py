@@ -0,0 +1,370 @@
+"""
+.. module:: accessibility
+  :synopsis: This module computes the relative solvant accessibility of the
+                residues, either with NACCESS or with a
+                built-in NumPy implementation of the Shrake-Rupley algorithm.
+                Both engines return the same dictionary as
+                Bio.PDB.NACCESS.process_rsa_data. The NACCESS runs of many
+                structures, or of the chains of a large assembly, can be
+                launched concurrently in the background, with their scratch
+                files on a RAM-backed directory.
+
+.. moduleauthor:: Gabriel Cretin M2 BIB
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import product
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+import numpy as np
+import src.loader as loader
+import src.parallel as parallel
+import src.sphere as sphere
+
+
+# RAM-backed directories for the scratch files of NACCESS, in order of preference
+SCRATCH_DIRS = ["/dev/shm"]
+
+# Van der Waals radii (angströms) of the atoms, as in NACCESS vdw.radii
+ELEMENT_RADII = {"C": 1.87, "N": 1.65, "O": 1.40, "S": 1.85}
+DEFAULT_RADIUS = 1.80
+# Carbonyl and aromatic carbons are smaller
+SMALL_CARBONS = {"C", "CG:PHE", "CD1:PHE", "CD2:PHE", "CE1:PHE", "CE2:PHE", "CZ:PHE",
+                 "CG:TYR", "CD1:TYR", "CD2:TYR", "CE1:TYR", "CE2:TYR", "CZ:TYR",
+                 "CG:TRP", "CD1:TRP", "CD2:TRP", "CE2:TRP", "CE3:TRP", "CZ2:TRP",
+                 "CZ3:TRP", "CH2:TRP", "CG:HIS", "CD2:HIS", "CE1:HIS",
+                 "CG:ASP", "CG:ASN", "CD:GLU", "CD:GLN", "CZ:ARG"}
+
+# All atoms accessibility (angströms²) of the residues in an extended
+# ALA-X-ALA tripeptide, as in NACCESS standard.data
+STANDARD_ACCESSIBILITY = {"ALA": 107.95, "ARG": 238.76, "ASN": 143.94, "ASP": 140.39,
+                          "CYS": 134.28, "GLN": 178.50, "GLU": 172.25, "GLY": 80.10,
+                          "HIS": 182.88, "ILE": 175.12, "LEU": 178.63, "LYS": 200.81,
+                          "MET": 194.15, "PHE": 199.48, "PRO": 136.13, "SER": 116.50,
+                          "THR": 139.27, "TRP": 249.36, "TYR": 212.76, "VAL": 151.44}
+
+
+def atom_radius(atom_name, element, res_name):
+    """Van der Waals radius of an atom
+
+        Args:
+            atom_name: Name of the atom in the PDB (CA, CB, ...)
+            element: Element of the atom
+            res_name: 3 letters code of the residue of the atom
+
+        Returns:
+            float: The radius in angströms
+    """
+    if element == "C" and (atom_name in SMALL_CARBONS
+                           or atom_name + ":" + res_name in SMALL_CARBONS):
+        return 1.76
+    return ELEMENT_RADII.get(element, DEFAULT_RADIUS)
+
+
+def cell_grid(coords, radii):
+    """Grid of cells at least as large as the largest diameter, padded with
+    one empty cell on each side (see :func:`neighbor_pairs`)
+
+        Args:
+            coords: (A, 3) Numpy array of the atoms coordinates
+            radii: (A,) Numpy array of the radii (probe included)
+
+        Returns:
+            tuple: (keys, order, sorted_keys, offsets) key of the cell of every
+                    atom, atoms sorted by key, their keys, and offsets of the
+                    keys of the 27 neighbor cells
+    """
+    cells = np.floor((coords - coords.min(axis=0)) / (2 * radii.max())).astype(np.int64) + 1
+    dims = cells.max(axis=0) + 2
+    keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+    order = np.argsort(keys, kind="stable")
+    offsets = np.array([(dx * dims[1] + dy) * dims[2] + dz
+                        for dx, dy, dz in product((-1, 0, 1), repeat=3)])
+    return keys, order, keys[order], offsets
+
+
+def neighbor_pairs(coords, radii, first, last, cell_index):
+    """Find the pairs of overlapping spheres for the atoms first to last - 1,
+    using a grid of cells at least as large as the largest diameter
+
+        Args:
+            coords: (A, 3) Numpy array of the atoms coordinates
+            radii: (A,) Numpy array of the radii (probe included)
+            first: Index of the first atom of the batch
+            last: Index after the last atom of the batch
+            cell_index: Tuple (keys, order, sorted_keys, offsets) describing the
+                        grid, from :func:`cell_grid`
+
+        Returns:
+            tuple: (atoms_i, atoms_j) Numpy arrays of the pairs, sorted by atoms_i
+    """
+    keys, order, sorted_keys, offsets = cell_index
+    atoms = np.arange(first, last)
+    neighbor_keys = keys[atoms][:, None] + offsets[None, :]
+    lower = np.searchsorted(sorted_keys, neighbor_keys, side="left").ravel()
+    counts = np.searchsorted(sorted_keys, neighbor_keys, side="right").ravel() - lower
+    # Expand the [lower, upper[ ranges of sorted atoms into pairs
+    atoms_i = np.repeat(np.repeat(atoms, len(offsets)), counts)
+    ends = np.cumsum(counts)
+    positions = np.arange(ends[-1] if len(ends) else 0) + np.repeat(lower - ends + counts, counts)
+    atoms_j = order[positions]
+    delta = coords[atoms_i] - coords[atoms_j]
+    overlap = (np.einsum('ij,ij->i', delta, delta) < (radii[atoms_i] + radii[atoms_j])**2) \
+        & (atoms_i != atoms_j)
+    return atoms_i[overlap], atoms_j[overlap]
+
+
+def atoms_sasa(coords, radii, probe_radius=1.4, n_points=100, batch_size=512):
+    """Shrake-Rupley algorithm: every atom is covered with test points, and
+    the accessible area is proportional to the number of points which are
+    not buried in a neighbor atom. The neighbors are found with a spatial
+    grid, and the points of a batch of atoms are tested against all their
+    neighbors in one matrix product.
+
+        Args:
+            coords: (A, 3) Numpy array of the atoms coordinates
+            radii: (A,) Numpy array of the Van der Waals radii
+            probe_radius: Radius of the solvant probe, in angströms
+            n_points: Number of test points per atom
+            batch_size: Number of atoms processed at once
+
+        Returns:
+            Numpy array: (A,) solvant accessible area of every atom, in angströms²
+    """
+    coords = np.asarray(coords, dtype=float)
+    radii = np.asarray(radii, dtype=float) + probe_radius
+    nb_atoms = len(coords)
+    if nb_atoms == 0:
+        return np.zeros(0)
+    unit_points = sphere.generate_points_on_sphere(n_points, hemisphere=False)
+    cell_index = cell_grid(coords, radii)
+
+    nb_exposed = np.full(nb_atoms, n_points)
+    for first in range(0, nb_atoms, batch_size):
+        last = min(first + batch_size, nb_atoms)
+        atoms_i, atoms_j = neighbor_pairs(coords, radii, first, last, cell_index)
+        if not len(atoms_i):
+            continue
+        # The point c_i + r_i * u is buried in the atom j if
+        # |d|² + r_i² + 2 * r_i * u.d < r_j² with d = c_i - c_j
+        delta = coords[atoms_i] - coords[atoms_j]
+        r_i = radii[atoms_i]
+        bound = (radii[atoms_j]**2 - r_i**2 - np.einsum('ij,ij->i', delta, delta)) / (2 * r_i)
+        buried = (delta @ unit_points.T) < bound[:, None]
+        # Pairs are sorted by atom i: merge the buried points of each atom
+        atoms, starts = np.unique(atoms_i, return_index=True)
+        buried = np.logical_or.reduceat(buried, starts, axis=0)
+        nb_exposed[atoms] = n_points - buried.sum(axis=1)
+    return 4 * np.pi * radii**2 * nb_exposed / n_points
+
+
+def shrake_rupley(atoms, probe_radius=1.4, n_points=100):
+    """Relative solvant accessibility of the residues of a structure,
+    computed in-process with :func:`atoms_sasa`. Like NACCESS, the hydrogens,
+    the waters and the hetero residues are ignored.
+
+        Args:
+            atoms: :class:`src.loader.Atoms` of the model
+            probe_radius: Radius of the solvant probe, in angströms
+            n_points: Number of test points per atom
+
+        Returns:
+            dict: Keys are (chain_id, res_id) and values dictionaries with the
+                    "res_name", "all_atoms_abs" and "all_atoms_rel" values,
+                    as in Bio.PDB.NACCESS.process_rsa_data
+    """
+    atoms = atoms.select(~atoms.hetero & (atoms.elements != "H") & (atoms.elements != "D"))
+    radii = [atom_radius(name, element, res_name) for name, element, res_name
+             in zip(atoms.names, atoms.elements, atoms.res_names)]
+    atoms_area = atoms_sasa(atoms.coords, radii, probe_radius, n_points)
+    residue_index, first_atoms = atoms.residue_index()
+    residues_area = np.bincount(residue_index, weights=atoms_area, minlength=len(first_atoms))
+    rsa = {}
+    for first, area in zip(first_atoms, residues_area):
+        res_name = str(atoms.res_names[first])
+        standard = STANDARD_ACCESSIBILITY.get(res_name)
+        res_id = (" ", int(atoms.res_ids[first]), str(atoms.icodes[first]))
+        rsa[(str(atoms.chains[first]), res_id)] = {
+            "res_name": res_name,
+            "all_atoms_abs": float(area),
+            "all_atoms_rel": 100 * float(area) / standard if standard else 0.0}
+    return rsa
+
+
+def scratch_dir(temp_path=None):
+    """Directory of the scratch files of NACCESS: temp_path if given, else the
+    first writable directory of SCRATCH_DIRS, else the default temporary
+    directory (None)
+
+        Args:
+            temp_path: Directory chosen by the user, or None
+
+        Returns:
+            str: The directory, or None for the default temporary directory
+    """
+    if temp_path:
+        return temp_path
+    for path in SCRATCH_DIRS:
+        if os.path.isdir(path) and os.access(path, os.W_OK | os.X_OK):
+            return path
+    return None
+
+
+def split_chains(atoms):
+    """Split the atoms of a model per chain. The hetero residues, ignored
+    by NACCESS, are removed first so that no chain is left empty.
+
+        Args:
+            atoms: :class:`src.loader.Atoms` of the model
+
+        Returns:
+            list: :class:`src.loader.Atoms` of every chain, in the order of the file
+    """
+    atoms = atoms.select(~atoms.hetero)
+    chains, first_atoms = np.unique(atoms.chains, return_index=True)
+    return [atoms.select(atoms.chains == chain) for chain in chains[np.argsort(first_atoms)]]
+
+
+def run_naccess(atoms, naccess=None, temp_path=None):
+    """Run NACCESS on the atoms of a model, written to a temporary PDB file
+    (NACCESS ignores the hetero residues)
+
+        Args:
+            atoms: :class:`src.loader.Atoms` of the model
+            naccess: Path to the naccess binary ("naccess" in the PATH by default)
+            temp_path: Directory of the temporary files (see :func:`scratch_dir`)
+
+        Returns:
+            dict: The accessibility of the residues, as returned by
+                    Bio.PDB.NACCESS.process_rsa_data
+    """
+    # Biopython is only loaded by the NACCESS engine
+    from Bio.PDB import NACCESS
+    tmp_dir = tempfile.mkdtemp(dir=scratch_dir(temp_path))
+    try:
+        # NACCESS writes its outputs in the current directory
+        # and needs a file name ending with '.pdb'
+        with open(os.path.join(tmp_dir, "protein.pdb"), "w") as file_out:
+            loader.write_pdb_atoms(atoms.select(~atoms.hetero), file_out)
+        process = subprocess.run([naccess or "naccess", "protein.pdb"], cwd=tmp_dir,
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                 universal_newlines=True)
+        rsa_file = os.path.join(tmp_dir, "protein.rsa")
+        if not os.path.exists(rsa_file):
+            raise RuntimeError("NACCESS did not execute or finish properly: "
+                               + process.stderr.strip())
+        with open(rsa_file) as rsa_data:
+            return NACCESS.process_rsa_data(rsa_data)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def merge_rsa(futures):
+    """Future of the union of the accessibilities of several futures
+    (the chains of one structure), failing if any of them fails"""
+    merged = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        rsa = {}
+        try:
+            for future in futures:
+                rsa.update(future.result())
+        except Exception as err:
+            merged.set_exception(err)
+        else:
+            merged.set_result(rsa)
+
+    if not futures:
+        merged.set_result({})
+    for future in futures:
+        future.add_done_callback(done)
+    return merged
+
+
+class NaccessRunner:
+    """
+    .. class:: NaccessRunner
+      This class runs NACCESS in the background, with at most max_jobs
+      subprocesses at the same time. The threads only wait for the
+      subprocesses, so the scans of the calling process go on meanwhile.
+      Large assemblies can be split per chain, one NACCESS run per chain:
+      the residues of the interfaces between chains are then counted as
+      accessible.
+
+    Attributes:
+        naccess: Path to the naccess binary, or None
+        temp_path: Directory of the scratch files (see :func:`scratch_dir`)
+        per_chain: Run NACCESS once per chain
+        executor: ThreadPoolExecutor of max_jobs threads
+    """
+
+    __slots__ = ("naccess", "temp_path", "per_chain", "executor")
+
+    def __init__(self, max_jobs=None, naccess=None, temp_path=None, per_chain=False):
+        """Creates a runner of at most max_jobs (all the available cpus by default)
+        concurrent NACCESS subprocesses"""
+        self.naccess = naccess
+        self.temp_path = scratch_dir(temp_path)
+        self.per_chain = per_chain
+        self.executor = ThreadPoolExecutor(max_workers=max_jobs or parallel.available_cpus())
+
+    def submit(self, atoms):
+        """Start the accessibility calculations of a model
+
+            Args:
+                atoms: :class:`src.loader.Atoms` of the model
+
+            Returns:
+                Future: Future of the accessibility of the residues, as
+                        returned by Bio.PDB.NACCESS.process_rsa_data
+        """
+        if not self.per_chain:
+            return self.executor.submit(run_naccess, atoms, self.naccess, self.temp_path)
+        return merge_rsa([self.executor.submit(run_naccess, chain, self.naccess,
+                                               self.temp_path)
+                          for chain in split_chains(atoms)])
+
+    def close(self):
+        """Wait for the running subprocesses and stop the threads"""
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def compute_rsa(atoms, engine="naccess", naccess=None, per_chain=False, jobs=None):
+    """Relative solvant accessibility of the residues with the chosen engine
+
+        Args:
+            atoms: :class:`src.loader.Atoms` of the model
+            engine: "naccess" or "shrake-rupley"
+            naccess: Absolute path to local naccess binary
+            per_chain: Run NACCESS once per chain, the chains concurrently
+            jobs: Maximum number of concurrent NACCESS runs of the chains,
+                    all the available cpus by default
+
+        Returns:
+            dict: The accessibility of the residues, as returned by
+                    Bio.PDB.NACCESS.process_rsa_data
+    """
+    if engine == "shrake-rupley":
+        return shrake_rupley(atoms)
+    if engine != "naccess":
+        raise ValueError("Unknown accessibility engine: " + str(engine))
+    if not per_chain:
+        return run_naccess(atoms, naccess)
+    with NaccessRunner(jobs, naccess, per_chain=True) as runner:
+        return runner.submit(atoms).result()
@@ -0,0 +1,311 @@
+"""
+.. module:: api
+  :synopsis: This module is the library interface of the prediction. The
+                structure is given in memory (Bio.PDB entity, atoms arrays,
+                coordinates of the c_alphas or PDB / mmCIF text) and the result
+                is returned as a :class:`MembranePrediction`: no file is read or
+                written unless the caller asks for it. Nothing is shared between
+                the calls, so that many predictions can run concurrently in the
+                threads of one process.
+
+.. moduleauthor:: Gabriel Cretin M2 BIB
+"""
+
+import io
+import os
+import time
+
+import numpy as np
+import src.loader as loader
+import src.pdb as pdb
+import src.pipeline as pipeline
+import src.protein as protein
+import src.scales as scales
+import src.scan as scan
+import src.search as search
+import src.sphere as sphere
+from src.vector import Vector
+
+
+# One letter codes of the residues of protein.RESIDUES, for the sequences
+# of the c_alphas coordinates
+ONE_LETTER_CODES = dict(zip("ARNDCQEGHILKMFPSTWYV", protein.RESIDUES))
+
+
+class MembranePrediction:
+    """
+    .. class:: MembranePrediction
+      This class stores the result of :func:`predict_membrane`
+
+    Attributes:
+        direction: (3,) unit vector of the best line (normal of the membranes)
+        point: (3,) point of the best line, in the frame of the structure
+        center_of_mass: (3,) center of mass of the c_alphas
+        hydrophobicity: Hydrophobicity factor of the best line
+        start_slice: Index of the first slice of the membrane
+        end_slice: Index of the last slice of the membrane
+        membrane_start: Distance of the first membrane to the nearest c_alpha
+                        of the best line, in angströms
+        membrane_end: Distance of the second membrane to the nearest c_alpha
+                        of the best line, in angströms
+        planes: (2, 4) array of the equations a*x+b*y+c*z+d = 0 of both
+                membranes, in the frame of the structure
+        profile: (nb_steps,) relative hydrophobicity of the slices of the best line
+        candidates: List of the candidate orientations, best first (see
+                    :func:`src.pipeline.candidate_summary`)
+        nb_accessible_residues: Number of accessible c_alphas
+        nb_lines: Number of lines evaluated
+        scale: Name of the hydrophobicity scale
+        timings: Dictionary of the runtimes of the steps, in seconds
+        best_results: The best line, as returned by
+                        :func:`src.protein.get_best_results`
+        resolution: Number in angströms setting the step of sliding.
+    """
+
+    __slots__ = ("direction", "point", "center_of_mass", "hydrophobicity", "start_slice",
+                 "end_slice", "membrane_start", "membrane_end", "planes", "profile",
+                 "candidates", "nb_accessible_residues", "nb_lines", "scale", "timings",
+                 "best_results", "resolution")
+
+    def __init__(self, prot, center_of_mass, candidates, profile, resolution, nb_lines,
+                 scale, timings):
+        """Creates the prediction from the candidates of a centered protein"""
+        best_results = candidates[0]
+        normal = best_results[0][0]
+        normal = np.array([normal.x, normal.y, normal.z], dtype=float)
+        self.direction = normal / np.linalg.norm(normal)
+        self.center_of_mass = np.array([center_of_mass.x, center_of_mass.y,
+                                        center_of_mass.z], dtype=float)
+        self.point = normal + self.center_of_mass
+        self.hydrophobicity = float(best_results[0][1])
+        self.start_slice = int(best_results[1])
+        self.end_slice = int(best_results[2])
+        dist_m1, dist_m2 = protein.membrane_bounds(best_results, resolution)
+        self.membrane_start = float(dist_m1)
+        self.membrane_end = float(dist_m2)
+        # The c_alphas are at PLANE_DISTANCE - distance to the far plane along the
+        # direction, from the center of mass
+        offsets = scan.PLANE_DISTANCE - best_results[5] - np.array([dist_m1, dist_m2])
+        self.planes = np.empty((2, 4))
+        self.planes[:, :3] = self.direction
+        self.planes[:, 3] = -(offsets + self.direction.dot(self.center_of_mass))
+        self.profile = profile
+        self.candidates = [pipeline.candidate_summary(candidate, center_of_mass, resolution)
+                           for candidate in candidates]
+        self.nb_accessible_residues = len(prot)
+        self.nb_lines = nb_lines
+        self.scale = scale
+        self.timings = timings
+        self.best_results = best_results
+        self.resolution = resolution
+
+    def __repr__(self):
+        return "MembranePrediction(direction=({:.3f}, {:.3f}, {:.3f}), hydrophobicity={:.4f}, " \
+               "membranes={:.1f}-{:.1f})".format(*self.direction, self.hydrophobicity,
+                                                 self.membrane_start, self.membrane_end)
+
+    def as_record(self):
+        """The prediction as a dictionary of JSON serializable values, with
+        the keys of :func:`src.pipeline.result_record`"""
+        return {"status": "ok",
+                "nb_accessible_residues": self.nb_accessible_residues,
+                "direction": self.direction.tolist(),
+                "point": self.point.tolist(),
+                "center_of_mass": self.center_of_mass.tolist(),
+                "hydrophobicity": self.hydrophobicity,
+                "start_slice": self.start_slice,
+                "end_slice": self.end_slice,
+                "nb_steps": len(self.profile),
+                "membrane_start": self.membrane_start,
+                "membrane_end": self.membrane_end,
+                "planes": self.planes.tolist(),
+                "profile": self.profile.tolist(),
+                "candidates": self.candidates,
+                "nb_lines": self.nb_lines,
+                "scale": self.scale,
+                "timings": dict(self.timings)}
+
+    def membrane_points(self):
+        """Points simulating both membranes (see :func:`src.protein.generate_membranes`)
+
+            Returns:
+                tuple: points_membrane_1, points_membrane_2
+        """
+        return protein.generate_membranes(None, self.best_results, self.resolution)
+
+    def pdb_records(self):
+        """HETATM records of the DUM atoms of both membranes, to append to
+        the structure (see :func:`src.pdb.membrane_records`)"""
+        return pdb.membrane_records(*self.membrane_points())
+
+    def write(self, pdb_file, new_pdb_file=None, pml_file=None, compress=None):
+        """Write the PDB file with the membranes and the PyMol script, as
+        the command line does (see :func:`src.pdb.write_pdb`)
+
+            Args:
+                pdb_file: Path to the original pdb_file
+                new_pdb_file: Path or binary file object of the new PDB file,
+                                <pdb_file without extension>_new.pdb by default
+                pml_file: Path or text file object of the PyMol script,
+                            next to the new PDB file by default
+                compress: Compress the new PDB file with gzip, by default if
+                            its path ends with ".gz"
+
+            Returns:
+                tuple: (new PDB file, PyMol script)
+        """
+        if new_pdb_file is None:
+            new_pdb_file, pml_path = pdb.output_paths(pdb_file)
+            pml_file = pml_path if pml_file is None else pml_file
+        new_pdb_file = pdb.write_pdb(pdb_file, *self.membrane_points(), new_pdb_file, compress)
+        # The script loads the new PDB file: a file object has no name to load
+        loaded = new_pdb_file if isinstance(new_pdb_file, (str, os.PathLike)) else pdb_file
+        pml_file = pdb.write_pml_script(Vector(*self.point), loaded, pml_file)
+        return new_pdb_file, pml_file
+
+
+def atoms_from_entity(entity, model=0):
+    """Atoms of a Bio.PDB entity (Structure, Model, Chain or Residue)
+
+        Args:
+            entity: The Bio.PDB entity
+            model: Index of the model of a Structure
+
+        Returns:
+            :class:`src.loader.Atoms`: The atoms of the entity
+    """
+    if entity.get_level() == "S":
+        entity = list(entity)[model]
+    rows = []
+    for atom in entity.get_atoms():
+        residue = atom.get_parent()
+        hetero_flag, res_id, icode = residue.get_id()
+        rows.append((atom.get_coord(), atom.get_id(), atom.element, residue.get_resname(),
+                     residue.get_parent().get_id(), res_id, icode, hetero_flag != " "))
+    if not rows:
+        raise ValueError("No atoms found in the structure")
+    return loader.Atoms(*zip(*rows))
+
+
+def to_atoms(structure, model=0):
+    """Atoms of a structure given in memory
+
+        Args:
+            structure: :class:`src.loader.Atoms`, a Bio.PDB entity, the text of
+                        a PDB or mmCIF file (str or bytes, plain or compressed),
+                        a file object, or the path to a structure file
+            model: Index of the model
+
+        Returns:
+            :class:`src.loader.Atoms`: The atoms of the model
+    """
+    if isinstance(structure, loader.Atoms):
+        return structure
+    if hasattr(structure, "get_atoms"):
+        return atoms_from_entity(structure, model)
+    if isinstance(structure, str) and "\n" in structure:
+        structure = io.StringIO(structure)
+    elif isinstance(structure, (bytes, bytearray, memoryview)):
+        structure = io.BytesIO(structure)
+    return loader.load_structure(structure, model)
+
+
+def protein_from_coords(coords, residues, accessibility=None):
+    """Protein of c_alphas given as coordinates, without the other atoms:
+    the accessibility can not be computed, and is given by the caller
+
+        Args:
+            coords: (N, 3) coordinates of the c_alphas
+            residues: The N residues, as a list of 3 letters codes or as a
+                        string of 1 letter codes
+            accessibility: (N,) relative accessibility (%) of the residues,
+                            or None to keep all of them
+
+        Returns:
+            tuple: (Protein of the accessible c_alphas, center_of_mass)
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+    if residues is None or len(residues) != len(coords):
+        raise ValueError("The residues of the {} c_alphas are expected".format(len(coords)))
+    if isinstance(residues, str):
+        residues = [ONE_LETTER_CODES.get(code, "UNK") for code in residues.upper()]
+    center_of_mass = protein.get_com(*coords.sum(axis=0), len(coords))
+    if accessibility is None:
+        accessibility = np.full(len(coords), 100.0)
+    accessibility = np.asarray(accessibility, dtype=float)
+    accessible = accessibility >= protein.ACCESSIBILITY_THRESHOLD
+    prot = protein.Protein(coords[accessible],
+                           [protein.RESIDUE_CODES.get(res_name, protein.UNKNOWN_RESIDUE)
+                            for res_name, keep in zip(residues, accessible) if keep],
+                           np.full(accessible.sum(), "A"),
+                           np.arange(1, len(coords) + 1)[accessible],
+                           accessibility[accessible])
+    return prot, center_of_mass
+
+
+def predict_membrane(structure, thickness=15, resolution=5, nb_points=250,
+                     scale=scales.DEFAULT_SCALE, sasa_engine="shrake-rupley", naccess=None,
+                     adaptive=False, precision=1.0, nb_candidates=1, residues=None,
+                     accessibility=None, model=0):
+    """Predict the membrane of a structure given in memory. The scan is serial
+    and reads or writes no file (with the built-in Shrake-Rupley engine):
+    call :meth:`MembranePrediction.write` to write the outputs.
+
+        Args:
+            structure: The structure (see :func:`to_atoms`), or a (N, 3)
+                        array of the coordinates of its c_alphas
+            thickness: Number for the desired thickness of the slices, in angströms
+            resolution: Number in angströms setting the step of sliding.
+            nb_points: Number of points on the hemisphere
+            scale: Hydrophobicity scale (see :func:`src.scales.get_scale`)
+            sasa_engine: "shrake-rupley" or "naccess" (which runs in a
+                            temporary directory)
+            naccess: Absolute path to local naccess binary, or None
+            adaptive: Use the coarse-to-fine search (:mod:`src.search`),
+                        nb_points being the number of points of the coarse scan
+            precision: Angular precision of the adaptive search, in degrees
+            nb_candidates: Number of distinct candidate orientations
+            residues: Residues of the c_alphas coordinates (see
+                        :func:`protein_from_coords`)
+            accessibility: Relative accessibility (%) of the residues of the
+                            c_alphas coordinates, or None to keep all of them
+            model: Index of the model of a multi-model structure
+
+        Returns:
+            MembranePrediction: The prediction
+    """
+    start_time = time.perf_counter()
+    timings = {}
+    scale = scales.get_scale(scale)
+    if isinstance(structure, (np.ndarray, list, tuple)):
+        prot, center_of_mass = protein_from_coords(structure, residues, accessibility)
+    else:
+        atoms = to_atoms(structure, model)
+        timings["parse"] = time.perf_counter() - start_time
+        prot, center_of_mass = pipeline.protein_from_atoms(atoms, sasa_engine, naccess)
+        timings["accessibility"] = time.perf_counter() - start_time - timings["parse"]
+    if not len(prot):
+        raise ValueError("No accessible c_alpha in the structure")
+    prot = protein.scale_ca_coords(prot, center_of_mass)
+
+    scan_time = time.perf_counter()
+    if adaptive:
+        candidates, nb_lines = search.adaptive_search(prot, thickness, resolution, nb_points,
+                                                      precision, nb_candidates=nb_candidates,
+                                                      scale=scale)
+    else:
+        sphere_points = sphere.generate_points_on_sphere(nb_points)
+        candidates = protein.get_candidates(
+            pipeline.scan_protein(prot, thickness, resolution, sphere_points, nb_candidates,
+                                  scale), nb_candidates)
+        nb_lines = nb_points
+    # The reducers only keep the best lines: the profile of the best one is
+    # computed again, from its point on the hemisphere
+    normal = candidates[0][0][0]
+    best_point = np.array([[normal.x, normal.y, normal.z]]) / scan.PLANE_DISTANCE
+    profile = np.ravel(scan.scan_lines(prot, thickness, resolution, best_point,
+                                       scale)[0]["slice_hydro"])
+    timings["scan"] = time.perf_counter() - scan_time
+    timings["total"] = time.perf_counter() - start_time
+    return MembranePrediction(prot, center_of_mass, candidates, profile, resolution, nb_lines,
+                              scale.name, timings)
@@ -0,0 +1,260 @@
+"""
+.. module:: batch
+  :synopsis: This module processes many PDB files with one persistent pool of
+                workers. Each worker processes a whole protein, the largest
+                files are scheduled first, and one result record per protein is
+                streamed to a JSON Lines or CSV file as soon as it is finished.
+                With NACCESS, the accessibility of the next structures can be
+                computed in the background while the workers scan the
+                previous ones.
+
+.. moduleauthor:: Gabriel Cretin M2 BIB
+"""
+
+from collections import deque
+from multiprocessing import Pool
+from functools import partial
+import csv
+import glob
+import json
+import os
+import sys
+import traceback
+
+import src.accessibility as accessibility
+import src.cache as cache
+import src.loader as loader
+import src.parallel as parallel
+import src.pipeline as pipeline
+import src.protein as protein
+
+
+# Extensions of the structure files searched in a directory
+EXTENSIONS = tuple(extension + compression
+                   for extension in loader.PDB_EXTENSIONS + loader.CIF_EXTENSIONS
+                   for compression in ("",) + loader.COMPRESSED_EXTENSIONS)
+
+CSV_FIELDS = ["file", "status", "nb_accessible_residues", "point_x", "point_y", "point_z",
+              "center_of_mass_x", "center_of_mass_y", "center_of_mass_z",
+              "hydrophobicity", "start_slice", "end_slice", "nb_steps", "nb_lines", "scale",
+              "runtime", "ambiguity", "error"]
+# Columns added by the parameter sweep
+SWEEP_FIELDS = CSV_FIELDS[:-2] + ["thickness", "resolution", "membrane_start", "membrane_end"]
+
+
+def list_structures(source):
+    """List the structure files of a batch
+
+        Args:
+            source: A directory, a glob pattern, a structure file or a manifest
+                    (text file with one path per line, relative to the manifest)
+
+        Returns:
+            list: Paths of the structure files
+    """
+    if os.path.isdir(source):
+        return sorted(os.path.join(source, name) for name in os.listdir(source)
+                      if name.lower().endswith(EXTENSIONS))
+    if glob.has_magic(source):
+        return sorted(path for path in glob.glob(source) if os.path.isfile(path))
+    if source.lower().endswith(EXTENSIONS):
+        return [source]
+    base_dir = os.path.dirname(source)
+    with open(source) as manifest:
+        return [os.path.join(base_dir, line.strip()) for line in manifest
+                if line.strip() and not line.startswith("#")]
+
+
+def schedule(pdb_files):
+    """Order the files from the largest to the smallest so that the big
+    structures do not end the batch on a single busy worker
+
+        Args:
+            pdb_files: Paths of the structure files
+
+        Returns:
+            list: The same paths, largest first
+    """
+    def size(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+    return sorted(pdb_files, key=size, reverse=True)
+
+
+def error_message(err):
+    """One line description of an exception"""
+    return "".join(traceback.format_exception_only(type(err), err)).strip()
+
+
+def prefetch_accessibility(pdb_files, runner, depth, sasa_engine="naccess", cache_dir=None,
+                           per_chain=False, **_):
+    """Compute the accessibility of the structures in the background, at most
+    depth structures ahead of the ones handed to the workers: the NACCESS
+    runs of the next structures overlap with the scans of the previous ones.
+    The structures already in the cache are not computed again, and the
+    parsed structures are handed to the workers, which do not parse them again.
+
+        Args:
+            pdb_files: Paths of the structure files, in the order of processing
+            runner: :class:`src.accessibility.NaccessRunner`
+            depth: Number of structures submitted ahead
+            sasa_engine: "naccess" or "shrake-rupley"
+            cache_dir: Directory of the cache, or None
+            per_chain: The runner splits the structures per chain
+            _: The other parameters of :func:`src.pipeline.predict`, ignored
+
+        Yields:
+            tuple: (pdb_file, atoms or None, accessible residues or None,
+                    error message or None)
+    """
+    def submit(pdb_file):
+        try:
+            if cache_dir and os.path.exists(cache.entry_path(
+                    cache_dir, pipeline.protein_cache_key(pdb_file, sasa_engine, per_chain))):
+                return pdb_file, None, None
+            atoms = loader.load_structure(pdb_file)
+            return pdb_file, atoms, runner.submit(atoms)
+        except Exception:
+            # The worker reports the error of the structure
+            return pdb_file, None, None
+
+    pdb_files = iter(pdb_files)
+    pending = deque(submit(pdb_file) for _, pdb_file in zip(range(depth), pdb_files))
+    while pending:
+        pdb_file, atoms, future = pending.popleft()
+        for next_file in pdb_files:
+            pending.append(submit(next_file))
+            break
+        if future is None:
+            yield pdb_file, None, None, None
+            continue
+        try:
+            yield pdb_file, atoms, protein.keep_accessible_residues(future.result()), None
+        except Exception as err:
+            yield pdb_file, None, None, error_message(err)
+
+
+def process_structure(parameters, task):
+    """Worker function: a failure is returned as an error record and never
+    stops the batch
+
+        Args:
+            parameters: Keyword arguments of :func:`src.pipeline.predict`
+            task: Tuple (pdb_file, atoms or None, accessible residues or None,
+                    error message or None) of :func:`prefetch_accessibility`
+
+        Returns:
+            dict: The result record of the protein
+    """
+    pdb_file, atoms, accessible_residues, error = task
+    if error:
+        return {"file": pdb_file, "status": "error", "error": error}
+    try:
+        return pipeline.predict(pdb_file, accessible_residues=accessible_residues, atoms=atoms,
+                                **parameters)
+    except (Exception, SystemExit) as err:
+        return {"file": pdb_file, "status": "error", "error": error_message(err)}
+
+
+def flatten(record):
+    """Flatten the coordinates of a result record for the CSV output
+    (the candidates and the other scales are only written in JSON Lines)"""
+    row = dict(record)
+    row.pop("candidates", None)
+    row.pop("scales", None)
+    for name in ("point", "center_of_mass", "direction"):
+        if name in row:
+            for axis, value in zip("xyz", row.pop(name)):
+                row[name + "_" + axis] = value
+    return row
+
+
+def record_writer(file_out, output_format="jsonl", fields=CSV_FIELDS):
+    """Function writing one record at a time, flushed so that the
+    records can be read while the run goes on
+
+        Args:
+            file_out: Text file object
+            output_format: "jsonl" or "csv" (the header is written at once)
+            fields: Columns of the CSV output
+
+        Returns:
+            function: write(record)
+    """
+    if output_format == "csv":
+        writer = csv.DictWriter(file_out, fieldnames=fields)
+        writer.writeheader()
+
+    def write(record):
+        if output_format == "csv":
+            writer.writerow(flatten(record))
+        else:
+            file_out.write(json.dumps(record) + "\n")
+        file_out.flush()
+    return write
+
+
+def run_batch(pdb_files, output, output_format="jsonl", processes=None, naccess_jobs=None,
+              **parameters):
+    """Process the structures with a persistent pool and stream the records
+
+        Args:
+            pdb_files: Paths of the structure files
+            output: Path of the output file, or "-" for the standard output
+            output_format: "jsonl" or "csv"
+            processes: Number of workers, all the available cpus by default
+            naccess_jobs: With NACCESS, number of concurrent NACCESS runs of the
+                            background accessibility stage, or None to run
+                            NACCESS in the workers
+            parameters: Keyword arguments of :func:`src.pipeline.predict`
+
+        Returns:
+            tuple: (number of successes, number of failures)
+    """
+    file_out = sys.stdout if output == "-" else open(output, "w", newline="")
+    write = record_writer(file_out, output_format)
+    nb_ok = nb_errors = 0
+    runner = None
+    if naccess_jobs and parameters.get("sasa_engine", "naccess") == "naccess":
+        runner = accessibility.NaccessRunner(naccess_jobs, parameters.get("naccess"),
+                                             per_chain=parameters.get("per_chain", False))
+        tasks = prefetch_accessibility(schedule(pdb_files), runner, 2 * naccess_jobs,
+                                       **parameters)
+    else:
+        tasks = ((pdb_file, None, None, None) for pdb_file in schedule(pdb_files))
+    try:
+        with Pool(processes=processes or parallel.available_cpus()) as pool:
+            func = partial(process_structure, parameters)
+            for record in pool.imap_unordered(func, tasks):
+                write(record)
+                if record["status"] == "ok":
+                    nb_ok += 1
+                else:
+                    nb_errors += 1
+    finally:
+        if runner is not None:
+            runner.close()
+        if file_out is not sys.stdout:
+            file_out.close()
+    return nb_ok, nb_errors
+
+
+def write_records(records, output, output_format="jsonl", fields=CSV_FIELDS):
+    """Write result records at once (parameter sweep)
+
+        Args:
+            records: List of result records
+            output: Path of the output file, or "-" for the standard output
+            output_format: "jsonl" or "csv"
+            fields: Columns of the CSV output
+    """
+    file_out = sys.stdout if output == "-" else open(output, "w", newline="")
+    try:
+        write = record_writer(file_out, output_format, fields)
+        for record in records:
+            write(record)
+    finally:
+        if file_out is not sys.stdout:
+            file_out.close()
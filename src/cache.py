@@ -0,0 +1,122 @@
+"""
+.. module:: cache
+  :synopsis: This module implements an on-disk cache of the accessible residues
+                of the proteins. The entries are keyed by the content of the PDB
+                file and the accessibility parameters, stored as uncompressed
+                .npz files and evicted in least recently used order.
+
+.. moduleauthor:: Gabriel Cretin M2 BIB
+"""
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+from src.protein import Protein
+from src.vector import Vector
+
+
+# Bumped when the content of the entries changes
+CACHE_VERSION = 1
+EXTENSION = ".npz"
+# Suffix of the entries being written, never evicted
+TMP_EXTENSION = EXTENSION + ".tmp"
+
+
+def cache_key(pdb_file, **parameters):
+    """Content-addressed key of a PDB file and the parameters of the
+    accessibility calculations
+
+        Args:
+            pdb_file: Path to the pdb_file
+            parameters: Parameters changing the accessible residues
+                            (engine, threshold, ...)
+
+        Returns:
+            str: Hexadecimal sha256 digest
+    """
+    digest = hashlib.sha256()
+    with open(pdb_file, "rb") as file_in:
+        for chunk in iter(lambda: file_in.read(1 << 20), b""):
+            digest.update(chunk)
+    digest.update(repr((CACHE_VERSION, sorted(parameters.items()))).encode())
+    return digest.hexdigest()
+
+
+def entry_path(cache_dir, key):
+    """Path of the file of a cache entry"""
+    return os.path.join(cache_dir, key + EXTENSION)
+
+
+def load(cache_dir, key):
+    """Load a cached protein. A hit refreshes the entry for the LRU eviction.
+
+        Args:
+            cache_dir: Directory of the cache
+            key: Key of the entry, from :func:`cache_key`
+
+        Returns:
+            tuple: (Protein, center_of_mass) or None if the entry is missing
+    """
+    path = entry_path(cache_dir, key)
+    try:
+        with np.load(path) as entry:
+            prot = Protein(entry["coords"], entry["res_codes"], entry["chains"],
+                           entry["res_ids"], entry["accessibility"])
+            center_of_mass = Vector(*entry["center_of_mass"])
+        os.utime(path)
+    except (OSError, KeyError, ValueError):
+        return None
+    return prot, center_of_mass
+
+
+def store(cache_dir, key, prot, center_of_mass, max_size):
+    """Store a protein in the cache, then evict the least recently used
+    entries until the cache fits in max_size bytes
+
+        Args:
+            cache_dir: Directory of the cache
+            key: Key of the entry, from :func:`cache_key`
+            prot: Protein of the accessible residues (not centered)
+            center_of_mass: Protein's center of mass
+            max_size: Maximum size of the cache, in bytes
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write in a temporary file first: concurrent runs never read half an entry,
+    # and never evict it (its suffix is not EXTENSION)
+    descriptor, tmp_path = tempfile.mkstemp(suffix=TMP_EXTENSION, dir=cache_dir)
+    try:
+        with os.fdopen(descriptor, "wb") as file_out:
+            np.savez(file_out, coords=prot.coords, res_codes=prot.res_codes,
+                     chains=prot.chains, res_ids=prot.res_ids,
+                     accessibility=prot.accessibility,
+                     center_of_mass=[center_of_mass.x, center_of_mass.y, center_of_mass.z])
+        os.replace(tmp_path, entry_path(cache_dir, key))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    evict(cache_dir, max_size)
+
+
+def evict(cache_dir, max_size):
+    """Remove the least recently used entries until the cache fits in max_size bytes
+
+        Args:
+            cache_dir: Directory of the cache
+            max_size: Maximum size of the cache, in bytes
+    """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(EXTENSION) and entry.is_file():
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
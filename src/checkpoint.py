@@ -0,0 +1,174 @@
+"""
+.. module:: checkpoint
+  :synopsis: This module saves the scan of the lines of one protein as it
+                goes: the best lines of every finished range of lines are
+                appended to a checkpoint file keyed by the protein and the
+                parameters of the scan. A killed run restarted with the same
+                parameters only scans the unfinished ranges, and gives the same
+                lines as a run which was never interrupted.
+
+.. moduleauthor:: Gabriel Cretin M2 BIB
+"""
+
+import hashlib
+import os
+import pickle
+
+import numpy as np
+import src.executors as executors
+import src.parallel as parallel
+from src.protein import TopLines
+
+
+# Bumped when the content of the checkpoints changes
+CHECKPOINT_VERSION = 2
+EXTENSION = ".ckpt"
+# Number of lines of a range of a checkpointed scan, without --chunk-size
+CHECKPOINT_LINES = 1000
+
+
+def checkpoint_key(prot, thickness, resolution, sphere_points, scale_list, nb_candidates,
+                   ranges):
+    """Key of the scan of a protein: hash of the arrays of the protein, of the
+    lines and of the parameters changing the best lines
+
+        Args:
+            prot: Protein centered on its center of mass
+            thickness: Number for the desired thickness of the slices, in angströms
+            resolution: Number in angströms setting the step of sliding.
+            sphere_points: (M, 3) Numpy array of points of the hemisphere
+            scale_list: List of :class:`src.scales.Scale`
+            nb_candidates: Number of distinct lines kept per scale
+            ranges: List of the (first, last) ranges of lines
+
+        Returns:
+            str: Hexadecimal sha256 digest
+    """
+    digest = hashlib.sha256()
+    for array in (prot.coords, prot.res_codes, prot.accessibility,
+                  np.ascontiguousarray(sphere_points, dtype=float)):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    for scale in scale_list:
+        digest.update(scale.table.tobytes())
+    digest.update(repr((CHECKPOINT_VERSION, float(thickness), float(resolution), nb_candidates,
+                        [(scale.name, scale.distinct) for scale in scale_list],
+                        ranges)).encode())
+    return digest.hexdigest()
+
+
+class Checkpoint:
+    """
+    .. class:: Checkpoint
+      This class appends the best lines of the finished ranges of a scan to
+      a checkpoint file, one pickled record (first, last, pool of the best
+      lines of every scale, see :class:`src.protein.TopLines`) per range.
+      The records are written in the order of the ranges: the finished
+      ranges are always the first ones. The records are pickled: the
+      checkpoint directory must be trusted.
+
+    Attributes:
+        path: Path of the checkpoint file
+        done: List of the records of the finished ranges
+        file_out: Binary file object of the checkpoint, opened for appending
+    """
+
+    __slots__ = ("path", "done", "file_out")
+
+    def __init__(self, checkpoint_dir, key, ranges):
+        """Open the checkpoint of key, and read the finished ranges.
+        A record cut by a killed run is dropped."""
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.path = os.path.join(checkpoint_dir, key + EXTENSION)
+        self.done = []
+        self.file_out = open(self.path, "a+b")
+        self.file_out.seek(0)
+        end = 0
+        try:
+            while len(self.done) < len(ranges):
+                first, last, lines = pickle.load(self.file_out)
+                if (first, last) != ranges[len(self.done)]:
+                    break
+                self.done.append((first, last, lines))
+                end = self.file_out.tell()
+        except (EOFError, pickle.UnpicklingError, ValueError, TypeError, AttributeError):
+            pass
+        self.file_out.truncate(end)
+        self.file_out.seek(end)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file_out.close()
+
+    def save(self, first, last, lines):
+        """Append the best lines of a finished range, on disk before returning
+
+            Args:
+                first: Index of the first line of the range
+                last: Index of the last line of the range + 1
+                lines: For every scale, the pool of the best lines of the range
+        """
+        pickle.dump((first, last, lines), self.file_out, pickle.HIGHEST_PROTOCOL)
+        self.file_out.flush()
+        os.fsync(self.file_out.fileno())
+        self.done.append((first, last, lines))
+
+    def remove(self):
+        """Remove the checkpoint file of a finished scan"""
+        self.file_out.close()
+        os.remove(self.path)
+
+
+def checkpointed_scan(prot, thickness, resolution, sphere_points, scale_list, checkpoint_dir,
+                      nb_candidates=1, backend="auto", jobs=None, chunk_size=None, keep=False):
+    """Scan all the lines of the hemisphere by ranges of lines, saving the best
+    lines of every finished range (see :func:`src.executors.scan_scales`).
+    The ranges already saved by a previous run are not scanned again, and the
+    lines are merged in the order of the ranges, as if the scan had not
+    been interrupted.
+
+        Args:
+            prot: Protein centered on its center of mass
+            thickness: Number for the desired thickness of the slices, in angströms
+            resolution: Number in angströms setting the step of sliding.
+            sphere_points: (M, 3) Numpy array of points of the hemisphere
+            scale_list: List of :class:`src.scales.Scale`
+            checkpoint_dir: Directory of the checkpoint files
+            nb_candidates: Number of distinct lines kept per scale
+            backend: Backend scanning the unfinished ranges
+            jobs: Number of workers, all the available cpus by default
+            chunk_size: Number of lines of a range, CHECKPOINT_LINES by default
+            keep: Keep the checkpoint file once the scan is finished
+
+        Returns:
+            tuple: (for every scale, one block of the best lines, as expected
+                    by :func:`src.protein.get_candidates`, number of lines
+                    read from the checkpoint)
+    """
+    ranges = parallel.line_ranges(len(sphere_points), 1, chunk_size or CHECKPOINT_LINES)
+    key = checkpoint_key(prot, thickness, resolution, sphere_points, scale_list,
+                         nb_candidates, ranges)
+    reducers = [TopLines(nb_candidates) for _ in scale_list]
+
+    def merge(first, last, lines):
+        for reducer, scale_lines in zip(reducers, lines):
+            reducer.extend(scale_lines)
+
+    with Checkpoint(checkpoint_dir, key, ranges) as checkpoint:
+        for record in checkpoint.done:
+            merge(*record)
+        nb_resumed = sum(last - first for first, last, _ in checkpoint.done)
+        pending = ranges[len(checkpoint.done):]
+        if pending:
+
+            def finished(first, last, lines):
+                checkpoint.save(first, last, lines)
+                merge(first, last, lines)
+
+            executors.scan_scales(prot, thickness, resolution, sphere_points, scale_list,
+                                  nb_candidates, backend, jobs, ranges=pending,
+                                  on_range=finished)
+        if not keep:
+            checkpoint.remove()
+    return [[reducer.lines] for reducer in reducers], nb_resumed
@@ -0,0 +1,433 @@
+"""
+.. module:: daemon
+  :synopsis: This module runs the prediction as a long-running local service.
+                The jobs are submitted over localhost HTTP or a Unix socket,
+                as a path or as the uploaded bytes of a structure, and are
+                processed by warm worker processes which keep the modules and
+                the last loaded proteins in memory. The queue of the jobs is
+                bounded (a full queue rejects the new jobs), and a job running
+                longer than its timeout is stopped by replacing its worker.
+
+.. moduleauthor:: Gabriel Cretin M2 BIB
+"""
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Pipe, Process
+from urllib.parse import parse_qsl, urlsplit
+import base64
+import binascii
+import hashlib
+import io
+import json
+import math
+import os
+import queue
+import signal
+import socketserver
+import threading
+
+import src.batch as batch
+import src.options as options
+import src.parallel as parallel
+import src.pipeline as pipeline
+import src.protein as protein
+
+
+HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# Number of proteins kept loaded by every worker
+MEMORY_CACHE_SIZE = 32
+# Largest structure accepted, in bytes
+MAX_UPLOAD = 256 * 1024**2
+
+# Parameters of a job: (keyword of src.pipeline.predict_protein, type, option checked)
+JOB_PARAMETERS = {"points": ("nb_points", int, "--points"),
+                  "slice": ("thickness", float, "--slice"),
+                  "resolution": ("resolution", float, "--resolution"),
+                  "precision": ("precision", float, "--precision"),
+                  "candidates": ("nb_candidates", int, "--candidates"),
+                  "adaptive": ("adaptive", bool, None),
+                  "scale": ("scale", str, "--scale")}
+
+
+def parse_job(request, data=None):
+    """Check a job request and build the job sent to a worker
+
+        Args:
+            request: Dictionary with "file" (path of a structure), "pdb" (text
+                        of a structure) or "pdb_base64" (bytes of a structure,
+                        plain or compressed), the parameters of JOB_PARAMETERS,
+                        and optionally "name" and "timeout" (seconds)
+            data: Bytes of an uploaded structure, replacing "pdb"
+
+        Returns:
+            dict: The job ("name", "file" or "data", "parameters", "timeout")
+
+        Raises:
+            ValueError: If the request is invalid
+    """
+    job = {"parameters": {}, "timeout": request.get("timeout")}
+    if data is None and "pdb" in request:
+        data = str(request["pdb"]).encode()
+    elif data is None and "pdb_base64" in request:
+        data = base64.b64decode(request["pdb_base64"])
+    if data is not None:
+        job["data"] = data
+        job["name"] = str(request.get("name", "upload"))
+    elif "file" in request:
+        job["file"] = os.path.abspath(str(request["file"]))
+        if not os.path.isfile(job["file"]):
+            raise ValueError("No such file: " + job["file"])
+        job["name"] = str(request.get("name", request["file"]))
+    else:
+        raise ValueError('The job needs a "file", "pdb" or "pdb_base64" structure')
+    for key, value in request.items():
+        if key not in JOB_PARAMETERS:
+            continue
+        name, kind, option = JOB_PARAMETERS[key]
+        if option == "--scale":
+            error = options.check_scale(value)
+        else:
+            error = options.check_number(option, value) if option else None
+        if error:
+            raise ValueError(error)
+        if kind is bool:
+            value = value if isinstance(value, bool) else str(value).lower() in ("1", "true", "yes")
+        job["parameters"][name] = kind(value)
+    if job["timeout"] is not None:
+        error = options.check_number("--timeout", job["timeout"])
+        if error:
+            raise ValueError(error)
+        job["timeout"] = float(job["timeout"])
+    return job
+
+
+def load_job_protein(job, settings, proteins):
+    """Protein of a job, centered, from the memory cache of the worker
+    or loaded (see :func:`src.pipeline.load_protein`)
+
+        Args:
+            job: Job of :func:`parse_job`
+            settings: Keyword arguments of the accessibility (sasa_engine,
+                        naccess, cache_dir, cache_size, per_chain)
+            proteins: OrderedDict of the proteins loaded by the worker, the
+                        most recently used last
+
+        Returns:
+            tuple: (Protein, center_of_mass)
+    """
+    if "data" in job:
+        key = ("data", hashlib.sha256(job["data"]).hexdigest())
+    else:
+        stat = os.stat(job["file"])
+        key = ("file", job["file"], stat.st_mtime_ns, stat.st_size)
+    if key in proteins:
+        proteins.move_to_end(key)
+        return proteins[key]
+    source = io.BytesIO(job["data"]) if "data" in job else job["file"]
+    prot, center_of_mass = pipeline.load_protein(
+        source, settings["sasa_engine"], settings["naccess"], settings["cache_dir"],
+        settings["cache_size"], per_chain=settings["per_chain"])
+    proteins[key] = (protein.scale_ca_coords(prot, center_of_mass), center_of_mass)
+    while len(proteins) > MEMORY_CACHE_SIZE:
+        proteins.popitem(last=False)
+    return proteins[key]
+
+
+def run_job(job, settings, proteins):
+    """Process a job in a worker: the record of :func:`src.pipeline.predict`,
+    with the direction of the best line and the membrane bounds
+
+        Returns:
+            dict: The result record, or an error record
+    """
+    start_time = datetime.now()
+    try:
+        prot, center_of_mass = load_job_protein(job, settings, proteins)
+        record = pipeline.predict_protein(job["name"], prot, center_of_mass,
+                                          start_time=start_time, **job["parameters"])
+    except (Exception, SystemExit) as err:
+        return {"file": job["name"], "status": "error", "error": batch.error_message(err)}
+    direction = [point - center for point, center in zip(record["point"],
+                                                           record["center_of_mass"])]
+    norm = math.sqrt(sum(value**2 for value in direction))
+    # The slices of the best line, as in the best results of src.protein
+    membrane_start, membrane_end = protein.membrane_bounds(
+        (None, record["start_slice"], record["end_slice"]),
+        job["parameters"].get("resolution", 5))
+    record.update(direction=[value / norm for value in direction],
+                  membrane_start=membrane_start, membrane_end=membrane_end)
+    return record
+
+
+def worker_loop(conn, settings):
+    """Worker process: process the jobs received on conn until None"""
+    # The daemon stops the workers: Ctrl-C is ignored, SIGTERM kills at once
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    proteins = OrderedDict()
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        conn.send(run_job(job, settings, proteins))
+
+
+class WarmPool:
+    """
+    .. class:: WarmPool
+      This class keeps worker processes alive between the jobs. Every worker
+      is fed by a thread of the daemon, which takes the jobs from a bounded
+      queue: a full queue rejects the new jobs (back-pressure). A job
+      running longer than its timeout is answered with a "timeout" record
+      and its worker is replaced, so that the next jobs are not stalled.
+
+    Attributes:
+        settings: Keyword arguments of the accessibility of the workers
+        timeout: Default timeout of the jobs, in seconds
+        jobs: Bounded queue of (job, future) waiting for a worker
+        threads: Threads feeding the workers
+        stats: Counters of the jobs (done, errors, timeouts, rejected)
+    """
+
+    __slots__ = ("settings", "timeout", "jobs", "threads", "stats", "lock")
+
+    def __init__(self, settings, processes=None, max_queue=16, timeout=300):
+        """Start the workers (all the available cpus by default)"""
+        self.settings = settings
+        self.timeout = timeout
+        self.jobs = queue.Queue(maxsize=max_queue)
+        self.stats = {"done": 0, "errors": 0, "timeouts": 0, "rejected": 0}
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.feed, daemon=True)
+                        for _ in range(processes or parallel.available_cpus())]
+        for thread in self.threads:
+            thread.start()
+
+    def start_worker(self):
+        """Start a worker process, and return it with its end of the pipe"""
+        conn, worker_conn = Pipe()
+        process = Process(target=worker_loop, args=(worker_conn, self.settings), daemon=True)
+        process.start()
+        worker_conn.close()
+        return process, conn
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def feed(self):
+        """Thread feeding one worker with the jobs of the queue"""
+        process, conn = self.start_worker()
+        while True:
+            item = self.jobs.get()
+            if item is None:
+                break
+            job, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            timeout = min(job["timeout"] or self.timeout, self.timeout)
+            conn.send(job)
+            try:
+                if not conn.poll(timeout):
+                    raise TimeoutError
+                record = conn.recv()
+            except (TimeoutError, EOFError, OSError) as err:
+                # Stop the stalled or dead worker, a new one takes its place
+                process.terminate()
+                process.join()
+                conn.close()
+                process, conn = self.start_worker()
+                if isinstance(err, TimeoutError):
+                    record = {"file": job["name"], "status": "timeout",
+                              "error": "Job stopped after {} seconds".format(timeout)}
+                else:
+                    record = {"file": job["name"], "status": "error",
+                              "error": "The worker stopped unexpectedly"}
+            # Every job is counted once: done, timeouts or errors
+            self.count({"ok": "done", "timeout": "timeouts"}.get(record["status"], "errors"))
+            future.set_result(record)
+        try:
+            conn.send(None)
+        except OSError:
+            process.terminate()
+        process.join()
+
+    def submit(self, job):
+        """Queue a job
+
+            Args:
+                job: Job of :func:`parse_job`
+
+            Returns:
+                Future: Future of the record of the job
+
+            Raises:
+                queue.Full: If the queue is full
+        """
+        future = Future()
+        try:
+            self.jobs.put_nowait((job, future))
+        except queue.Full:
+            self.count("rejected")
+            raise
+        return future
+
+    def status(self):
+        """Number of workers, jobs waiting and counters"""
+        with self.lock:
+            return dict(self.stats, workers=len(self.threads), queued=self.jobs.qsize(),
+                        max_queue=self.jobs.maxsize)
+
+    def close(self):
+        """Stop the workers once the queued jobs are done"""
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+def answer(pool, request, data=None):
+    """Submit a request to the pool and wait for its record
+
+        Returns:
+            tuple: (HTTP status code, record)
+    """
+    try:
+        job = parse_job(request, data)
+        record = pool.submit(job).result()
+    except (ValueError, TypeError, binascii.Error) as err:
+        return 400, {"status": "error", "error": str(err)}
+    except queue.Full:
+        return 503, {"status": "busy", "error": "Too many jobs waiting, retry later"}
+    return {"ok": 200, "timeout": 504}.get(record["status"], 500), record
+
+
+class HTTPHandler(BaseHTTPRequestHandler):
+    """
+    .. class:: HTTPHandler
+      Handler of the HTTP requests: POST /predict with a JSON job, or with
+      the bytes of a structure and the parameters in the query string,
+      and GET /status
+    """
+
+    def send_json(self, code, document):
+        body = (json.dumps(document) + "\n").encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if code == 503:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urlsplit(self.path).path == "/status":
+            self.send_json(200, self.server.pool.status())
+        else:
+            self.send_json(404, {"status": "error", "error": "Unknown path: " + self.path})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != "/predict":
+            self.send_json(404, {"status": "error", "error": "Unknown path: " + self.path})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        if length > MAX_UPLOAD:
+            self.send_json(413, {"status": "error", "error": "Structure too large"})
+            return
+        body = self.rfile.read(length)
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            try:
+                request = json.loads(body)
+            except ValueError as err:
+                self.send_json(400, {"status": "error", "error": "Invalid JSON: " + str(err)})
+                return
+            self.send_json(*answer(self.server.pool, request))
+        else:
+            self.send_json(*answer(self.server.pool, dict(parse_qsl(url.query)), body))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SocketHandler(socketserver.StreamRequestHandler):
+    """
+    .. class:: SocketHandler
+      Handler of the Unix socket connections: one JSON job per line, one
+      JSON record per line in the same order
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as err:
+                record = {"status": "error", "error": "Invalid JSON: " + str(err)}
+            else:
+                record = answer(self.server.pool, request)[1]
+            self.wfile.write((json.dumps(record) + "\n").encode())
+            self.wfile.flush()
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(port=None, socket_path=None, processes=None, max_queue=16, timeout=300,
+          sasa_engine="naccess", naccess=None, cache_dir=None, cache_size=1024,
+          per_chain=False):
+    """Run the daemon until interrupted, on localhost HTTP and / or a Unix socket
+
+        Args:
+            port: Port of the HTTP server on localhost, or None
+            socket_path: Path of the Unix socket, or None
+            processes: Number of warm workers, all the available cpus by default
+            max_queue: Maximum number of jobs waiting for a worker
+            timeout: Maximum runtime of a job, in seconds
+            sasa_engine: "naccess" or "shrake-rupley"
+            naccess: Absolute path to local naccess binary, or None
+            cache_dir: Directory of the cache, or None
+            cache_size: Maximum size of the cache in megabytes
+            per_chain: Run NACCESS once per chain
+    """
+    if port is None and socket_path is None:
+        port = DEFAULT_PORT
+    pool = WarmPool({"sasa_engine": sasa_engine, "naccess": naccess, "cache_dir": cache_dir,
+                     "cache_size": cache_size, "per_chain": per_chain},
+                    processes, max_queue, timeout)
+    servers = []
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        servers.append(UnixServer(socket_path, SocketHandler))
+    if port is not None:
+        http_server = ThreadingHTTPServer((HOST, port), HTTPHandler)
+        http_server.daemon_threads = True
+        servers.append(http_server)
+    for server in servers:
+        server.pool = pool
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    # SIGTERM stops the daemon like Ctrl-C
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        signal.pause()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.unlink(socket_path)
+        pool.close()
+
+
+def stop(signum, frame):
+    """Signal handler stopping the daemon"""
+    raise KeyboardInterrupt
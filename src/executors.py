@@ -0,0 +1,187 @@
+"""
+.. module:: executors
+  :synopsis: This module runs the scan of the lines of one protein with the
+                backend fitting the workload: serially for the small proteins,
+                where starting workers costs more than the scan, or with the
+                pool of processes of :mod:`src.parallel`. A pool of threads can
+                be chosen explicitly: only the NumPy operations of the kernel
+                release the GIL, so it is not chosen from the workload. The
+                number of workers respects the scheduler affinity and the CPU
+                quota of the container.
+
+.. moduleauthor:: Gabriel Cretin M2 BIB
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import src.parallel as parallel
+import src.profiling as profiling
+import src.scan as scan
+from src.options import BACKENDS
+from src.protein import TopLines
+
+
+# Fixed cost of a line, in c_alphas: the binning of a line costs about as
+# much as the projection of 2000 c_alphas
+LINE_COST = 2000
+# Workload ((accessible c_alphas + LINE_COST) x lines) below which starting a
+# pool of processes costs more than it saves (about 0.1 second of serial scan)
+SERIAL_WORKLOAD = 2000000
+
+
+def choose_backend(nb_residues, nb_lines, jobs=None):
+    """Backend of a scan, from the size of its workload. The threads are
+    never chosen: the scoring of the slices holds the GIL, and they were
+    not measured faster than the serial scan.
+
+        Args:
+            nb_residues: Number of accessible c_alphas
+            nb_lines: Number of lines to scan
+            jobs: Number of workers, all the available cpus by default
+
+        Returns:
+            str: "serial" or "processes"
+    """
+    workload = (nb_residues + LINE_COST) * nb_lines
+    if (jobs or parallel.available_cpus()) == 1 or workload < SERIAL_WORKLOAD:
+        return "serial"
+    return "processes"
+
+
+def thread_scan_scales(prot, thickness, resolution, sphere_points, scale_list, jobs=None,
+                       nb_candidates=1, chunk_size=None, ranges=None, on_range=None):
+    """Scan all the lines of the hemisphere with a pool of threads sharing
+    the protein (see :func:`src.parallel.parallel_scan_scales`). The threads
+    only run concurrently in the NumPy operations which release the GIL.
+
+        Args:
+            prot: Protein centered on its center of mass
+            thickness: Number for the desired thickness of the slices, in angströms
+            resolution: Number in angströms setting the step of sliding.
+            sphere_points: (M, 3) Numpy array of points of the hemisphere
+            scale_list: List of :class:`src.scales.Scale`
+            jobs: Number of threads, all the available cpus by default
+            nb_candidates: Number of distinct lines kept per scale
+            chunk_size: Number of lines of a task, about 4 tasks per thread by default
+            ranges: List of the (first, last) ranges of lines to scan, instead
+                    of all the lines split by chunk_size
+            on_range: Function called with (first, last, pool of the lines of every
+                        scale) of every finished range, in the order of the ranges
+
+        Returns:
+            list: For every scale, one block of the best lines, as expected by
+                    :func:`src.protein.get_candidates`
+    """
+    jobs = jobs or parallel.available_cpus()
+    ranges = ranges or parallel.line_ranges(len(sphere_points), jobs, chunk_size)
+    profiler = profiling.current()
+
+    def scan_range(lines_range):
+        first, last = lines_range
+        reducers = [TopLines(nb_candidates) for _ in scale_list]
+        start = time.perf_counter()
+        # cProfile is per process: the kernel of the threads is not dumped
+        nb_slices = scan.reduce_lines(prot, thickness, resolution, sphere_points[first:last],
+                                      reducers, scale_list)
+        return ([reducer.pool for reducer in reducers], threading.get_native_id(), nb_slices,
+                time.perf_counter() - start)
+
+    reducers = [TopLines(nb_candidates) for _ in scale_list]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # Ordered results, so that the ties are resolved as in a serial scan
+        for (first, last), (lines, pid, nb_slices, seconds) in zip(
+                ranges, executor.map(scan_range, ranges)):
+            for reducer, scale_lines in zip(reducers, lines):
+                reducer.extend(scale_lines)
+            if on_range:
+                on_range(first, last, lines)
+            profiler.worker(pid, last - first, nb_slices, seconds)
+            profiler.count("lines", last - first)
+            profiler.count("slice_evaluations", nb_slices)
+    return [[reducer.lines] for reducer in reducers]
+
+
+def serial_scan_scales(prot, thickness, resolution, sphere_points, scale_list,
+                       nb_candidates=1, ranges=None, on_range=None):
+    """Scan all the lines of the hemisphere in the calling thread, in one go
+    or range by range
+
+        Args:
+            prot: Protein centered on its center of mass
+            thickness: Number for the desired thickness of the slices, in angströms
+            resolution: Number in angströms setting the step of sliding.
+            sphere_points: (M, 3) Numpy array of points of the hemisphere
+            scale_list: List of :class:`src.scales.Scale`
+            nb_candidates: Number of distinct lines kept per scale
+            ranges: List of the (first, last) ranges of lines to scan, instead
+                    of all the lines at once
+            on_range: Function called with (first, last, pool of the lines of every
+                        scale) of every finished range, in the order of the ranges
+
+        Returns:
+            list: For every scale, one block of the best lines, as expected by
+                    :func:`src.protein.get_candidates`
+    """
+    profiler = profiling.current()
+    reducers = [TopLines(nb_candidates) for _ in scale_list]
+    for first, last in ranges or [(0, len(sphere_points))]:
+        range_reducers = [TopLines(nb_candidates) for _ in scale_list] if ranges else reducers
+        with profiler.kernel():
+            nb_slices = scan.reduce_lines(prot, thickness, resolution,
+                                          sphere_points[first:last], range_reducers,
+                                          scale_list)
+        if ranges:
+            lines = [reducer.pool for reducer in range_reducers]
+            for reducer, scale_lines in zip(reducers, lines):
+                reducer.extend(scale_lines)
+            if on_range:
+                on_range(first, last, lines)
+        profiler.count("lines", last - first)
+        profiler.count("slice_evaluations", nb_slices)
+    return [[reducer.lines] for reducer in reducers]
+
+
+def scan_scales(prot, thickness, resolution, sphere_points, scale_list, nb_candidates=1,
+                backend="auto", jobs=None, chunk_size=None, ranges=None, on_range=None):
+    """Scan all the lines of the hemisphere with the chosen backend. All the
+    backends give the same lines.
+
+        Args:
+            prot: Protein centered on its center of mass
+            thickness: Number for the desired thickness of the slices, in angströms
+            resolution: Number in angströms setting the step of sliding.
+            sphere_points: (M, 3) Numpy array of points of the hemisphere
+            scale_list: List of :class:`src.scales.Scale`
+            nb_candidates: Number of distinct lines kept per scale
+            backend: "serial", "threads", "processes" or "auto" to choose it
+                        from the workload (:func:`choose_backend`)
+            jobs: Number of workers, all the available cpus by default
+            chunk_size: Number of lines of a task, about 4 tasks per worker by default
+            ranges: List of the (first, last) ranges of lines to scan, instead
+                    of all the lines split by chunk_size
+            on_range: Function called with (first, last, pool of the lines of every
+                        scale) of every finished range, in the order of the ranges
+
+        Returns:
+            list: For every scale, one block of the best lines, as expected by
+                    :func:`src.protein.get_candidates`
+    """
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend: {} (expected one of {})".format(
+            backend, ", ".join(BACKENDS)))
+    if backend == "auto":
+        nb_lines = sum(last - first for first, last in ranges) if ranges \
+            else len(sphere_points)
+        backend = choose_backend(len(prot), nb_lines, jobs)
+    profiling.current().count("backend_" + backend, 1)
+    if backend == "serial":
+        return serial_scan_scales(prot, thickness, resolution, sphere_points, scale_list,
+                                  nb_candidates, ranges, on_range)
+    if backend == "threads":
+        return thread_scan_scales(prot, thickness, resolution, sphere_points, scale_list,
+                                  jobs, nb_candidates, chunk_size, ranges, on_range)
+    return parallel.parallel_scan_scales(prot, thickness, resolution, sphere_points,
+                                         scale_list, jobs, nb_candidates, chunk_size, ranges,
+                                         on_range)
@@ -0,0 +1,337 @@
+"""
+.. module:: loader
+  :synopsis: This module reads a structure file once and gives the atoms of
+                one model as arrays, used both by the accessibility calculations
+                and to build the Protein. PDB and mmCIF files are read as
+                streams, plain or compressed with gzip or bz2.
+
+.. moduleauthor:: Gabriel Cretin M2 BIB
+"""
+
+from itertools import chain, islice
+import bz2
+import gzip
+import io
+import os
+import re
+
+import numpy as np
+
+
+# Extensions of the structure files
+PDB_EXTENSIONS = (".pdb", ".ent")
+CIF_EXTENSIONS = (".cif", ".mmcif")
+COMPRESSED_EXTENSIONS = (".gz", ".bz2")
+
+# Tokens of a mmCIF line: quoted strings may contain quotes not followed by a space
+CIF_TOKEN = re.compile(r"'(?:[^']|'(?!\s|$))*'|\"(?:[^\"]|\"(?!\s|$))*\"|\S+")
+
+
+class Atoms:
+    """
+    .. class:: Atoms
+      This class stores the atoms of one model of a structure as arrays
+      (one row per atom)
+
+    Attributes:
+        coords: (A, 3) float array of the atoms coordinates
+        names: (A,) array of the atoms names (CA, CB, ...)
+        elements: (A,) array of the elements
+        res_names: (A,) array of the 3 letters code of the residues
+        chains: (A,) array of the chain ids
+        res_ids: (A,) int32 array of the residues numbers
+        icodes: (A,) array of the insertion codes (" " if none)
+        hetero: (A,) bool array, True for HETATM records
+    """
+
+    __slots__ = ("coords", "names", "elements", "res_names", "chains",
+                 "res_ids", "icodes", "hetero")
+
+    def __init__(self, coords, names, elements, res_names, chains, res_ids, icodes, hetero):
+        """Creates the atoms from per-atom sequences"""
+        self.coords = np.array(coords, dtype=float).reshape(-1, 3)
+        self.names = np.array(names, dtype="U4")
+        self.elements = np.array(elements, dtype="U2")
+        self.res_names = np.array(res_names, dtype="U3")
+        self.chains = np.array(chains, dtype="U4")
+        self.res_ids = np.array(res_ids, dtype=np.int32)
+        self.icodes = np.array(icodes, dtype="U1")
+        self.hetero = np.array(hetero, dtype=bool)
+
+    def __len__(self):
+        return len(self.names)
+
+    def select(self, mask):
+        """Subset of the atoms
+
+            Args:
+                mask: Boolean array or indexes of the atoms to keep
+
+            Returns:
+                Atoms: The selected atoms
+        """
+        subset = Atoms.__new__(Atoms)
+        for name in self.__slots__:
+            setattr(subset, name, getattr(self, name)[mask])
+        return subset
+
+    def residue_index(self):
+        """Index of the residue of every atom: consecutive atoms
+        with the same chain, number and insertion code belong to the same residue
+
+            Returns:
+                tuple: ((A,) array of residue indexes, indexes of the first
+                        atom of every residue)
+        """
+        if not len(self):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        new_residue = np.ones(len(self), dtype=bool)
+        new_residue[1:] = ((self.chains[1:] != self.chains[:-1])
+                           | (self.res_ids[1:] != self.res_ids[:-1])
+                           | (self.icodes[1:] != self.icodes[:-1]))
+        return np.cumsum(new_residue) - 1, np.nonzero(new_residue)[0]
+
+
+def open_text(source):
+    """Open a structure as a text stream, decompressing gzip and bz2 on the fly
+
+        Args:
+            source: Path to the file, or binary / text file object
+
+        Returns:
+            A text stream
+    """
+    if isinstance(source, (str, os.PathLike)):
+        stream = open(source, "rb")
+    elif isinstance(source, io.TextIOBase):
+        return source
+    else:
+        stream = source
+    if not hasattr(stream, "peek"):
+        stream = io.BufferedReader(stream)
+    magic = stream.peek(3)[:3]
+    if magic[:2] == b"\x1f\x8b":
+        stream = gzip.open(stream)
+    elif magic == b"BZh":
+        stream = bz2.open(stream)
+    return io.TextIOWrapper(stream, encoding="ascii", errors="replace")
+
+
+def is_mmcif(source, first_line):
+    """Guess if a structure is in mmCIF format, from its name or its first line"""
+    if isinstance(source, (str, os.PathLike)):
+        name = str(source).lower()
+        for extension in COMPRESSED_EXTENSIONS:
+            if name.endswith(extension):
+                name = name[:-len(extension)]
+        if name.endswith(CIF_EXTENSIONS):
+            return True
+        if name.endswith(PDB_EXTENSIONS):
+            return False
+    return first_line.startswith("data_")
+
+
+def read_pdb(lines, model=0):
+    """Read the ATOM and HETATM records of one model of a PDB file
+
+        Args:
+            lines: Iterable of the lines of the file
+            model: Index of the model (0 for the first one)
+
+        Returns:
+            list: The atoms as tuples of the Atoms fields
+    """
+    return next(islice(iter_pdb_models(lines), model, None), [])
+
+
+def iter_pdb_models(lines):
+    """Read the models of a PDB file one after the other, as a stream:
+    a model is given as soon as its ENDMDL record is read
+
+        Args:
+            lines: Iterable of the lines of the file
+
+        Yields:
+            list: The atoms of a model as tuples of the Atoms fields
+    """
+    atoms = []
+    seen = set()
+    for line in lines:
+        record = line[0:6]
+        if record == "ENDMDL":
+            yield atoms
+            atoms = []
+            seen = set()
+        elif record in ("ATOM  ", "HETATM"):
+            name = line[12:16].strip()
+            chain_id = line[21]
+            res_id = int(line[22:26])
+            icode = line[26]
+            alt_loc = line[16]
+            # Keep the first alternate location of every atom
+            if alt_loc != " ":
+                key = (chain_id, res_id, icode, name)
+                if key in seen:
+                    continue
+                seen.add(key)
+            element = line[76:78].strip() or name[0]
+            atoms.append(((float(line[30:38]), float(line[38:46]), float(line[46:54])),
+                          name, element.upper(), line[17:20].strip(), chain_id,
+                          res_id, icode, record == "HETATM"))
+    # Last model without ENDMDL, or single model file
+    if atoms:
+        yield atoms
+
+
+def read_mmcif(lines, model=0):
+    """Read the atom_site loop of one model of a mmCIF file
+
+        Args:
+            lines: Iterable of the lines of the file
+            model: Index of the model (0 for the first one)
+
+        Returns:
+            list: The atoms as tuples of the Atoms fields
+    """
+    return next(islice(iter_mmcif_models(lines), model, None), [])
+
+
+def iter_mmcif_models(lines):
+    """Read the models of the atom_site loop of a mmCIF file one after the
+    other, as a stream: a model is given as soon as the next one starts
+
+        Args:
+            lines: Iterable of the lines of the file
+
+        Yields:
+            list: The atoms of a model as tuples of the Atoms fields
+    """
+    atoms = []
+    seen = set()
+    columns = []
+    current_model = None
+    lines = iter(lines)
+    for line in lines:
+        if line.startswith("_atom_site."):
+            columns.append(line.split()[0][len("_atom_site."):])
+        elif columns:
+            break
+    if not columns:
+        return
+
+    def column(*names):
+        for name in names:
+            if name in columns:
+                return columns.index(name)
+        return None
+    group = column("group_PDB")
+    name_col = column("auth_atom_id", "label_atom_id")
+    element_col = column("type_symbol")
+    res_name_col = column("auth_comp_id", "label_comp_id")
+    chain_col = column("auth_asym_id", "label_asym_id")
+    res_id_col = column("auth_seq_id", "label_seq_id")
+    icode_col = column("pdbx_PDB_ins_code")
+    alt_col = column("label_alt_id")
+    model_col = column("pdbx_PDB_model_num")
+    x_col, y_col, z_col = column("Cartn_x"), column("Cartn_y"), column("Cartn_z")
+
+    while line and not line.startswith(("#", "loop_", "_", "data_")):
+        values = line.split() if "'" not in line and '"' not in line else \
+            [token[1:-1] if token[0] in "'\"" else token for token in CIF_TOKEN.findall(line)]
+        line = next(lines, "")
+        if not values:
+            continue
+        if model_col is not None and values[model_col] != current_model:
+            if atoms:
+                yield atoms
+            atoms = []
+            seen = set()
+            current_model = values[model_col]
+        name = values[name_col]
+        chain_id = values[chain_col]
+        res_id = int(values[res_id_col]) if values[res_id_col] not in (".", "?") else 0
+        icode = values[icode_col] if icode_col is not None else "?"
+        icode = " " if icode in (".", "?") else icode
+        if alt_col is not None and values[alt_col] not in (".", "?"):
+            key = (chain_id, res_id, icode, name)
+            if key in seen:
+                continue
+            seen.add(key)
+        element = values[element_col] if element_col is not None else name[0]
+        atoms.append(((float(values[x_col]), float(values[y_col]), float(values[z_col])),
+                      name, element.upper(), values[res_name_col], chain_id, res_id, icode,
+                      group is not None and values[group] == "HETATM"))
+    if atoms:
+        yield atoms
+
+
+def load_structure(source, model=0):
+    """Read a structure file once (PDB or mmCIF, plain, gzip or bz2)
+
+        Args:
+            source: Path to the file, or binary / text file object
+            model: Index of the model (0 for the first one)
+
+        Returns:
+            Atoms: The atoms of the model
+    """
+    stream = open_text(source)
+    try:
+        first_line = stream.readline()
+        lines = chain([first_line], stream)
+        if is_mmcif(source, first_line):
+            atoms = read_mmcif(lines, model)
+        else:
+            atoms = read_pdb(lines, model)
+    finally:
+        # The streams given by the caller are left open
+        if isinstance(source, (str, os.PathLike)):
+            stream.close()
+    if not atoms:
+        raise ValueError("No atoms found in the structure (model {})".format(model))
+    return Atoms(*zip(*atoms))
+
+
+def iter_models(source):
+    """Read the models of a structure file (PDB or mmCIF, plain, gzip or bz2)
+    one after the other: NMR ensembles, or the frames of a trajectory given
+    as a multi-model file or stream. The file is read once, and only one
+    model is held in memory at a time.
+
+        Args:
+            source: Path to the file, or binary / text file object
+
+        Yields:
+            Atoms: The atoms of every model
+    """
+    stream = open_text(source)
+    try:
+        first_line = stream.readline()
+        lines = chain([first_line], stream)
+        models = iter_mmcif_models(lines) if is_mmcif(source, first_line) \
+            else iter_pdb_models(lines)
+        for atoms in models:
+            yield Atoms(*zip(*atoms))
+    finally:
+        # The streams given by the caller are left open
+        if isinstance(source, (str, os.PathLike)):
+            stream.close()
+
+
+def write_pdb_atoms(atoms, file_out):
+    """Write atoms as PDB ATOM / HETATM records
+
+        Args:
+            atoms: Atoms to write
+            file_out: Text file object
+    """
+    for serial, (coords, name, element, res_name, chain_id, res_id, icode, hetero) in enumerate(
+            zip(atoms.coords, atoms.names, atoms.elements, atoms.res_names, atoms.chains,
+                atoms.res_ids, atoms.icodes, atoms.hetero), start=1):
+        # Atom names of 1 to 3 characters start at the second column
+        name = name if len(name) == 4 or len(element) == 2 else " " + name
+        file_out.write("{:6s}{:5d} {:4s} {:3s} {:1s}{:4d}{:1s}   {:8.3f}{:8.3f}{:8.3f}"
+                       "{:6.2f}{:6.2f}          {:>2s}\n".format(
+                           "HETATM" if hetero else "ATOM", serial % 100000, name, res_name,
+                           chain_id[:1], res_id, icode, coords[0], coords[1], coords[2],
+                           1.0, 0.0, element))
@@ -0,0 +1,113 @@
+"""
+.. module:: options
+  :synopsis: This module holds the choices of the command line options and
+                checks the arguments with the standard library only: the help
+                and the argument errors are printed before NumPy, Biopython
+                and multiprocessing are loaded.
+
+.. moduleauthor:: Gabriel Cretin M2 BIB
+"""
+
+import math
+import os
+
+
+# Engines computing the solvant accessibility (see src.accessibility)
+ENGINES = ["naccess", "shrake-rupley"]
+# Formats of the records of the batch, trajectory and sweep modes
+FORMATS = ["jsonl", "csv"]
+# Names of the built-in hydrophobicity scales (see src.scales.SCALES)
+SCALE_NAMES = ["types", "binary", "kyte-doolittle", "wimley-white"]
+# Backends of the scan of the lines (see src.executors)
+BACKENDS = ["auto", "serial", "threads", "processes"]
+
+# Numerical options: (type, smallest value, True if the smallest value is accepted)
+NUMBERS = {"--points": (int, 1, True), "--slice": (float, 0, False),
+           "--resolution": (float, 0, False), "--precision": (float, 0, False),
+           "--candidates": (int, 1, True), "--cache-size": (float, 0, False),
+           "--naccess-jobs": (int, 1, True), "--local-angle": (float, 0, False),
+           "--local-points": (int, 1, True), "--rescan-drop": (float, 0, True),
+           "--port": (int, 1, True), "--max-queue": (int, 1, True),
+           "--timeout": (float, 0, False), "--jobs": (int, 1, True),
+           "--chunk-size": (int, 1, True)}
+
+
+def check_arguments(arguments):
+    """Check the arguments parsed by docopt, without loading the stages
+
+        Args:
+            arguments: Dictionary returned by docopt
+
+        Returns:
+            str: The error message of the first invalid argument, or None
+    """
+    for option in NUMBERS:
+        error = check_number(option, arguments.get(option))
+        if error:
+            return error
+    if arguments.get("--sasa") not in ENGINES:
+        return "--sasa should be one of: " + ", ".join(ENGINES)
+    if arguments.get("--backend") not in BACKENDS:
+        return "--backend should be one of: " + ", ".join(BACKENDS)
+    if arguments.get("--format") not in FORMATS:
+        return "--format should be one of: " + ", ".join(FORMATS)
+    error = check_scale(arguments.get("--scale"))
+    if error:
+        return error
+    # The frames of a trajectory are tracked with one scale
+    if arguments.get("--trajectory") and len(scale_names(arguments.get("--scale"))) > 1:
+        return "--trajectory takes one hydrophobicity scale: " + arguments["--scale"]
+    return None
+
+
+def scale_names(value):
+    """Names of a comma separated list of hydrophobicity scales"""
+    return [name.strip() for name in str(value or "").split(",") if name.strip()]
+
+
+def check_scale(value):
+    """Check a comma separated list of hydrophobicity scales
+
+        Args:
+            value: Names of SCALE_NAMES or paths to scale files, or None if
+                    the option is not set
+
+        Returns:
+            str: The error message, or None if the value is valid
+    """
+    if value is None:
+        return None
+    names = scale_names(value)
+    if not names:
+        return "--scale should name at least one hydrophobicity scale"
+    for name in names:
+        if name not in SCALE_NAMES and not os.path.isfile(name):
+            return "Unknown hydrophobicity scale: {} (expected one of {} or a file)".format(
+                name, ", ".join(SCALE_NAMES))
+    return None
+
+
+def check_number(option, value):
+    """Check the value of a numerical option of NUMBERS
+
+        Args:
+            option: Name of the option (ex: "--points")
+            value: Value of the option, or None if it is not set
+
+        Returns:
+            str: The error message, or None if the value is valid
+    """
+    if value is None:
+        return None
+    kind, minimum, inclusive = NUMBERS[option]
+    try:
+        number = kind(value)
+    except (TypeError, ValueError):
+        return "{} should be {}: {}".format(
+            option, "an integer" if kind is int else "a number", value)
+    if not math.isfinite(number):
+        return "{} should be a finite number: {}".format(option, value)
+    if number < minimum or (number == minimum and not inclusive):
+        return "{} should be {} {}: {}".format(
+            option, "at least" if inclusive else "greater than", minimum, value)
+    return None
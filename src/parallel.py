@@ -0,0 +1,295 @@
+"""
+.. module:: parallel
+  :synopsis: This module parallelizes the scan of the lines of one protein.
+                The arrays of the protein are placed once in shared memory and
+                attached by every worker when the pool starts: the tasks only
+                carry the range of the lines to process. This works with both
+                the fork and the spawn start methods.
+
+.. moduleauthor:: Gabriel Cretin M2 BIB
+"""
+
+from contextlib import nullcontext
+from multiprocessing import Pool, cpu_count
+from multiprocessing.shared_memory import SharedMemory
+import math
+import os
+import time
+
+import numpy as np
+import src.profiling as profiling
+import src.scales as scales
+import src.scan as scan
+from src.protein import Protein, TopLines
+
+
+# CPU quota of the container: cgroup v2, then cgroup v1 (quota, period)
+CGROUP_V2_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+CGROUP_V1_CPU_QUOTA = ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us",
+                       "/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+
+# State of a worker, set by init_worker
+_worker = {}
+
+
+def cgroup_cpus():
+    """Number of cpus allowed by the CPU quota of the container, or None
+    if there is no quota"""
+    try:
+        with open(CGROUP_V2_CPU_MAX) as file_in:
+            quota, period = file_in.read().split()[:2]
+    except (OSError, ValueError):
+        try:
+            with open(CGROUP_V1_CPU_QUOTA[0]) as quota_in, \
+                    open(CGROUP_V1_CPU_QUOTA[1]) as period_in:
+                quota, period = quota_in.read().strip(), period_in.read().strip()
+        except OSError:
+            return None
+    if quota in ("max", "-1"):
+        return None
+    try:
+        return max(1, math.ceil(int(quota) / int(period)))
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def available_cpus():
+    """Number of cpus the process can use: the cpus of its scheduler affinity,
+    limited by the CPU quota of the container"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = cpu_count()
+    quota = cgroup_cpus()
+    return min(cpus, quota) if quota else cpus
+
+
+def share_protein(prot):
+    """Copy the arrays of a protein into shared memory blocks
+
+        Args:
+            prot: The Protein to share
+
+        Returns:
+            tuple: (blocks, descriptor) the SharedMemory blocks, to be closed
+                    and unlinked by the parent, and the (name, shape, dtype)
+                    of each array needed to attach them
+    """
+    blocks = []
+    descriptor = {}
+    for name in Protein.__slots__:
+        array = getattr(prot, name)
+        block = SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        descriptor[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, descriptor
+
+
+def attach_protein(descriptor):
+    """Build a Protein whose arrays are views of the shared memory blocks
+
+        Args:
+            descriptor: The descriptor returned by :func:`share_protein`
+
+        Returns:
+            tuple: (Protein, blocks) the blocks must stay referenced
+                    as long as the Protein is used
+    """
+    blocks = []
+    arrays = {}
+    for name, (block_name, shape, dtype) in descriptor.items():
+        block = SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    prot = Protein.__new__(Protein)
+    prot.__setstate__(arrays)
+    return prot, blocks
+
+
+def init_worker(descriptor, thickness, resolution, sphere_points, kernel_dump=None,
+                combinations=None, nb_candidates=1, scale=scales.DEFAULT_SCALE):
+    """Pool initializer: attach the shared protein once per worker
+
+        Args:
+            descriptor: The descriptor returned by :func:`share_protein`
+            thickness: Number for the desired thickness of the slices, in angströms
+            resolution: Number in angströms setting the step of sliding.
+            sphere_points: (M, 3) Numpy array of points of the hemisphere
+            kernel_dump: Prefix of the cProfile dumps of the scan kernel, or None
+            combinations: List of (thickness, resolution) tuples of a parameter
+                            sweep (:func:`sweep_range`), or None
+            nb_candidates: Number of distinct lines returned by a task, per scale
+            scale: Hydrophobicity scale, or list of scales scored in one pass
+                    (see :func:`src.scales.get_scales`)
+    """
+    prot, blocks = attach_protein(descriptor)
+    _worker.update(prot=prot, blocks=blocks, thickness=thickness,
+                   resolution=resolution, sphere_points=sphere_points,
+                   kernel_dump=kernel_dump, combinations=combinations,
+                   nb_candidates=nb_candidates, scale_list=scales.get_scales(scale))
+
+
+def scan_range(lines_range):
+    """Worker task: scan the lines first to last - 1 of the hemisphere and
+    reduce them locally to the best distinct lines of every scale
+
+        Args:
+            lines_range: Tuple (first, last) of indexes of the sphere points
+
+        Returns:
+            tuple: (pool of the best lines of every scale (see
+                    :class:`src.protein.TopLines`), pid, number of slices, seconds)
+    """
+    first, last = lines_range
+    reducers = [TopLines(_worker["nb_candidates"]) for _ in _worker["scale_list"]]
+    start = time.perf_counter()
+    with profiling.profile_kernel(_worker["kernel_dump"]) if _worker["kernel_dump"] \
+            else nullcontext():
+        nb_slices = scan.reduce_lines(_worker["prot"], _worker["thickness"],
+                                      _worker["resolution"],
+                                      _worker["sphere_points"][first:last], reducers,
+                                      _worker["scale_list"])
+    return ([reducer.pool for reducer in reducers], os.getpid(), nb_slices,
+            time.perf_counter() - start)
+
+
+def sweep_range(lines_range):
+    """Worker task: best line of the lines first to last - 1 of the hemisphere
+    for every (thickness, resolution) combination of the sweep
+
+        Args:
+            lines_range: Tuple (first, last) of indexes of the sphere points
+
+        Returns:
+            list: The best processed line of the range for every combination
+    """
+    first, last = lines_range
+    with profiling.profile_kernel(_worker["kernel_dump"]) if _worker["kernel_dump"] \
+            else nullcontext():
+        return scan.sweep_lines(_worker["prot"], _worker["combinations"],
+                                _worker["sphere_points"][first:last],
+                                _worker["scale_list"][0])
+
+
+def line_ranges(nb_points, processes, chunk_size=None):
+    """Split the sphere points in about 4 ranges of lines per worker, or in
+    ranges of chunk_size lines"""
+    nb_ranges = math.ceil(nb_points / chunk_size) if chunk_size else processes * 4
+    bounds = np.linspace(0, nb_points, min(nb_points, nb_ranges) + 1).astype(int)
+    return [(int(first), int(last)) for first, last in zip(bounds[:-1], bounds[1:])
+            if last > first]
+
+
+def parallel_scan(prot, thickness, resolution, sphere_points, processes=None,
+                  nb_candidates=1, scale=scales.DEFAULT_SCALE, chunk_size=None):
+    """Scan all the lines of the hemisphere with a pool of workers
+    sharing the arrays of the protein. The workers return the pools of their best
+    lines, merged as they arrive in a bounded :class:`src.protein.TopLines`: the
+    memory does not grow with the number of lines.
+
+        Args:
+            prot: Protein centered on its center of mass
+            thickness: Number for the desired thickness of the slices, in angströms
+            resolution: Number in angströms setting the step of sliding.
+            sphere_points: (M, 3) Numpy array of points of the hemisphere
+            processes: Number of workers, all the available cpus by default
+            nb_candidates: Number of distinct lines kept
+            scale: Hydrophobicity scale (see :func:`src.scales.get_scale`)
+            chunk_size: Number of lines of a task, about 4 tasks per worker by default
+
+        Returns:
+            list: One block of the best lines, as expected by
+                    :func:`src.protein.get_candidates`
+    """
+    return parallel_scan_scales(prot, thickness, resolution, sphere_points,
+                                [scales.get_scale(scale)], processes, nb_candidates,
+                                chunk_size)[0]
+
+
+def parallel_scan_scales(prot, thickness, resolution, sphere_points, scale_list,
+                         processes=None, nb_candidates=1, chunk_size=None, ranges=None,
+                         on_range=None):
+    """Parallel scan of all the lines for several hydrophobicity scales in
+    one pass (:func:`src.scan.scan_lines_scales`)
+
+        Args:
+            prot: Protein centered on its center of mass
+            thickness: Number for the desired thickness of the slices, in angströms
+            resolution: Number in angströms setting the step of sliding.
+            sphere_points: (M, 3) Numpy array of points of the hemisphere
+            scale_list: List of :class:`src.scales.Scale`
+            processes: Number of workers, all the available cpus by default
+            nb_candidates: Number of distinct lines kept per scale
+            chunk_size: Number of lines of a task, about 4 tasks per worker by default
+            ranges: List of the (first, last) ranges of lines to scan, instead
+                    of all the lines split by chunk_size
+            on_range: Function called with (first, last, pool of the lines of every
+                        scale) of every finished range, in the order of the ranges
+
+        Returns:
+            list: For every scale, one block of the best lines, as expected by
+                    :func:`src.protein.get_candidates`
+    """
+    processes = processes or available_cpus()
+    ranges = ranges or line_ranges(len(sphere_points), processes, chunk_size)
+    profiler = profiling.current()
+    reducers = [TopLines(nb_candidates) for _ in scale_list]
+    blocks, descriptor = share_protein(prot)
+    try:
+        with Pool(processes=processes, initializer=init_worker,
+                  initargs=(descriptor, thickness, resolution, sphere_points,
+                            profiler.kernel_dump, None, nb_candidates,
+                            scale_list)) as pool:
+            # Ordered results, so that the ties are resolved as in a serial scan
+            for (first, last), (lines, pid, nb_slices, seconds) in zip(
+                    ranges, pool.imap(scan_range, ranges)):
+                for reducer, scale_lines in zip(reducers, lines):
+                    reducer.extend(scale_lines)
+                if on_range:
+                    on_range(first, last, lines)
+                profiler.worker(pid, last - first, nb_slices, seconds)
+                profiler.count("lines", last - first)
+                profiler.count("slice_evaluations", nb_slices)
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return [[reducer.lines] for reducer in reducers]
+
+
+def parallel_sweep(prot, combinations, sphere_points, processes=None,
+                   scale=scales.DEFAULT_SCALE):
+    """Scan all the lines of the hemisphere once for many (thickness, resolution)
+    combinations: each worker projects and sorts its lines once and only
+    returns its best line per combination
+
+        Args:
+            prot: Protein centered on its center of mass
+            combinations: List of (thickness, resolution) tuples
+            sphere_points: (M, 3) Numpy array of points of the hemisphere
+            processes: Number of workers, all the available cpus by default
+            scale: Hydrophobicity scale (see :func:`src.scales.get_scale`)
+
+        Returns:
+            list: For every combination, the processed lines (one per task)
+                    as expected by :func:`src.protein.get_best_results`
+    """
+    processes = processes or available_cpus()
+    ranges = line_ranges(len(sphere_points), processes)
+    profiler = profiling.current()
+    blocks, descriptor = share_protein(prot)
+    try:
+        with Pool(processes=processes, initializer=init_worker,
+                  initargs=(descriptor, None, None, sphere_points,
+                            profiler.kernel_dump, combinations, 1,
+                            scales.get_scale(scale))) as pool:
+            best_lines = pool.map(sweep_range, ranges)
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    profiler.count("lines", len(sphere_points))
+    profiler.count("combinations", len(combinations))
+    # Transpose tasks x combinations into combinations x tasks
+    return [[list(lines)] for lines in zip(*best_lines)]
@@ -1,74 +1,215 @@
 """This module implements functions to visualize the program's results
-with PyMol. It generates a PDB file and a .pml file."""
+with PyMol. It generates a PDB file and a .pml file. A PDB structure is
+copied as is, and a mmCIF structure is converted to PDB records.
+The files are written to temporary files renamed at the end, so that
+concurrent runs writing the same paths never mix their outputs, and they
+can also be written to in-memory file objects."""
 
 
-from shutil import copyfile
+import bz2
+import gzip
+import io
 import os
+import shutil
+import tempfile
 
+import numpy as np
+import src.loader as loader
 
-def write_pdb(pdb_file, points_membrane_1, points_membrane_2):
-    """ Copy the original pdb into a new file and write the coordinates of DUM
-    atoms to visualize the membranes
+
+# Serial number of the first DUM atom of the membranes
+MEMBRANE_FIRST_SERIAL = 10000
+# HETATM record of a DUM atom: serial, name, membrane number (1 or 2), x, y, z, element
+MEMBRANE_RECORD = "HETATM%5d  %-3s DUM  %4d    %8.3f%8.3f%8.3f  1.00  0.00          %2s\n"
+# Size of the chunks of the copy of the original file
+COPY_BUFFER = 1 << 20
+
+
+def strip_compression(path):
+    """Path without its .gz or .bz2 extension"""
+    for extension in (".gz", ".bz2"):
+        if path.endswith(extension):
+            return path[:-len(extension)]
+    return path
+
+
+def output_paths(pdb_file, prefix=None):
+    """Paths of the PDB and PyMol files of a run
 
         Args:
             pdb_file: Path to the pdb_file
+            prefix: Prefix of the output files chosen by the caller, or None
+                    for <pdb_file without extension>_new
+
+        Returns:
+            tuple: (path of the PDB file, path of the .pml file)
+    """
+    if prefix is None:
+        prefix = os.path.splitext(strip_compression(pdb_file))[0] + "_new"
+    return prefix + ".pdb", prefix + ".pml"
+
+
+def membrane_records(points_membrane_1, points_membrane_2, first_serial=MEMBRANE_FIRST_SERIAL):
+    """HETATM records of the DUM atoms of both membranes, formatted in one
+    operation. The serial numbers are unique, and the residue number is the
+    number of the membrane (1 or 2).
+
+        Args:
             points_membrane_1: 3D coordinates of the points representing the first membrane
             points_membrane_2: 3D coordinates of the points representing the second membrane
+            first_serial: Serial number of the first DUM atom
 
         Returns:
-            file: New PDB file with DUM atoms simulating the membranes
+            str: The records
     """
-    # Copy the original pdb file to a new pdb_file_new.pdb
-    base, ext = os.path.splitext(pdb_file)
-    new_pdb_file = base + "_new" + ext
-    command = "cp " + pdb_file + " " + new_pdb_file
-    os.system(command)
-    # Write the new lines at the end of the file
-    with open(new_pdb_file, "a") as file_in:
-        i = 10000
-        for point in points_membrane_1:
-            if i % 2 == 0:
-                line = "{:6s}{:5d}      {:3s} {:1s} {:5d}       {:8.3f} {:8.3f} {:8.3f}\n".format(
-                    "HETATM ", i, "N", "DUM", i, float(point[0]), float(point[1]), float(point[2]))
-            else:
-                line = "{:6s}{:5d}      {:3s} {:1s} {:5d}       {:8.3f} {:8.3f} {:8.3f}\n".format(
-                    "HETATM ", i, "O", "DUM", i, float(point[0]), float(point[1]), float(point[2]))
-            i += 1
-            file_in.write(line)
-        i = 10000
-        for point in points_membrane_2:
-            if i % 2 == 0:
-                line = "{:6s}{:5d}      {:3s} {:1s} {:5d}       {:8.3f} {:8.3f} {:8.3f}\n".format(
-                    "HETATM ", i, "N", "DUM", i, float(point[0]), float(point[1]), float(point[2]))
+    membranes = [np.reshape(points_membrane_1, (-1, 3)), np.reshape(points_membrane_2, (-1, 3))]
+    points = np.vstack(membranes)
+    serials = first_serial + np.arange(len(points))
+    # Alternate N and O atoms to color the membranes
+    elements = np.where(serials % 2 == 0, "N", "O")
+    table = np.empty((len(points), 7), dtype=object)
+    table[:, 0] = serials.tolist()
+    table[:, 1] = elements
+    table[:, 2] = np.repeat([1, 2], [len(membrane) for membrane in membranes]).tolist()
+    table[:, 3:6] = points.tolist()
+    table[:, 6] = elements
+    return (MEMBRANE_RECORD * len(points)) % tuple(table.ravel())
+
+
+def open_original(pdb_file):
+    """Binary stream of the original structure, decompressed on the fly"""
+    stream = open(pdb_file, "rb")
+    magic = stream.peek(3)[:3]
+    if magic[:2] == b"\x1f\x8b":
+        return gzip.open(stream)
+    if magic == b"BZh":
+        return bz2.open(stream)
+    return stream
+
+
+def original_is_mmcif(pdb_file):
+    """True if the original structure is in mmCIF format (see :func:`src.loader.is_mmcif`)"""
+    with loader.open_text(pdb_file) as file_in:
+        return loader.is_mmcif(pdb_file, file_in.readline())
+
+
+def write_atomic(path, write, compress=None):
+    """Write a file through a temporary file of the same directory, renamed
+    at the end: a reader or a concurrent run never sees a partial file
+
+        Args:
+            path: Path of the file
+            write: Function writing the content to a binary file object
+            compress: Compress with gzip, by default if path ends with ".gz"
+    """
+    compress = path.endswith(".gz") if compress is None else compress
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    handle, tmp_path = tempfile.mkstemp(dir=directory,
+                                        prefix="." + os.path.basename(path))
+    try:
+        with os.fdopen(handle, "wb") as file_out:
+            if compress:
+                with gzip.GzipFile(fileobj=file_out, mode="wb") as gzip_out:
+                    write(gzip_out)
             else:
-                line = "{:6s}{:5d}      {:3s} {:1s} {:5d}       {:8.3f} {:8.3f} {:8.3f}\n".format(
-                    "HETATM ", i, "O", "DUM", i, float(point[0]), float(point[1]), float(point[2]))
-            i += 1
-            file_in.write(line)
+                write(file_out)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_pdb(pdb_file, points_membrane_1, points_membrane_2, new_pdb_file=None,
+              compress=None):
+    """ Copy the original pdb into a new file and write the coordinates of DUM
+    atoms to visualize the membranes. A mmCIF structure is written as the
+    PDB records of its first model (see :func:`src.loader.write_pdb_atoms`).
+
+        Args:
+            pdb_file: Path to the pdb_file (PDB or mmCIF, plain or compressed
+                        with gzip or bz2)
+            points_membrane_1: 3D coordinates of the points representing the first membrane
+            points_membrane_2: 3D coordinates of the points representing the second membrane
+            new_pdb_file: Path of the new PDB file (see :func:`output_paths`
+                            by default), or a binary file object (ex: io.BytesIO)
+            compress: Compress the new file with gzip, by default if its
+                        path ends with ".gz"
+
+        Returns:
+            The path of the new PDB file, or the file object
+    """
+    records = membrane_records(points_membrane_1, points_membrane_2).encode("ascii")
+    if original_is_mmcif(pdb_file):
+        # PDB records appended to mmCIF text would be neither PDB nor mmCIF
+        atom_records = io.StringIO()
+        loader.write_pdb_atoms(loader.load_structure(pdb_file), atom_records)
+        atom_records = atom_records.getvalue().encode("ascii")
+    else:
+        atom_records = None
+
+    def write(file_out):
+        if atom_records is not None:
+            file_out.write(atom_records)
+        else:
+            # Buffered copy of the original pdb file
+            with open_original(pdb_file) as file_in:
+                shutil.copyfileobj(file_in, file_out, COPY_BUFFER)
+        # The DUM atoms at the end
+        file_out.write(records)
+
+    if new_pdb_file is None:
+        new_pdb_file = output_paths(pdb_file)[0]
+    if not isinstance(new_pdb_file, (str, os.PathLike)):
+        write(new_pdb_file)
+        return new_pdb_file
+    write_atomic(os.fspath(new_pdb_file), write, compress)
     return new_pdb_file
 
 
-def write_pml_script(sphere_point, pdb_file):
+def pml_script(sphere_point, pdb_file):
+    """PyMol script to visualize the best line/direction
+
+        Args:
+            sphere_point: A point on the hemisphere englobing the protein
+            pdb_file: Path to the pdb_file loaded by the script
+
+        Returns:
+            str: The script
+    """
+    return "\n".join([
+        "cmd.load('{}')".format(pdb_file),
+        "cmd.pseudoatom('pt1', pos=[{}, {}, {}])".format(-sphere_point.x, -sphere_point.y,
+                                                         -sphere_point.z),
+        "cmd.pseudoatom('pt2', pos=[{}, {}, {}])".format(sphere_point.x, sphere_point.y,
+                                                         sphere_point.z),
+        "cmd.distance('/pt1', '/pt2')",
+        "cmd.set('dash_gap', '0')",
+        "cmd.set('dash_radius', '0.3')",
+        "cmd.set('dash_round_ends', '0')",
+        "cmd.set('dash_color', '0xffcc00', 'dist01')",
+        "cmd.hide('labels', 'dist01')"])
+
+
+def write_pml_script(sphere_point, pdb_file, pml_file=None):
     """Write a small PyMol script to visualize the best line/direction
 
         Args:
             sphere_point: A point on the hemisphere englobing the protein
-            pdb_file: Path to the pdb_file
+            pdb_file: Path to the pdb_file loaded by the script
+            pml_file: Path of the script (next to the PDB file it loads, with
+                        the same name, by default), or a text file object
+                        (ex: io.StringIO)
+
+        Returns:
+            The path of the script, or the file object
     """
-    with open("src/pymol_visualize.pml", "w") as file_in:
-        line1 = "cmd.load('{}')".format(pdb_file)
-        line2 = "cmd.pseudoatom('pt1', pos=[{}, {}, {}])".format(-sphere_point.x,
-                                                                 -sphere_point.y,
-                                                                 -sphere_point.z)
-        line3 = "cmd.pseudoatom('pt2', pos=[{}, {}, {}])".format(sphere_point.x,
-                                                                 sphere_point.y,
-                                                                 sphere_point.z)
-        line4 = "cmd.distance('/pt1', '/pt2')"
-        line5 = "cmd.set('dash_gap', '0')"
-        line6 = "cmd.set('dash_radius', '0.3')"
-        line7 = "cmd.set('dash_round_ends', '0')"
-        line8 = "cmd.set('dash_color', '0xffcc00', 'dist01')"
-        line9 = "cmd.hide('labels', 'dist01')"
-        file_in.write('{}\n{}\n{}\n{}\n{}\n{}\n{}\n{}\n{}'.format(line1, line2, line3,
-                                                                  line4, line5, line6,
-                                                                  line7, line8, line9))
+    script = pml_script(sphere_point, pdb_file)
+    if pml_file is None:
+        pml_file = os.path.splitext(strip_compression(pdb_file))[0] + ".pml"
+    if not isinstance(pml_file, (str, os.PathLike)):
+        pml_file.write(script)
+        return pml_file
+    write_atomic(os.fspath(pml_file), lambda file_out: file_out.write(script.encode()), False)
+    return pml_file
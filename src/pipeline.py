@@ -0,0 +1,369 @@
+"""
+.. module:: pipeline
+  :synopsis: This module chains the steps of the prediction for one protein:
+                accessibility, parsing, scan of the lines and best line.
+                It is shared by the command line and the batch mode.
+
+.. moduleauthor:: Gabriel Cretin M2 BIB
+"""
+
+from datetime import datetime
+
+import src.accessibility as accessibility
+import src.cache as cache
+import src.executors as executors
+import src.loader as loader
+import src.parallel as parallel
+import src.profiling as profiling
+import src.protein as protein
+import src.scales as scales
+import src.search as search
+import src.sphere as sphere
+
+
+def load_protein(pdb_file, sasa_engine="naccess", naccess=None, cache_dir=None, cache_size=1024,
+                 accessible_residues=None, per_chain=False, atoms=None):
+    """Compute the accessibility of the residues and parse the accessible c_alphas.
+    Warm runs read them from the cache and skip the accessibility and the parsing.
+
+        Args:
+            pdb_file: Path to the structure file (PDB or mmCIF, plain or
+                        compressed), or a file object
+            sasa_engine: "naccess" or "shrake-rupley"
+            naccess: Absolute path to local naccess binary, or None
+            cache_dir: Directory of the cache, or None to disable the cache
+            cache_size: Maximum size of the cache in megabytes
+            accessible_residues: Accessibility of the residues already computed
+                                    (ex: in the background by the batch mode),
+                                    or None to compute it
+            per_chain: Run NACCESS once per chain (see
+                        :class:`src.accessibility.NaccessRunner`)
+            atoms: :class:`src.loader.Atoms` of the structure already parsed
+                    (ex: for accessible_residues), or None to parse it
+
+        Returns:
+            tuple: (Protein, center_of_mass)
+    """
+    profiler = profiling.current()
+    # Only the files can be cached, the streams are read once
+    cache_dir = cache_dir if isinstance(pdb_file, str) else None
+    if cache_dir:
+        with profiler.stage("cache_load"):
+            key = protein_cache_key(pdb_file, sasa_engine, per_chain)
+            cached = cache.load(cache_dir, key) if accessible_residues is None else None
+        if cached:
+            return cached
+
+    # The structure is read once, for the accessibility and the c_alphas
+    if atoms is None:
+        with profiler.stage("parse"):
+            atoms = loader.load_structure(pdb_file)
+    prot, center_of_mass = protein_from_atoms(atoms, sasa_engine, naccess,
+                                              accessible_residues, per_chain)
+
+    if cache_dir:
+        with profiler.stage("cache_store"):
+            cache.store(cache_dir, key, prot, center_of_mass, int(cache_size * 1024**2))
+    return prot, center_of_mass
+
+
+def protein_cache_key(pdb_file, sasa_engine="naccess", per_chain=False):
+    """Cache key of the accessible residues of a structure file"""
+    parameters = {"sasa": sasa_engine, "threshold": protein.ACCESSIBILITY_THRESHOLD}
+    if per_chain and sasa_engine == "naccess":
+        parameters["per_chain"] = True
+    return cache.cache_key(pdb_file, **parameters)
+
+
+def protein_from_atoms(atoms, sasa_engine="naccess", naccess=None, accessible_residues=None,
+                       per_chain=False):
+    """Compute the accessibility of the residues of a model and build the
+    Protein of its accessible c_alphas
+
+        Args:
+            atoms: :class:`src.loader.Atoms` of the model
+            sasa_engine: "naccess" or "shrake-rupley"
+            naccess: Absolute path to local naccess binary, or None
+            accessible_residues: Accessibility of the residues already computed
+                                    (ex: on the first frame of a trajectory),
+                                    or None to compute it
+            per_chain: Run NACCESS once per chain, the chains concurrently
+
+        Returns:
+            tuple: (Protein, center_of_mass)
+    """
+    profiler = profiling.current()
+    if accessible_residues is None:
+        # Relative % of solvant accessible area for each residue, with NACCESS
+        # (custom installation path if specified)
+        # or with the built-in Shrake-Rupley engine
+        with profiler.stage("accessibility"):
+            naccess_rsa = accessibility.compute_rsa(atoms, sasa_engine, naccess=naccess,
+                                                    per_chain=per_chain)
+        # Keep only residues having a relative accessibility > 30 (arbitrary)
+        accessible_residues = protein.keep_accessible_residues(naccess_rsa)
+    with profiler.stage("build_protein"):
+        return protein.build_protein(atoms, accessible_residues)
+
+
+def scan_protein(prot, thickness, resolution, sphere_points, nb_candidates=1,
+                 scale=scales.DEFAULT_SCALE):
+    """Serial scan of all the lines, by blocks of :data:`src.scan.BLOCK_SIZE` lines.
+    Only the best distinct lines are kept (:class:`src.protein.TopLines`).
+
+        Args:
+            prot: Protein centered on its center of mass
+            thickness: Number for the desired thickness of the slices, in angströms
+            resolution: Number in angströms setting the step of sliding.
+            sphere_points: (M, 3) Numpy array of points of the hemisphere
+            nb_candidates: Number of distinct lines kept
+            scale: Hydrophobicity scale (see :func:`src.scales.get_scale`)
+
+        Returns:
+            list: One block of the best lines, as expected by
+                    :func:`src.protein.get_candidates`
+    """
+    return scan_protein_scales(prot, thickness, resolution, sphere_points,
+                               [scales.get_scale(scale)], nb_candidates)[0]
+
+
+def scan_protein_scales(prot, thickness, resolution, sphere_points, scale_list,
+                        nb_candidates=1):
+    """Serial scan of all the lines for several hydrophobicity scales in one pass
+
+        Args:
+            prot: Protein centered on its center of mass
+            thickness: Number for the desired thickness of the slices, in angströms
+            resolution: Number in angströms setting the step of sliding.
+            sphere_points: (M, 3) Numpy array of points of the hemisphere
+            scale_list: List of :class:`src.scales.Scale`
+            nb_candidates: Number of distinct lines kept per scale
+
+        Returns:
+            list: For every scale, one block of the best lines, as expected by
+                    :func:`src.protein.get_candidates`
+    """
+    return executors.serial_scan_scales(prot, thickness, resolution, sphere_points, scale_list,
+                                        nb_candidates)
+
+
+def predict(pdb_file, nb_points=250, thickness=15, resolution=5, sasa_engine="naccess",
+            naccess=None, cache_dir=None, cache_size=1024, adaptive=False, precision=1.0,
+            nb_candidates=1, scale=scales.DEFAULT_SCALE, per_chain=False,
+            accessible_residues=None, atoms=None):
+    """Full prediction for one protein, processed serially
+
+        Args:
+            pdb_file: Path to the pdb_file
+            nb_points: Number of points on the hemisphere
+            thickness: Number for the desired thickness of the slices, in angströms
+            resolution: Number in angströms setting the step of sliding.
+            sasa_engine: "naccess" or "shrake-rupley"
+            naccess: Absolute path to local naccess binary, or None
+            cache_dir: Directory of the cache, or None to disable the cache
+            cache_size: Maximum size of the cache in megabytes
+            adaptive: Use the coarse-to-fine search (:mod:`src.search`),
+                        nb_points being the number of points of the coarse scan
+            precision: Angular precision of the adaptive search, in degrees
+            nb_candidates: Number of distinct candidate orientations in the record
+            scale: Hydrophobicity scale, or several scales scored in one pass
+                    (see :func:`src.scales.get_scales`): the record is the one of
+                    the first scale, with the best line of every scale in "scales"
+            per_chain: Run NACCESS once per chain, the chains concurrently
+            accessible_residues: Accessibility of the residues already computed,
+                                    or None to compute it
+            atoms: :class:`src.loader.Atoms` of the structure already parsed,
+                    or None to parse it
+
+        Returns:
+            dict: The result record of the protein (best line and membrane slices)
+    """
+    start_time = datetime.now()
+    prot, center_of_mass = load_protein(pdb_file, sasa_engine, naccess, cache_dir, cache_size,
+                                        accessible_residues, per_chain, atoms)
+    prot = protein.scale_ca_coords(prot, center_of_mass)
+    return predict_protein(pdb_file, prot, center_of_mass, nb_points, thickness, resolution,
+                           adaptive, precision, nb_candidates, scale, start_time)
+
+
+def predict_protein(pdb_file, prot, center_of_mass, nb_points=250, thickness=15, resolution=5,
+                    adaptive=False, precision=1.0, nb_candidates=1,
+                    scale=scales.DEFAULT_SCALE, start_time=None):
+    """Prediction for a protein already loaded (see :func:`predict`)
+
+        Args:
+            pdb_file: Name of the protein in the record
+            prot: Protein centered on its center of mass
+            center_of_mass: Protein's center of mass
+            nb_points: Number of points on the hemisphere
+            thickness: Number for the desired thickness of the slices, in angströms
+            resolution: Number in angströms setting the step of sliding.
+            adaptive: Use the coarse-to-fine search (:mod:`src.search`)
+            precision: Angular precision of the adaptive search, in degrees
+            nb_candidates: Number of distinct candidate orientations in the record
+            scale: Hydrophobicity scale, or several scales scored in one pass
+            start_time: datetime of the start of the job, for the runtime of
+                        the record (now by default)
+
+        Returns:
+            dict: The result record of the protein (best line and membrane slices)
+    """
+    start_time = start_time or datetime.now()
+    scale_list = scales.get_scales(scale)
+    if adaptive:
+        # The refined directions depend on the scale: one search per scale
+        scale_candidates = []
+        nb_lines = 0
+        for one_scale in scale_list:
+            candidates, scale_lines = search.adaptive_search(
+                prot, thickness, resolution, nb_points, precision,
+                nb_candidates=nb_candidates, scale=one_scale)
+            scale_candidates.append(candidates)
+            nb_lines += scale_lines
+    else:
+        sphere_points = sphere.generate_points_on_sphere(nb_points)
+        scale_candidates = [protein.get_candidates(lines, nb_candidates)
+                            for lines in scan_protein_scales(prot, thickness, resolution,
+                                                             sphere_points, scale_list,
+                                                             nb_candidates)]
+        nb_lines = nb_points
+    candidates = scale_candidates[0]
+    record = result_record(pdb_file, prot, center_of_mass, candidates[0], nb_lines,
+                           (datetime.now() - start_time).total_seconds())
+    record["scale"] = scale_list[0].name
+    if nb_candidates > 1:
+        record.update(candidates_record(candidates, center_of_mass, resolution))
+    if len(scale_list) > 1:
+        record["scales"] = {one_scale.name: candidate_summary(candidates[0], center_of_mass,
+                                                              resolution)
+                            for one_scale, candidates in zip(scale_list, scale_candidates)}
+    return record
+
+
+def result_record(pdb_file, prot, center_of_mass, best_results, nb_lines, runtime):
+    """Summarize the best results of a protein in a flat dictionary
+
+        Args:
+            pdb_file: Path to the pdb_file
+            prot: Protein of the accessible residues
+            center_of_mass: Protein's center of mass
+            best_results: The list returned by :func:`src.protein.get_best_results`
+            nb_lines: Number of lines evaluated
+            runtime: Runtime in seconds
+
+        Returns:
+            dict: The result record
+    """
+    point = best_results[0][0] + center_of_mass
+    return {"file": pdb_file,
+            "status": "ok",
+            "nb_accessible_residues": len(prot),
+            "point": [float(point.x), float(point.y), float(point.z)],
+            "center_of_mass": [float(center_of_mass.x), float(center_of_mass.y),
+                               float(center_of_mass.z)],
+            "hydrophobicity": float(best_results[0][1]),
+            "start_slice": int(best_results[1]),
+            "end_slice": int(best_results[2]),
+            "nb_steps": int(best_results[4]),
+            "nb_lines": nb_lines,
+            "runtime": runtime}
+
+
+def candidate_summary(best_results, center_of_mass, resolution):
+    """Point, hydrophobicity and membrane bounds of a candidate line
+
+        Args:
+            best_results: A candidate of :func:`src.protein.get_candidates`
+            center_of_mass: Protein's center of mass
+            resolution: Number in angströms setting the step of sliding.
+
+        Returns:
+            dict: "point", "hydrophobicity", "start_slice", "end_slice",
+                    "membrane_start" and "membrane_end"
+    """
+    point = best_results[0][0] + center_of_mass
+    dist_m1, dist_m2 = protein.membrane_bounds(best_results, resolution)
+    return {"point": [float(point.x), float(point.y), float(point.z)],
+            "hydrophobicity": float(best_results[0][1]),
+            "start_slice": best_results[1], "end_slice": best_results[2],
+            "membrane_start": float(dist_m1), "membrane_end": float(dist_m2)}
+
+
+def candidates_record(candidates, center_of_mass, resolution):
+    """Summarize the candidate orientations of a protein, for the quality control
+    of ambiguous predictions (near-ties are common for symmetric barrels)
+
+        Args:
+            candidates: The list returned by :func:`src.protein.get_candidates`
+            center_of_mass: Protein's center of mass
+            resolution: Number in angströms setting the step of sliding.
+
+        Returns:
+            dict: "candidates", one dictionary per candidate (point,
+                    hydrophobicity and membrane bounds), and "ambiguity",
+                    the ratio of the hydrophobicity factors of the second
+                    and the first candidates (None if there is one candidate)
+    """
+    summaries = [candidate_summary(best_results, center_of_mass, resolution)
+                 for best_results in candidates]
+    ambiguity = summaries[1]["hydrophobicity"] / summaries[0]["hydrophobicity"] \
+        if len(summaries) > 1 and summaries[0]["hydrophobicity"] > 0 else None
+    return {"candidates": summaries, "ambiguity": ambiguity}
+
+
+def parse_values(values, default):
+    """Parse a comma separated list of numbers of a parameter sweep
+
+        Args:
+            values: String like "10,15,20", or None
+            default: Value used when values is None
+
+        Returns:
+            list: The numbers (int when possible, float otherwise)
+    """
+    if not values:
+        return [default]
+    numbers = [float(value) for value in values.split(",") if value.strip()]
+    return [int(number) if number.is_integer() else number for number in numbers]
+
+
+def sweep(pdb_file, prot, center_of_mass, thicknesses, resolutions, sphere_points,
+          processes=None, scale=scales.DEFAULT_SCALE):
+    """Parameter sweep: best line and membranes for every (thickness, resolution)
+    combination. The lines are projected and sorted once for all the combinations
+    (:func:`src.scan.sweep_lines`).
+
+        Args:
+            pdb_file: Path to the pdb_file
+            prot: Protein centered on its center of mass
+            center_of_mass: Protein's center of mass
+            thicknesses: List of thicknesses of the slices, in angströms
+            resolutions: List of resolutions (sliding steps), in angströms
+            sphere_points: (M, 3) Numpy array of points of the hemisphere
+            processes: Number of workers, all the cpus by default
+            scale: Hydrophobicity scale (see :func:`src.scales.get_scale`)
+
+        Returns:
+            list: One result record per combination, with the "thickness",
+                    "resolution", "membrane_start" and "membrane_end" values
+    """
+    start_time = datetime.now()
+    combinations = [(thickness, resolution) for thickness in thicknesses
+                    for resolution in resolutions]
+    profiler = profiling.current()
+    with profiler.stage("scan"):
+        best_lines = parallel.parallel_sweep(prot, combinations, sphere_points, processes,
+                                             scale)
+    runtime = (datetime.now() - start_time).total_seconds()
+    records = []
+    with profiler.stage("best_line"):
+        for (thickness, resolution), lines in zip(combinations, best_lines):
+            best_results = protein.get_best_results(lines)
+            record = result_record(pdb_file, prot, center_of_mass, best_results,
+                                   len(sphere_points), runtime)
+            dist_m1, dist_m2 = protein.membrane_bounds(best_results, resolution)
+            record.update(scale=scales.get_scale(scale).name,
+                          thickness=thickness, resolution=resolution,
+                          membrane_start=float(dist_m1), membrane_end=float(dist_m2))
+            records.append(record)
+    return records
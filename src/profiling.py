@@ -0,0 +1,211 @@
+"""
+.. module:: profiling
+  :synopsis: This module implements the opt-in instrumentation of the stages
+                of the prediction: wall time, CPU time and peak RSS per stage,
+                lines and slice evaluations per second, per worker throughput
+                and optional cProfile dumps of the scan kernel. When it is not
+                enabled, every hook is a no-op.
+
+.. moduleauthor:: Gabriel Cretin M2 BIB
+"""
+
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def resources():
+    """CPU time (seconds) and peak RSS (kilobytes) of the process and of its
+    finished children
+
+        Returns:
+            dict: cpu_self, cpu_children, peak_rss_self_kb, peak_rss_children_kb
+    """
+    if resource is None:
+        return {"cpu_self": time.process_time(), "cpu_children": 0.0,
+                "peak_rss_self_kb": None, "peak_rss_children_kb": None}
+    usage_self = resource.getrusage(resource.RUSAGE_SELF)
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+    scale = 1024 if sys.platform == "darwin" else 1
+    return {"cpu_self": usage_self.ru_utime + usage_self.ru_stime,
+            "cpu_children": usage_children.ru_utime + usage_children.ru_stime,
+            "peak_rss_self_kb": usage_self.ru_maxrss // scale,
+            "peak_rss_children_kb": usage_children.ru_maxrss // scale}
+
+
+class Profiler:
+    """
+    .. class:: Profiler
+      This class records the stages of one prediction
+
+    Attributes:
+        stages: List of dictionaries, one per stage, in the order of execution
+        counters: Dictionary of the counters (lines, slice_evaluations, ...)
+        workers: Dictionary {pid: {"lines", "slices", "seconds"}} of the scan workers
+        kernel_dump: Prefix of the cProfile dumps of the scan kernel, or None
+    """
+
+    enabled = True
+
+    def __init__(self, kernel_dump=None):
+        """Creates an empty profile"""
+        self.stages = []
+        self.counters = {}
+        self.workers = {}
+        self.kernel_dump = kernel_dump
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager recording a stage. ru_maxrss is a high-water mark
+        of the whole process: "process_peak_rss_kb" is the peak RSS of the
+        process at the end of the stage, and "peak_rss_increase_kb" how much
+        the stage raised it (0 if it stayed below an earlier peak)."""
+        before = resources()
+        wall = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            after = resources()
+            self.stages.append({
+                "stage": name,
+                "wall": wall,
+                "cpu": after["cpu_self"] - before["cpu_self"],
+                "cpu_children": after["cpu_children"] - before["cpu_children"],
+                "process_peak_rss_kb": after["peak_rss_self_kb"],
+                "peak_rss_increase_kb": None if after["peak_rss_self_kb"] is None
+                else after["peak_rss_self_kb"] - before["peak_rss_self_kb"],
+                "children_peak_rss_kb": after["peak_rss_children_kb"]})
+
+    def count(self, name, value):
+        """Add value to a counter"""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def worker(self, pid, nb_lines, nb_slices, seconds):
+        """Record the work of a scan task done by the worker pid"""
+        stats = self.workers.setdefault(pid, {"lines": 0, "slices": 0, "seconds": 0.0})
+        stats["lines"] += nb_lines
+        stats["slices"] += nb_slices
+        stats["seconds"] += seconds
+
+    def count_lines(self, processed_lines):
+        """Count the lines and the slices of blocks of processed lines"""
+        for block in processed_lines:
+            self.count("lines", len(block))
+            self.count("slice_evaluations", sum(line["nb_steps"] for line in block))
+
+    def kernel(self):
+        """Context manager running cProfile on the scan kernel, when a dump
+        prefix is set. The dump file is <prefix>.<pid>"""
+        if not self.kernel_dump:
+            return nullcontext()
+        return profile_kernel(self.kernel_dump)
+
+    def report(self):
+        """The profile as a JSON serializable dictionary"""
+        scan_wall = sum(stage["wall"] for stage in self.stages if stage["stage"] == "scan")
+        rates = {}
+        if scan_wall:
+            rates["lines_per_second"] = self.counters.get("lines", 0) / scan_wall
+            rates["slice_evaluations_per_second"] = \
+                self.counters.get("slice_evaluations", 0) / scan_wall
+        workers = {str(pid): dict(stats, lines_per_second=stats["lines"] / stats["seconds"]
+                                  if stats["seconds"] else None)
+                   for pid, stats in self.workers.items()}
+        return {"total_wall": time.perf_counter() - self._start,
+                "stages": self.stages,
+                "counters": self.counters,
+                "rates": rates,
+                "workers": workers,
+                "resources": resources()}
+
+    def write(self, path):
+        """Write the report as JSON in path ("-" for the standard output)"""
+        if path == "-":
+            json.dump(self.report(), sys.stdout, indent=2)
+            print()
+        else:
+            with open(path, "w") as file_out:
+                json.dump(self.report(), file_out, indent=2)
+
+
+class NullProfiler:
+    """
+    .. class:: NullProfiler
+      Profiler used when the instrumentation is disabled: every hook is a no-op
+    """
+
+    enabled = False
+    kernel_dump = None
+
+    def stage(self, name):
+        return _NULL_CONTEXT
+
+    def count(self, name, value):
+        pass
+
+    def worker(self, pid, nb_lines, nb_slices, seconds):
+        pass
+
+    def count_lines(self, processed_lines):
+        pass
+
+    def kernel(self):
+        return _NULL_CONTEXT
+
+
+_NULL_CONTEXT = nullcontext()
+# Profiler of the running prediction, per thread (and per asyncio task): the
+# predictions running concurrently in the threads of one process do not
+# share it. The new threads start with the NullProfiler.
+_current = ContextVar("profiler", default=NullProfiler())
+
+
+@contextmanager
+def profile_kernel(prefix):
+    """Run cProfile and accumulate the statistics in <prefix>.<pid>"""
+    import cProfile
+    profile = _kernel_profiles.setdefault(os.getpid(), cProfile.Profile())
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats("{}.{}".format(prefix, os.getpid()))
+
+
+_kernel_profiles = {}
+
+
+def current():
+    """The profiler of the running prediction (a NullProfiler when disabled)"""
+    return _current.get()
+
+
+def enable(kernel_dump=None):
+    """Enable the instrumentation (library hook) in the calling thread
+
+        Args:
+            kernel_dump: Prefix of the cProfile dumps of the scan kernel, or None
+
+        Returns:
+            Profiler: The new current profiler
+    """
+    profiler = Profiler(kernel_dump)
+    _current.set(profiler)
+    return profiler
+
+
+def disable():
+    """Disable the instrumentation in the calling thread"""
+    _current.set(NullProfiler())
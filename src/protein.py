@@ -8,8 +8,64 @@
 """
 
 from src.vector import *
-from operator import itemgetter
-import sys
+import math
+
+
+# Standard residues. A residue is encoded by its index in this list,
+# and every other residue by UNKNOWN_RESIDUE.
+RESIDUES = ["ALA", "ARG", "ASN", "ASP", "CYS", "GLN", "GLU", "GLY", "HIS", "ILE",
+            "LEU", "LYS", "MET", "PHE", "PRO", "SER", "THR", "TRP", "TYR", "VAL"]
+RESIDUE_CODES = {res_name: code for code, res_name in enumerate(RESIDUES)}
+UNKNOWN_RESIDUE = len(RESIDUES)
+
+# Residues with a relative accessibility below this value (%) are buried
+ACCESSIBILITY_THRESHOLD = 30
+
+# Residues considered as hydrophobic
+HYDROPHOBES = ["PHE", "ILE", "GLY", "LEU", "MET", "TRP", "TYR", "VAL"]
+
+# Minimum angle (degrees) between two candidate orientations
+CANDIDATE_MIN_ANGLE = 10
+
+
+class Protein:
+    """
+    .. class:: Protein
+      This class stores the accessible c_alphas of a protein as contiguous
+      Numpy arrays (one row per residue) instead of one dictionary per residue
+
+    Attributes:
+        coords: (N, 3) float array of the c_alphas coordinates
+        res_codes: (N,) int8 array of the residues codes (see RESIDUES)
+        chains: (N,) array of the chain ids
+        res_ids: (N,) int32 array of the residues numbers
+        accessibility: (N,) float32 array of the all_atoms_rel values
+    """
+
+    __slots__ = ("coords", "res_codes", "chains", "res_ids", "accessibility")
+
+    def __init__(self, coords, res_codes, chains, res_ids, accessibility):
+        """Creates a protein from its per-residue arrays"""
+        self.coords = np.ascontiguousarray(coords, dtype=float).reshape(-1, 3)
+        self.res_codes = np.asarray(res_codes, dtype=np.int8)
+        self.chains = np.asarray(chains, dtype="U4")
+        self.res_ids = np.asarray(res_ids, dtype=np.int32)
+        self.accessibility = np.asarray(accessibility, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.res_codes)
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def res_names(self):
+        """Gives the 3 letters code of the residues"""
+        return [RESIDUES[code] if code < UNKNOWN_RESIDUE else "UNK"
+                for code in self.res_codes]
 
 
 def get_com(x, y, z, nb_ca):
@@ -29,112 +85,67 @@ def get_com(x, y, z, nb_ca):
 
 def keep_accessible_residues(naccess_rsa):
     """From the output of naccess we keep only accessible residues
-    which have a all_atoms_rel value > 30 (arbitrary threshold)
+    which have a all_atoms_rel value >= 30 (arbitrary threshold)
 
     Args:
         naccess_rsa: A dictionnary containing the output of naccess's calculations
 
     Returns:
-        dict: Keys are the residue ids and as value their solvant accessible area
+        dict: Keys are the (chain_id, residue_number) of the residues and
+                as value their solvant accessible area
     """
     accessible_residues_dict = {}
     for (chain_id, res_id), data_dict in naccess_rsa.items():
         for key, val in data_dict.items():
-            if key == "all_atoms_rel" and val >= 30:
-                accessible_residues_dict[res_id[1]] = val
+            if key == "all_atoms_rel" and val >= ACCESSIBILITY_THRESHOLD:
+                accessible_residues_dict[(chain_id, res_id[1])] = val
     return accessible_residues_dict
 
 
-def build_prot_dict(pdb_file, accessible_residues):
-    """1. Get the coordinates of alpha carbones in the PDB
+def build_protein(atoms, accessible_residues):
+    """1. Get the coordinates of alpha carbones of the structure
        2. Check if the residue is accessible to solvant
-       3. Builds a dictionnary compiling infos on:
+       3. Builds a Protein compiling infos on:
             - 3D coordinates of accessible residues
             - value of relative accessibility to solvant
-            - residue name
+            - residue code and chain
 
         Args:
-            pdb_file: The protein's PDB file
+            atoms: :class:`src.loader.Atoms` of the model, read once
             accessible_residues: Dictionnary containing the accessible residues
                             and their relative accessibility value
 
         Returns:
-            dict: Residue_id:
-                - Vector(x, y, z)
-                - All_atoms_rel_accessibility_value
-                - Residue_name
+            Protein: The accessible residues of the protein
 
             Vector: Protein's center_of_mass
     """
-    prot_dict = {}
-    with open(pdb_file, 'r') as file_in:
-        nb_ca = 0
-        x = 0
-        y = 0
-        z = 0
-        x_com = 0
-        y_com = 0
-        z_com = 0
-        for line in file_in:
-            atom_type = line[0:6].strip()  # "ATOM " or "HETATM"
-            atom_name = line[12:16].strip()
-            if atom_type == "ATOM" and atom_name == "CA":
-                residue_name = str(line[17:20].strip())
-                residue_num = int(line[22:26].strip())
-                x = float(line[30:38].strip())
-                y = float(line[38:46].strip())
-                z = float(line[46:54].strip())
-                # Keep the residue if it is accessible to solvant
-                # Build a dictionnary compiling all infos for the said residue
-                if residue_num in accessible_residues:
-                    prot_dict[residue_num] = {'3Dcoords': Vector(x, y, z),
-                                              'all_atoms_rel': accessible_residues[residue_num],
-                                              'resName': residue_name}
-                if atom_type == "ATOM":
-                    # Cumulative sum of coordinates for the calculation
-                    # of the center of mass
-                    x_com += x
-                    y_com += y
-                    z_com += z
-                    nb_ca += 1
-    return (prot_dict, get_com(x_com, y_com, z_com, nb_ca))
-
-
-def scale_ca_coords(prot_dict, center_of_mass):
+    c_alphas = atoms.select(~atoms.hetero & (atoms.names == "CA"))
+    x_com, y_com, z_com = c_alphas.coords.sum(axis=0)
+    # Keep the residue if it is accessible to solvant
+    keys = list(zip(c_alphas.chains.tolist(), c_alphas.res_ids.tolist()))
+    accessible = np.array([key in accessible_residues for key in keys], dtype=bool)
+    prot = Protein(c_alphas.coords[accessible],
+                   [RESIDUE_CODES.get(res_name, UNKNOWN_RESIDUE)
+                    for res_name in c_alphas.res_names[accessible]],
+                   c_alphas.chains[accessible],
+                   c_alphas.res_ids[accessible],
+                   [accessible_residues[key] for key, keep in zip(keys, accessible) if keep])
+    return (prot, get_com(x_com, y_com, z_com, len(c_alphas)))
+
+
+def scale_ca_coords(prot, center_of_mass):
     """Place the cartesian system centered in (0, 0, 0) origin
 
         Args:
-            prot_dict: Coordinates of all c_alphas of the protein
+            prot: Protein containing the coordinates of the c_alphas
             center_of_mass: 3D coordinates of the protein's center of mass
 
         Returns:
-            dict: The new prot_dict with new coordinates
+            Protein: The same protein with new coordinates
     """
-    for c_alpha, infos in prot_dict.items():
-        infos['3Dcoords'] = infos['3Dcoords'] - center_of_mass
-    return prot_dict
-
-
-def slice_relative_hydrophobicity(residues, nb_residues_in_slice):
-    """Calculates the relative hydrophobicity of a list of residues
-
-        Args:
-            residues: Array of 3 letters code residues in the slice
-            nb_residues_in_slice: Number of residues in the slice
-
-        Returns:
-            float: :math:`Relative\ hydrophobicity = \\frac{hydrophobe\ residues}{total\ residues}`
-
-    """
-    hydrophobes = ["PHE", "ILE", "GLY", "LEU", "MET", "TRP", "TYR", "VAL"]
-    try:
-        rel_hydro = len(set(residues).intersection(
-            hydrophobes)) / nb_residues_in_slice
-    except ZeroDivisionError as err:
-        sys.exit("It seems like there is no residues in the slice: " + str(err))
-    assert isinstance(rel_hydro, (float, int)
-                      ) == True, "Error 3: rel_hydro should be an int or a float."
-    return rel_hydro
+    prot.coords -= np.array([center_of_mass.x, center_of_mass.y, center_of_mass.z])
+    return prot
 
 
 def max_sub_array_sum(array):
@@ -150,53 +161,198 @@ def max_sub_array_sum(array):
         Returns:
             tuple: (a, b, c) such that sum(array[a:b]) == c and c is maximal
     """
-    best = current = 0
-    current_index = start_index = best_index = 0
-    for index, val in enumerate(array):
-        if current + val > 0:
-            current += val
-        else:  # reset start position
-            current, current_index = 0, index + 1
-        if current > best:
-            start_index, best_index, best = current_index, index + 1, current
-    return (start_index, best_index, best)
+    starts, ends, sums = max_sub_arrays(np.asarray(array, dtype=float).reshape(1, -1))
+    return (int(starts[0]), int(ends[0]), float(sums[0]))
 
 
-def get_best_results(processed_lines):
+def max_sub_arrays(scores):
+    """Batched maximum sub-array problem, one row of scores per line.
+    The best sub-array ending at slice j starts after the smallest prefix sum
+    before j, so all the rows are solved at once with prefix sums and
+    running minima instead of a Kadane loop per line.
+    Rows shorter than the matrix must be padded with zeros.
+
+        Args:
+            scores: (L, S) Numpy array of the slices scores of L lines
+
+        Returns:
+            tuple: (starts, ends, sums) (L,) Numpy arrays such that
+                    sum(scores[l, starts[l]:ends[l]]) == sums[l] is maximal.
+                    The earliest and shortest sub-array wins the ties, as in Kadane.
+    """
+    nb_lines, nb_slices = scores.shape
+    prefix = np.zeros((nb_lines, nb_slices + 1))
+    np.cumsum(scores, axis=1, out=prefix[:, 1:])
+    running_min = np.minimum.accumulate(prefix, axis=1)
+    # Latest position of the running minimum
+    positions = np.where(prefix == running_min, np.arange(nb_slices + 1), 0)
+    running_argmin = np.maximum.accumulate(positions, axis=1)
+    gains = prefix - running_min
+    ends = np.argmax(gains, axis=1)
+    rows = np.arange(nb_lines)
+    return running_argmin[rows, ends], ends, gains[rows, ends]
+
+
+def line_directions(lines):
+    """Values and unit directions of processed lines
+
+        Args:
+            lines: List of processed lines
+
+        Returns:
+            tuple: ((L,) values, (L, 3) unit directions)
+    """
+    values = np.array([line["line_average_hydro"][1] for line in lines])
+    normals = np.array([[line["line_average_hydro"][0].x, line["line_average_hydro"][0].y,
+                         line["line_average_hydro"][0].z] for line in lines], dtype=float)
+    return values, normals / np.linalg.norm(normals, axis=1)[:, None]
+
+
+def distinct_lines(lines, top_k, min_angle):
+    """Indexes of the top_k best lines, whose directions are at least min_angle apart
+
+        Args:
+            lines: List of processed lines
+            top_k: Maximum number of lines
+            min_angle: Minimum angle between two directions, in radians
+
+        Returns:
+            list: Indexes of the lines, best first
+    """
+    values, directions = line_directions(lines)
+    selected = []
+    for index in np.argsort(-values, kind="stable"):
+        if all(np.dot(directions[index], directions[other]) < np.cos(min_angle)
+               for other in selected):
+            selected.append(index)
+            if len(selected) == top_k:
+                break
+    return selected
+
+
+class TopLines:
+    """
+    .. class:: TopLines
+      This class reduces a stream of processed lines to the top_k best distinct
+      lines of :func:`distinct_lines`, so that the memory stays bounded whatever
+      the number of lines. It keeps the pool of the lines which can still be
+      selected: a line is dropped once top_k better lines are pairwise more
+      than 2 * min_angle apart. Every selected line is then close to at most one
+      of them, so at least top_k better lines are always selected, whatever
+      the lines offered next.
+      Workers return their pool and the parent merges the pools.
+
+    Attributes:
+        top_k: Maximum number of lines selected
+        min_angle: Minimum angle between two selected lines, in radians
+        pool: The lines which can still be selected, in the order they were offered
+    """
+
+    __slots__ = ("top_k", "min_angle", "pool", "_pruned")
+
+    def __init__(self, top_k=1, min_angle=math.radians(CANDIDATE_MIN_ANGLE)):
+        """Creates an empty reducer"""
+        self.top_k = top_k
+        self.min_angle = min_angle
+        self.pool = []
+        self._pruned = 0
+
+    def push(self, line):
+        """Offer a processed line"""
+        self.pool.append(line)
+        # The pool is pruned when it has doubled: the cost is amortized
+        if len(self.pool) > 2 * max(self._pruned, 32 * self.top_k):
+            self.prune()
+
+    def extend(self, lines):
+        """Offer many processed lines"""
+        for line in lines:
+            self.push(line)
+
+    def prune(self):
+        """Drop the lines of the pool which can not be selected any more"""
+        if len(self.pool) > self.top_k:
+            values, directions = line_directions(self.pool)
+            order = np.argsort(-values, kind="stable")
+            witnesses = []
+            for rank, index in enumerate(order):
+                if all(np.dot(directions[index], directions[other]) < np.cos(2 * self.min_angle)
+                       for other in witnesses):
+                    witnesses.append(index)
+                    if len(witnesses) == self.top_k:
+                        # The ties are resolved by the order of the lines: keep it
+                        self.pool = [self.pool[kept] for kept in sorted(order[:rank + 1])]
+                        break
+        self._pruned = len(self.pool)
+
+    @property
+    def lines(self):
+        """The top_k best distinct lines, best first"""
+        if not self.pool:
+            return []
+        return [self.pool[index] for index in distinct_lines(self.pool, self.top_k,
+                                                               self.min_angle)]
+
+
+def get_candidates(processed_lines, top_k=1, min_angle=math.radians(CANDIDATE_MIN_ANGLE)):
     """Parse the results of the parallelization.
-    Finds the line with the highest average hydrophobicity value and determines
-    the range of slices maximizing the accessible residues hydrophobicity,
-    which will point to the famous transmembrane area !
+    Finds the top_k distinct lines with the highest average hydrophobicity
+    values and determines, for each of them, the range of slices of above
+    average hydrophobicity, which will point to the famous transmembrane area !
+    The maximum sub-arrays of the candidates are computed in one batch.
 
         Args:
-            processed_lines: A list containing lines (dictionaries) with their
-                                respective slices infos and values of average
-                                hydrophobicity
+            processed_lines: A list containing blocks of lines (dictionaries)
+                                with their respective slices infos and values
+                                of average hydrophobicity
+            top_k: Number of candidate orientations
+            min_angle: Minimum angle between two candidates, in radians
+
+        Returns:
+            list: Candidates, best first, as lists [(plane_normal,
+                    average_hydrophobicity), start_index, best_index, best,
+                    nb_steps, shortest_distance]
+    """
+    lines = [line for block in processed_lines for line in block]
+    candidates = [lines[index] for index in distinct_lines(lines, top_k, min_angle)]
+    # (candidates x slices) matrix of the scores, centered on the average
+    # of each line: the membrane is the range of slices above the average
+    scores = np.zeros((len(candidates), max(line["nb_steps"] for line in candidates)))
+    for row, line in zip(scores, candidates):
+        slice_hydro = np.ravel(line["slice_hydro"])
+        row[:len(slice_hydro)] = slice_hydro - slice_hydro.mean() if len(slice_hydro) else 0
+    starts, ends, sums = max_sub_arrays(scores)
+    return [[line["line_average_hydro"], int(start), int(end), float(best),
+             line["nb_steps"], line["shortest_distance"]]
+            for line, start, end, best in zip(candidates, starts, ends, sums)]
+
+
+def get_best_results(processed_lines):
+    """Parse the results of the parallelization: best line of
+    :func:`get_candidates`
+
+        Args:
+            processed_lines: A list containing blocks of lines (dictionaries)
+                                with their respective slices infos and values
+                                of average hydrophobicity
         Returns:
             list: [(plane_normal, average_hydrophobicity), start_index,
                     best_index, best, nb_steps, shortest_distance]
     """
-    lines = []
-    best_slices = None
-    nb_steps = None
-    shortest_distance = None
-    # The result of the parallelization is an ImapIterator,
-    # which explains the necessity of doing the double for loop.
-    for index in processed_lines:
-        for line in index:
-            lines.append(line)
-    # Get the best line
-    best_line = max([line["line_average_hydro"]
-                     for line in lines], key=itemgetter(1))
-    # Get the slices of the best line
-    for line in lines:
-        if line["line_average_hydro"] == best_line:
-            best_slices = line["slice_hydro"]
-            nb_steps = line["nb_steps"]
-            shortest_distance = line["shortest_distance"]
-    # Get the indexes of the slices between which there is the maximum hydrophobicity
-    start_index, best_index, best = max_sub_array_sum(best_slices)
-    return [best_line, start_index, best_index, best, nb_steps, shortest_distance]
+    return get_candidates(processed_lines, 1)[0]
+
+
+def membrane_bounds(best_results, resolution):
+    """Distances of both membranes to the nearest c_alpha of the best line
+
+        Args:
+            best_results: The list returned by :func:`get_best_results`
+            resolution: Number in angströms setting the step of sliding.
+
+        Returns:
+            tuple: (dist_m1, dist_m2) in angströms
+    """
+    return resolution * (best_results[1] + 1), resolution * (best_results[2] + 1)
 
 
 def generate_membranes(processed_lines, best_results, resolution):
@@ -210,7 +366,7 @@ def generate_membranes(processed_lines, best_results, resolution):
             best_results: A list [(plane_normal, average_hydrophobicity),
                                     start_index, best_index, best, nb_steps,
                                     shortest_distance]
-            resolution: Integer in angströms setting the step of sliding.
+            resolution: Number in angströms setting the step of sliding.
         Returns:
             tuple: points_membrane_1, points_membrane_2
     """
@@ -221,10 +377,8 @@ def generate_membranes(processed_lines, best_results, resolution):
     start_index = best_results[1]
     best_index = best_results[2]
 
-    # Distance of membrane 1 to best plane (the "far" plane)
-    dist_m1 = resolution * (start_index + 1)
-    # Distance of membrane 2 to best plane (the "far" plane)
-    dist_m2 = resolution * (best_index + 1)
+    # Distances of membranes 1 and 2 to best plane (the "far" plane)
+    dist_m1, dist_m2 = membrane_bounds(best_results, resolution)
 
     plane_normal = np.array([plane_normal.x, plane_normal.y, plane_normal.z])
 
@@ -251,7 +405,8 @@ def generate_membranes(processed_lines, best_results, resolution):
     z2 = (-plane_normal[0] * positions[1] - plane_normal[1]
           * positions[0] - d2) * 1. / plane_normal[2]
 
-    points_membrane_1 = points_membrane_2 = np.zeros((400, 3))
+    points_membrane_1 = np.zeros((400, 3))
+    points_membrane_2 = np.zeros((400, 3))
     points_membrane_1[:, 0] = positions[1]
     points_membrane_1[:, 1] = positions[0]
     points_membrane_1[:, 2] = z1
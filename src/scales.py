@@ -0,0 +1,172 @@
+"""
+.. module:: scales
+  :synopsis: This module defines the hydrophobicity scales scoring the slices.
+                A scale is a lookup table indexed by the integer codes of the
+                residues (see src.protein.RESIDUES), so that the content of
+                the slices is scored with array arithmetic in the scan kernel.
+
+.. moduleauthor:: Gabriel Cretin M2 BIB
+"""
+
+import os
+
+import numpy as np
+from src.protein import RESIDUES, RESIDUE_CODES, UNKNOWN_RESIDUE, HYDROPHOBES
+
+
+# Score of a slice without any residue
+EMPTY_SLICE_SCORE = 0.0
+# Scale of the original program: distinct hydrophobic residue types
+DEFAULT_SCALE = "types"
+
+# Kyte J. & Doolittle R.F. (1982) hydropathy index
+KYTE_DOOLITTLE = {"ALA": 1.8, "ARG": -4.5, "ASN": -3.5, "ASP": -3.5, "CYS": 2.5,
+                  "GLN": -3.5, "GLU": -3.5, "GLY": -0.4, "HIS": -3.2, "ILE": 4.5,
+                  "LEU": 3.8, "LYS": -3.9, "MET": 1.9, "PHE": 2.8, "PRO": -1.6,
+                  "SER": -0.8, "THR": -0.7, "TRP": -0.9, "TYR": -1.3, "VAL": 4.2}
+
+# Wimley W.C. & White S.H. (1996) whole residue octanol scale, with the sign
+# of the free energy of transfer inverted: hydrophobic residues are positive
+WIMLEY_WHITE = {"ALA": -0.50, "ARG": -1.81, "ASN": -0.85, "ASP": -3.64, "CYS": 0.02,
+                "GLN": -0.77, "GLU": -3.63, "GLY": -1.15, "HIS": -2.33, "ILE": 1.12,
+                "LEU": 1.25, "LYS": -2.80, "MET": 0.67, "PHE": 1.71, "PRO": -0.14,
+                "SER": -0.46, "THR": -0.25, "TRP": 2.09, "TYR": 0.71, "VAL": 0.46}
+
+
+class Scale:
+    """
+    .. class:: Scale
+      This class stores a hydrophobicity scale as a lookup table of the
+      residues codes. The score of a slice is the average value of its residues,
+      or for the "types" scale the number of distinct hydrophobic residue types
+      divided by the number of residues (the original scoring of the program).
+
+    Attributes:
+        name: Name of the scale
+        table: (UNKNOWN_RESIDUE + 1,) float array of the values of the residues
+        distinct: True to count the distinct residue types of non zero value
+    """
+
+    __slots__ = ("name", "table", "distinct")
+
+    def __init__(self, name, values, distinct=False):
+        """Creates a scale from a dictionary {3 letters code: value}.
+        The other residues have a value of 0."""
+        self.name = name
+        self.table = np.zeros(UNKNOWN_RESIDUE + 1)
+        for res_name, value in values.items():
+            self.table[RESIDUE_CODES[res_name]] = value
+        self.distinct = distinct
+
+    def weights(self, res_codes):
+        """Columns of the residues counted along the lines
+
+            Args:
+                res_codes: (N,) array of the residues codes
+
+            Returns:
+                Numpy array: (N, C) weights, one-hot types of the residues of
+                                non zero value for a "distinct" scale, and a
+                                single column of values otherwise
+        """
+        if not self.distinct:
+            return self.table[res_codes][:, None]
+        types = np.nonzero(self.table)[0]
+        return (np.asarray(res_codes)[:, None] == types[None, :]).astype(float)
+
+    def score(self, sums, nb_residues):
+        """Scores of the slices from the sums of their weights
+
+            Args:
+                sums: (S, C) sums of the weights of the residues of the slices
+                nb_residues: (S,) number of residues of the slices
+
+            Returns:
+                Numpy array: (S,) scores, EMPTY_SLICE_SCORE for the empty slices
+        """
+        totals = (sums > 0).sum(axis=1) if self.distinct else sums[:, 0]
+        scores = np.full(len(nb_residues), EMPTY_SLICE_SCORE)
+        np.divide(totals, nb_residues, out=scores, where=nb_residues > 0)
+        return scores
+
+
+def read_scale(path):
+    """Read a user-supplied scale: one residue per line, its 3 letters
+    code and its value separated by spaces. Lines starting with # are ignored.
+
+        Args:
+            path: Path to the file of the scale
+
+        Returns:
+            Scale: The scale, named after the file
+    """
+    values = {}
+    with open(path) as scale_file:
+        for number, line in enumerate(scale_file, start=1):
+            fields = line.split("#")[0].split()
+            if not fields:
+                continue
+            if len(fields) != 2 or fields[0].upper() not in RESIDUE_CODES:
+                raise ValueError("{}, line {}: expected a residue code among {} and "
+                                 "a value".format(path, number, ", ".join(RESIDUES)))
+            values[fields[0].upper()] = float(fields[1])
+    return Scale(os.path.splitext(os.path.basename(path))[0], values)
+
+
+SCALES = {"types": Scale("types", {res_name: 1 for res_name in HYDROPHOBES}, distinct=True),
+          "binary": Scale("binary", {res_name: 1 for res_name in HYDROPHOBES}),
+          "kyte-doolittle": Scale("kyte-doolittle", KYTE_DOOLITTLE),
+          "wimley-white": Scale("wimley-white", WIMLEY_WHITE)}
+
+
+def stack_weights(scale_list, res_codes):
+    """Weights of several scales side by side (scales x residues), so that
+    their slices are scored from the same sums along the lines
+
+        Args:
+            scale_list: List of Scale
+            res_codes: (N,) array of the residues codes
+
+        Returns:
+            tuple: ((N, C) weights of all the scales, list of the slices of
+                    the columns of every scale)
+    """
+    weights = [scale.weights(res_codes) for scale in scale_list]
+    ends = np.cumsum([weight.shape[1] for weight in weights])
+    return np.hstack(weights), [slice(end - weight.shape[1], end)
+                                for weight, end in zip(weights, ends)]
+
+
+def get_scales(names):
+    """The scales of a comma separated list (see :func:`get_scale`)
+
+        Args:
+            names: String like "types,kyte-doolittle", or a list of scales
+
+        Returns:
+            list: The Scale objects
+    """
+    if isinstance(names, str):
+        names = [name.strip() for name in names.split(",") if name.strip()]
+    elif isinstance(names, Scale):
+        names = [names]
+    return [get_scale(name) for name in names]
+
+
+def get_scale(scale):
+    """The scale of a name of SCALES or of a file (see :func:`read_scale`)
+
+        Args:
+            scale: A Scale, a name of SCALES or the path to a scale file
+
+        Returns:
+            Scale: The scale
+    """
+    if isinstance(scale, Scale):
+        return scale
+    if scale in SCALES:
+        return SCALES[scale]
+    if os.path.isfile(scale):
+        return read_scale(scale)
+    raise ValueError("Unknown hydrophobicity scale: {} (expected one of {} or a file)".format(
+        scale, ", ".join(SCALES)))
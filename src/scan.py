@@ -0,0 +1,314 @@
+"""
+.. module:: scan
+  :synopsis: This module implements the vectorized scan of the protein along
+                the lines/directions of the hemisphere. The distances between
+                all the accessible c_alphas and all the planes are computed
+                in one NumPy operation instead of one Vector per residue per line,
+                and the slices are windowed sums of a histogram of each line.
+
+.. moduleauthor:: Gabriel Cretin M2 BIB
+"""
+
+from fractions import Fraction
+from functools import reduce
+import math
+
+import numpy as np
+import src.scales as scales
+from src.vector import Vector
+
+
+# The planes are set far away from the protein (500 angströms)
+PLANE_DISTANCE = 500
+# Number of lines processed at once by the vectorized scan
+BLOCK_SIZE = 64
+# Finest bins of the histograms of the lines (0.01 angström)
+MAX_BINS_PER_ANGSTROM = 100
+
+
+def plane_normals(sphere_points):
+    """Scale the points of the hemisphere to get the normals of the planes
+    set far away from the protein
+
+        Args:
+            sphere_points: (M, 3) Numpy array of points of the hemisphere
+
+        Returns:
+            Numpy array: (M, 3) normal vectors of the planes
+    """
+    return np.asarray(sphere_points, dtype=float).reshape(-1, 3) * PLANE_DISTANCE
+
+
+def dist_to_planes(coords, normals):
+    """Vectorized version of :func:`src.vector.Vector.dist_to_plane`:
+    calculates the distances between all the c_alphas and all the planes.
+
+        Args:
+            coords: (N, 3) Numpy array of c_alpha coordinates
+            normals: (M, 3) Numpy array of the normal vectors of the planes
+
+        Returns:
+            Numpy array: (M, N) distances, one row per plane
+    """
+    # A plane equation is: a*x+b*y+c*z+d = 0
+    # [a,b,c] is the normal. Thus, we have to calculate d
+    d = -np.einsum('ij,ij->i', normals, normals)
+    numerator = np.abs(normals @ np.asarray(coords, dtype=float).T + d[:, None])
+    return numerator / np.sqrt(-d)[:, None]
+
+
+def bin_width(*lengths):
+    """Width of the histogram bins: the largest width dividing all the given
+    thicknesses and resolutions, so that the slices start and end on bin edges.
+    The lengths are rounded to a multiple of 1 / MAX_BINS_PER_ANGSTROM angström,
+    so the width is at least 1 / MAX_BINS_PER_ANGSTROM angström.
+
+        Args:
+            lengths: Thicknesses and resolutions, in angströms
+
+        Returns:
+            float: The width of the bins, in angströms
+    """
+    # Multiples of 1 / MAX_BINS_PER_ANGSTROM: the width is never finer
+    fractions = [Fraction(max(1, round(length * MAX_BINS_PER_ANGSTROM)), MAX_BINS_PER_ANGSTROM)
+                 for length in lengths]
+    numerator = reduce(math.gcd, (fraction.numerator for fraction in fractions))
+    denominator = reduce(lambda a, b: a * b // math.gcd(a, b),
+                         (fraction.denominator for fraction in fractions))
+    return numerator / denominator
+
+
+def line_histogram(distances, weights, width):
+    """Bin the c_alphas of one line along the line, and sum cumulatively
+    the residues and their weights in the bins. Every slice
+    profile of the line whose thickness and resolution are multiples of
+    the width is then derived from this in O(1) per slice.
+
+        Args:
+            distances: (N,) distances between the c_alphas and the far plane
+            weights: (N, C) weights of the residues given by
+                        :meth:`src.scales.Scale.weights`
+            width: Width of the bins, in angströms (:func:`bin_width`)
+
+        Returns:
+            tuple: (cumulative_counts, shortest_distance, longest_distance)
+                    where cumulative_counts[b] counts the residues (last column)
+                    and sums the weights of the bins before b
+    """
+    shortest_distance = distances.min()
+    longest_distance = distances.max()
+    bins = np.floor((distances - shortest_distance) / width).astype(np.int64)
+    nb_bins = int(bins.max()) + 1
+    # One column per weight, and one for all the residues
+    nb_columns = weights.shape[1] + 1
+    columns = np.arange(nb_columns)
+    all_weights = np.empty((len(bins), nb_columns))
+    all_weights[:, :-1] = weights
+    all_weights[:, -1] = 1
+    histogram = np.bincount((bins[:, None] * nb_columns + columns).ravel(),
+                            weights=all_weights.ravel(), minlength=nb_bins * nb_columns)
+    cumulative_counts = np.zeros((nb_bins + 1, nb_columns))
+    np.cumsum(histogram.reshape(nb_bins, nb_columns), axis=0, out=cumulative_counts[1:])
+    return cumulative_counts, shortest_distance, longest_distance
+
+
+def slab_counts(line, thickness, resolution, width):
+    """Windowed sums of the bins of all the slices of a binned line, given by
+    the difference of the cumulative counts at the edges of the slices.
+
+        Args:
+            line: The tuple returned by :func:`line_histogram`
+            thickness: Number for the desired thickness of the slices, in angströms
+            resolution: Number in angströms setting the step of sliding.
+            width: Width of the bins of the line, in angströms
+
+        Returns:
+            tuple: ((nb_steps, C + 1) sums of the weights of the slices, the
+                    number of residues in the last column, nb_steps)
+    """
+    cumulative_counts, shortest_distance, longest_distance = line
+    nb_steps = math.ceil((longest_distance - shortest_distance) / resolution)
+
+    # Bins of the first and last + 1 bins of every slice
+    lower = np.arange(nb_steps) * round(resolution / width)
+    upper = np.minimum(lower + round(thickness / width), len(cumulative_counts) - 1)
+    return cumulative_counts[upper] - cumulative_counts[lower], nb_steps
+
+
+def histogram_profile(line, thickness, resolution, width, scale):
+    """Relative hydrophobicity of all the slices of a binned line: the content
+    of a slice is the windowed sum of its bins, given by the difference of
+    the cumulative counts at its edges.
+
+        Args:
+            line: The tuple returned by :func:`line_histogram`
+            thickness: Number for the desired thickness of the slices, in angströms
+            resolution: Number in angströms setting the step of sliding.
+            width: Width of the bins of the line, in angströms
+            scale: :class:`src.scales.Scale` scoring the slices
+
+        Returns:
+            tuple: (slice_hydro, nb_steps)
+    """
+    counts, nb_steps = slab_counts(line, thickness, resolution, width)
+    # The empty slices have a score of EMPTY_SLICE_SCORE
+    slice_hydro = scale.score(counts[:, :-1], counts[:, -1]).reshape(-1, 1)
+    return slice_hydro, nb_steps
+
+
+def slice_profile(distances, weights, thickness, resolution, scale):
+    """Calculate the relative hydrophobicity of all the slices of one line.
+    The slice slides from the nearest c_alpha to the farthest one.
+
+    The c_alphas are binned once in a histogram (:func:`line_histogram`) with
+    bins as wide as the largest common divisor of the thickness and the
+    resolution, which costs O(N + nb_bins) instead of a scan of every residue
+    for every step, and allows sub-angström resolutions.
+
+        Args:
+            distances: (N,) distances between the c_alphas and the far plane
+            weights: (N, C) weights of the residues given by scale
+            thickness: Number for the desired thickness of the slices, in angströms
+            resolution: Number in angströms setting the step of sliding.
+            scale: :class:`src.scales.Scale` scoring the slices
+
+        Returns:
+            tuple: (slice_hydro, nb_steps, shortest_distance)
+    """
+    width = bin_width(thickness, resolution)
+    line = line_histogram(distances, weights, width)
+    slice_hydro, nb_steps = histogram_profile(line, thickness, resolution, width, scale)
+    return slice_hydro, nb_steps, line[1]
+
+
+def make_line(normal, slice_hydro, nb_steps, shortest_distance):
+    """Dictionary of a processed line, as expected by :func:`src.protein.get_best_results`
+
+        Args:
+            normal: (3,) normal vector of the far plane of the line
+            slice_hydro: Relative hydrophobicity of the slices
+            nb_steps: Number of slices
+            shortest_distance: Distance between the nearest c_alpha and the plane
+
+        Returns:
+            dict: The processed line
+    """
+    # Calculate the hydrophobicity factor of the line
+    line_average_hydro = np.sum(slice_hydro) * nb_steps**2
+    return {"slice_hydro": slice_hydro,
+            "line_average_hydro": (Vector(*normal), line_average_hydro),
+            "nb_steps": nb_steps,
+            "shortest_distance": shortest_distance}
+
+
+def scan_lines(prot, thickness, resolution, sphere_points, scale=scales.DEFAULT_SCALE):
+    """Process a block of lines of the hemisphere at once.
+    The whole projection matrix of the block is computed in one operation.
+
+        Args:
+            prot: :class:`src.protein.Protein` of the accessible c_alphas,
+                    centered on the center of mass
+            thickness: Number for the desired thickness of the slices, in angströms
+            resolution: Number in angströms setting the step of sliding.
+            sphere_points: (M, 3) Numpy array of points of the hemisphere.
+                            Iterative argument for the parallelization.
+            scale: Hydrophobicity scale (see :func:`src.scales.get_scale`)
+
+        Returns:
+            list: The processed lines, as dictionaries with the same keys as
+                    the ones expected by :func:`src.protein.get_best_results`
+    """
+    return scan_lines_scales(prot, thickness, resolution, sphere_points,
+                             [scales.get_scale(scale)])[0]
+
+
+def scan_lines_scales(prot, thickness, resolution, sphere_points, scale_list):
+    """Process a block of lines for several hydrophobicity scales in one pass:
+    the c_alphas of a line are binned once with the weights of all the scales
+    side by side (:func:`src.scales.stack_weights`), and every scale scores
+    its columns of the same windowed sums.
+
+        Args:
+            prot: :class:`src.protein.Protein` of the accessible c_alphas,
+                    centered on the center of mass
+            thickness: Number for the desired thickness of the slices, in angströms
+            resolution: Number in angströms setting the step of sliding.
+            sphere_points: (M, 3) Numpy array of points of the hemisphere.
+            scale_list: List of :class:`src.scales.Scale`
+
+        Returns:
+            list: For every scale, the processed lines
+    """
+    weights, columns = scales.stack_weights(scale_list, prot.res_codes)
+    width = bin_width(thickness, resolution)
+    normals = plane_normals(sphere_points)
+    distances = dist_to_planes(prot.coords, normals)
+    lines = [[] for _ in scale_list]
+    for normal, line_distances in zip(normals, distances):
+        histogram = line_histogram(line_distances, weights, width)
+        counts, nb_steps = slab_counts(histogram, thickness, resolution, width)
+        for scale, scale_columns, scale_lines in zip(scale_list, columns, lines):
+            # The empty slices have a score of EMPTY_SLICE_SCORE
+            slice_hydro = scale.score(counts[:, scale_columns], counts[:, -1]).reshape(-1, 1)
+            scale_lines.append(make_line(normal, slice_hydro, nb_steps, histogram[1]))
+    return lines
+
+
+def reduce_lines(prot, thickness, resolution, sphere_points, reducers, scale_list):
+    """Scan the lines by blocks of BLOCK_SIZE lines and only keep the best ones:
+    the memory is bounded by the size of a block, whatever the number of lines.
+
+        Args:
+            prot: :class:`src.protein.Protein` of the accessible c_alphas,
+                    centered on the center of mass
+            thickness: Number for the desired thickness of the slices, in angströms
+            resolution: Number in angströms setting the step of sliding.
+            sphere_points: (M, 3) Numpy array of points of the hemisphere.
+            reducers: One :class:`src.protein.TopLines` per scale, receiving
+                        the processed lines
+            scale_list: List of :class:`src.scales.Scale`, scored in one pass
+
+        Returns:
+            int: The number of slices evaluated
+    """
+    nb_slices = 0
+    for first in range(0, len(sphere_points), BLOCK_SIZE):
+        lines = scan_lines_scales(prot, thickness, resolution,
+                                  sphere_points[first:first + BLOCK_SIZE], scale_list)
+        nb_slices += sum(line["nb_steps"] for line in lines[0])
+        for reducer, scale_lines in zip(reducers, lines):
+            reducer.extend(scale_lines)
+    return nb_slices
+
+
+def sweep_lines(prot, combinations, sphere_points, scale=scales.DEFAULT_SCALE):
+    """Process a block of lines for many (thickness, resolution) combinations.
+    The projections of a line are computed and binned once, and the profiles
+    of all the combinations are derived from the same cumulative histogram.
+
+        Args:
+            prot: :class:`src.protein.Protein` of the accessible c_alphas,
+                    centered on the center of mass
+            combinations: List of (thickness, resolution) tuples
+            sphere_points: (M, 3) Numpy array of points of the hemisphere.
+            scale: Hydrophobicity scale (see :func:`src.scales.get_scale`)
+
+        Returns:
+            list: For each combination, the best processed line of the block
+    """
+    scale = scales.get_scale(scale)
+    weights = scale.weights(prot.res_codes)
+    normals = plane_normals(sphere_points)
+    distances = dist_to_planes(prot.coords, normals)
+    # The bins are shared by all the combinations
+    width = bin_width(*(length for combination in combinations for length in combination))
+    best_lines = [None] * len(combinations)
+    for normal, line_distances in zip(normals, distances):
+        histogram = line_histogram(line_distances, weights, width)
+        for index, (thickness, resolution) in enumerate(combinations):
+            line = make_line(normal, *histogram_profile(histogram, thickness, resolution,
+                                                        width, scale), histogram[1])
+            if best_lines[index] is None or \
+                    line["line_average_hydro"][1] > best_lines[index]["line_average_hydro"][1]:
+                best_lines[index] = line
+    return best_lines
@@ -0,0 +1,80 @@
+"""
+.. module:: search
+  :synopsis: This module implements the coarse-to-fine adaptive search of the
+                best direction: a coarse scan of the hemisphere, then denser
+                patches of directions around the best ones, with a halved
+                angle at each round.
+
+.. moduleauthor:: Gabriel Cretin M2 BIB
+"""
+
+import numpy as np
+import src.profiling as profiling
+import src.protein as protein
+import src.scales as scales
+import src.scan as scan
+import src.sphere as sphere
+
+
+def line_direction(line):
+    """Unit direction of a processed line"""
+    normal = line["line_average_hydro"][0]
+    direction = np.array([normal.x, normal.y, normal.z], dtype=float)
+    return direction / np.linalg.norm(direction)
+
+
+def top_directions(lines, top_k, min_angle):
+    """Directions of the top_k best lines, at least min_angle apart
+
+        Args:
+            lines: The processed lines
+            top_k: Maximum number of directions
+            min_angle: Minimum angle between two directions, in radians
+
+        Returns:
+            list: Unit directions, best first
+    """
+    return [line_direction(lines[index])
+            for index in protein.distinct_lines(lines, top_k, min_angle)]
+
+
+def adaptive_search(prot, thickness, resolution, nb_points=100, precision=1.0,
+                    top_k=3, patch_points=20, nb_candidates=1, scale=scales.DEFAULT_SCALE):
+    """Coarse-to-fine search of the best line. The hemisphere is first scanned
+    with nb_points lines, then patches of patch_points lines are scanned around
+    the top_k best directions, the angle of the patches being halved at each
+    round until it reaches the precision.
+
+        Args:
+            prot: Protein centered on its center of mass
+            thickness: Number for the desired thickness of the slices, in angströms
+            resolution: Number in angströms setting the step of sliding.
+            nb_points: Number of points of the coarse scan of the hemisphere
+            precision: Angular precision to reach, in degrees
+            top_k: Number of directions refined at each round
+            patch_points: Number of lines of each patch
+            nb_candidates: Number of candidate orientations returned
+            scale: Hydrophobicity scale (see :func:`src.scales.get_scale`)
+
+        Returns:
+            tuple: (candidates, nb_lines) the list returned by
+                    :func:`src.protein.get_candidates` and the number
+                    of lines evaluated
+    """
+    profiler = profiling.current()
+    scale = scales.get_scale(scale)
+    with profiler.kernel():
+        lines = scan.scan_lines(prot, thickness, resolution,
+                                sphere.generate_points_on_sphere(nb_points), scale)
+    nb_lines = len(lines)
+    angle = sphere.point_spacing(nb_points)
+    while np.degrees(angle) > precision:
+        centers = top_directions(lines, top_k, angle)
+        patches = np.vstack([sphere.generate_points_around(center, angle, patch_points)
+                             for center in centers])
+        with profiler.kernel():
+            lines.extend(scan.scan_lines(prot, thickness, resolution, patches, scale))
+        nb_lines += len(patches)
+        angle /= 2
+    profiler.count_lines([lines])
+    return protein.get_candidates([lines], nb_candidates), nb_lines
@@ -1,7 +1,8 @@
 """
 .. module:: sphere
-  :synopsis: This module contains the function that generates of points
-                evenly distributed at the surface of a hemisphere.
+  :synopsis: This module contains the functions that generate points
+                evenly distributed at the surface of a hemisphere,
+                or of a small cap around a direction.
 
 .. moduleauthor:: Gabriel Cretin M2 BIB
 """
@@ -10,13 +11,14 @@ import numpy as np
 from src.vector import *
 
 
-def generate_points_on_sphere(num_points):
+def generate_points_on_sphere(num_points, hemisphere=True):
     """Generate *num_points* points evenly distributed on a hemisphere,
     centered on the center of mass of the protein thanks to the
     golden angle 3 - sqrt(5).
 
     Args:
         num_points: Number of desired points on the hemisphere
+        hemisphere: If False, the points cover the whole sphere
 
     Returns:
         A Numpy array of n 3D cartesian coordinates centered on (0,0,0)
@@ -25,7 +27,10 @@ def generate_points_on_sphere(num_points):
     indices = np.arange(0, num_points, dtype=float) + 0.5
     golden_angle = np.pi * (3 - np.sqrt(5))
     # We need only points on an hemisphere instead of whole sphere.
-    phi = np.arccos(1 - indices / num_points)
+    if hemisphere:
+        phi = np.arccos(1 - indices / num_points)
+    else:
+        phi = np.arccos(1 - 2 * indices / num_points)
     theta = golden_angle * indices
 
     # Translate the spherical coordinates to cartesian 3D coordinates (x, y, z)
@@ -35,3 +40,47 @@ def generate_points_on_sphere(num_points):
     points[:, 1] = np.sin(theta) * np.sin(phi)
     points[:, 2] = np.cos(phi)
     return points
+
+
+def point_spacing(num_points):
+    """Approximate angle (radians) between neighbor points of
+    :func:`generate_points_on_sphere` on the hemisphere
+
+    Args:
+        num_points: Number of points on the hemisphere
+
+    Returns:
+        float: The angular spacing of the points
+    """
+    # Each point covers an equal part of the 2 * pi steradians of the hemisphere
+    return np.sqrt(2 * np.pi / num_points)
+
+
+def generate_points_around(direction, angle, num_points):
+    """Generate *num_points* points evenly distributed with the golden angle
+    on the spherical cap of half-angle *angle* centered on *direction*.
+
+    Args:
+        direction: 3D coordinates of the center of the cap
+        angle: Half-angle of the cap, in radians
+        num_points: Number of desired points on the cap
+
+    Returns:
+        A Numpy array of n unit 3D cartesian coordinates
+    """
+    direction = np.asarray(direction, dtype=float)
+    direction = direction / np.linalg.norm(direction)
+    indices = np.arange(0, num_points, dtype=float) + 0.5
+    golden_angle = np.pi * (3 - np.sqrt(5))
+    phi = np.arccos(1 - (1 - np.cos(angle)) * indices / num_points)
+    theta = golden_angle * indices
+
+    # Orthonormal basis (u, v, direction): the cap is generated around
+    # the z axis and rotated on the direction
+    helper = np.array([1.0, 0, 0]) if abs(direction[0]) < 0.9 else np.array([0, 1.0, 0])
+    u = np.cross(direction, helper)
+    u /= np.linalg.norm(u)
+    v = np.cross(direction, u)
+    return (np.outer(np.cos(theta) * np.sin(phi), u)
+            + np.outer(np.sin(theta) * np.sin(phi), v)
+            + np.outer(np.cos(phi), direction))
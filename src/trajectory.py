@@ -0,0 +1,159 @@
+"""
+.. module:: trajectory
+  :synopsis: This module predicts the membrane of every model of a multi-model
+                structure (NMR ensemble) or of every frame of a trajectory
+                stream. The search of a frame is seeded with the best direction
+                of the previous frame: only a patch of lines around it is
+                scanned, and the whole hemisphere is scanned again only when
+                the hydrophobicity factor drops.
+
+.. moduleauthor:: Gabriel Cretin M2 BIB
+"""
+
+from datetime import datetime
+import math
+import sys
+import traceback
+
+import numpy as np
+import src.accessibility as accessibility
+import src.batch as batch
+import src.loader as loader
+import src.pipeline as pipeline
+import src.protein as protein
+import src.scales as scales
+import src.sphere as sphere
+
+
+# Columns of the CSV output, one row per frame
+TRAJECTORY_FIELDS = ["frame", "status", "mode", "nb_accessible_residues",
+                     "direction_x", "direction_y", "direction_z", "point_x", "point_y", "point_z",
+                     "center_of_mass_x", "center_of_mass_y", "center_of_mass_z",
+                     "hydrophobicity", "start_slice", "end_slice", "nb_steps", "membrane_start",
+                     "membrane_end", "angle_change", "nb_lines", "scale", "runtime", "error"]
+
+
+def unit_direction(best_results):
+    """Unit direction of the best line"""
+    normal = best_results[0][0]
+    direction = np.array([normal.x, normal.y, normal.z], dtype=float)
+    return direction / np.linalg.norm(direction)
+
+
+def best_line(prot, thickness, resolution, sphere_points, scale):
+    """Best line among the lines of the given points (serial scan)"""
+    return protein.get_best_results(
+        pipeline.scan_protein(prot, thickness, resolution, sphere_points, scale=scale))
+
+
+def track_frames(frames, thickness=15, resolution=5, nb_points=250, local_angle=10,
+                 local_points=50, rescan_drop=0.1, scale=scales.DEFAULT_SCALE,
+                 sasa_engine="naccess", naccess=None, per_chain=False, accessibility_once=False):
+    """Predict the membrane of every frame, warm-starting each search from
+    the best direction of the previous frame.
+    The first frame, and every frame whose local best hydrophobicity factor is
+    more than rescan_drop below the one of the previous frame, are scanned
+    on the whole hemisphere.
+
+        Args:
+            frames: Iterable of :class:`src.loader.Atoms`, one per frame
+            thickness: Number for the desired thickness of the slices, in angströms
+            resolution: Number in angströms setting the step of sliding.
+            nb_points: Number of points of the full scans of the hemisphere
+            local_angle: Angle of the patch scanned around the previous direction,
+                            in degrees
+            local_points: Number of lines of the patch
+            rescan_drop: Relative drop of the hydrophobicity factor triggering
+                            a full scan
+            scale: Hydrophobicity scale (see :func:`src.scales.get_scale`)
+            sasa_engine: "naccess" or "shrake-rupley"
+            naccess: Absolute path to local naccess binary, or None
+            per_chain: Run NACCESS once per chain, the chains concurrently
+            accessibility_once: Compute the accessible residues on the first
+                                frame only, and reuse them for all the frames
+
+        Yields:
+            dict: The record of every frame, in the order of the frames
+    """
+    scale = scales.get_scale(scale)
+    sphere_points = sphere.generate_points_on_sphere(nb_points)
+    accessible_residues = None
+    previous = None
+    for frame, atoms in enumerate(frames):
+        start_time = datetime.now()
+        try:
+            if accessibility_once and accessible_residues is None:
+                accessible_residues = protein.keep_accessible_residues(
+                    accessibility.compute_rsa(atoms, sasa_engine, naccess=naccess,
+                                              per_chain=per_chain))
+            prot, center_of_mass = pipeline.protein_from_atoms(
+                atoms, sasa_engine, naccess, accessible_residues, per_chain)
+            prot = protein.scale_ca_coords(prot, center_of_mass)
+
+            mode = "full"
+            nb_lines = 0
+            best_results = None
+            if previous is not None:
+                previous_direction, previous_score = previous
+                patch = np.vstack([previous_direction, sphere.generate_points_around(
+                    previous_direction, math.radians(local_angle), local_points)])
+                best_results = best_line(prot, thickness, resolution, patch, scale)
+                nb_lines += len(patch)
+                mode = "local"
+                if best_results[0][1] < previous_score - rescan_drop * abs(previous_score):
+                    mode = "rescan"
+            if mode != "local":
+                full_results = best_line(prot, thickness, resolution, sphere_points, scale)
+                nb_lines += nb_points
+                if best_results is None or full_results[0][1] > best_results[0][1]:
+                    best_results = full_results
+
+            direction = unit_direction(best_results)
+            record = pipeline.result_record(None, prot, center_of_mass, best_results, nb_lines,
+                                            (datetime.now() - start_time).total_seconds())
+            del record["file"]
+            dist_m1, dist_m2 = protein.membrane_bounds(best_results, resolution)
+            # The lines are not oriented: d and -d are the same line
+            angle_change = math.degrees(math.acos(min(1.0, abs(float(
+                np.dot(direction, previous[0])))))) if previous is not None else None
+            record.update(frame=frame, mode=mode, scale=scale.name, direction=direction.tolist(),
+                          membrane_start=float(dist_m1), membrane_end=float(dist_m2),
+                          angle_change=angle_change)
+            previous = (direction, best_results[0][1])
+        except (Exception, SystemExit) as err:
+            record = {"frame": frame, "status": "error",
+                      "error": "".join(traceback.format_exception_only(type(err), err)).strip()}
+        yield record
+
+
+def run_trajectory(source, output, output_format="jsonl", **parameters):
+    """Process all the frames of a multi-model structure or stream, and write
+    the time series of the orientations, one record per frame as soon as
+    the frame is processed
+
+        Args:
+            source: Path to the structure file, "-" for the standard input
+            output: Path of the output file, or "-" for the standard output
+            output_format: "jsonl" or "csv"
+            parameters: Keyword arguments of :func:`track_frames`
+
+        Returns:
+            tuple: (number of frames processed, number of failures,
+                    number of full scans)
+    """
+    frames = loader.iter_models(sys.stdin.buffer if source == "-" else source)
+    file_out = sys.stdout if output == "-" else open(output, "w", newline="")
+    write = batch.record_writer(file_out, output_format, TRAJECTORY_FIELDS)
+    nb_ok = nb_errors = nb_full_scans = 0
+    try:
+        for record in track_frames(frames, **parameters):
+            write(record)
+            if record["status"] == "ok":
+                nb_ok += 1
+                nb_full_scans += record["mode"] != "local"
+            else:
+                nb_errors += 1
+    finally:
+        if file_out is not sys.stdout:
+            file_out.close()
+    return nb_ok, nb_errors, nb_full_scans
@@ -0,0 +1,56 @@
+"""Structures shared by the tests"""
+
+import os
+
+import pytest
+import src.loader as loader
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+# Columns of the atom_site loop written by write_mmcif
+ATOM_SITE = ["group_PDB", "id", "type_symbol", "label_atom_id", "label_alt_id", "label_comp_id",
+             "label_asym_id", "label_seq_id", "pdbx_PDB_ins_code", "Cartn_x", "Cartn_y",
+             "Cartn_z", "occupancy", "B_iso_or_equiv", "auth_seq_id", "auth_comp_id",
+             "auth_asym_id", "auth_atom_id", "pdbx_PDB_model_num"]
+
+
+def cif_value(value):
+    """A value of a mmCIF row, quoted if needed"""
+    value = str(value).strip()
+    if not value:
+        return "."
+    if "'" in value:
+        return '"{}"'.format(value)
+    return value
+
+
+def write_mmcif(models, file_out):
+    """Write models (lists of Atoms) as the atom_site loop of a mmCIF file"""
+    file_out.write("data_test\n#\nloop_\n")
+    for name in ATOM_SITE:
+        file_out.write("_atom_site.{}\n".format(name))
+    serial = 0
+    for number, atoms in enumerate(models, start=1):
+        for coords, name, element, res_name, chain_id, res_id, icode, hetero in zip(
+                atoms.coords, atoms.names, atoms.elements, atoms.res_names, atoms.chains,
+                atoms.res_ids, atoms.icodes, atoms.hetero):
+            serial += 1
+            row = ["HETATM" if hetero else "ATOM", serial, element, name, ".", res_name,
+                   chain_id, res_id, icode if icode.strip() else "?",
+                   "{:.3f}".format(coords[0]), "{:.3f}".format(coords[1]),
+                   "{:.3f}".format(coords[2]), "1.00", "0.00", res_id, res_name, chain_id,
+                   name, number]
+            file_out.write(" ".join(cif_value(value) for value in row) + "\n")
+    file_out.write("#\n")
+
+
+@pytest.fixture
+def mmcif_copy(tmp_path):
+    """Function writing the mmCIF copy of a PDB file of DATA_DIR, and returning its path"""
+    def copy(name, suffix=".cif"):
+        path = str(tmp_path / (os.path.splitext(name)[0] + suffix))
+        with open(path, "w") as file_out:
+            write_mmcif(list(loader.iter_models(os.path.join(DATA_DIR, name))), file_out)
+        return path
+    return copy
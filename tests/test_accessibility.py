@@ -0,0 +1,83 @@
+"""Tests of the built-in Shrake-Rupley engine"""
+
+import os
+
+import numpy as np
+import pytest
+import src.accessibility as accessibility
+import src.loader as loader
+import src.protein as protein
+import src.sphere as sphere
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+TESTS_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+@pytest.fixture(scope="module")
+def globular_atoms():
+    atoms = loader.load_structure(os.path.join(DATA_DIR, "1uw3_globular.pdb"))
+    atoms = atoms.select(~atoms.hetero)
+    radii = np.array([accessibility.atom_radius(name, element, res_name) for name, element,
+                      res_name in zip(atoms.names, atoms.elements, atoms.res_names)])
+    return atoms, radii
+
+
+def read_reference(path):
+    reference = {}
+    with open(path) as file_in:
+        for line in file_in:
+            if not line.startswith("#"):
+                chain_id, residue, res_name, relative = line.split()
+                reference[(chain_id, int(residue))] = (res_name, float(relative))
+    return reference
+
+
+def test_relative_accessibility_matches_reference():
+    rsa = accessibility.shrake_rupley(
+        loader.load_structure(os.path.join(DATA_DIR, "1uw3_globular.pdb")))
+    reference = read_reference(os.path.join(TESTS_DATA_DIR, "1uw3_globular.rsa"))
+
+    assert {(chain_id, res_id[1]) for chain_id, res_id in rsa} == set(reference)
+    for (chain_id, res_id), values in rsa.items():
+        res_name, relative = reference[(chain_id, res_id[1])]
+        assert values["res_name"] == res_name
+        assert values["all_atoms_rel"] == pytest.approx(relative, abs=0.5)
+    assert len(protein.keep_accessible_residues(rsa)) == sum(
+        relative > protein.ACCESSIBILITY_THRESHOLD for _, relative in reference.values())
+
+
+@pytest.mark.parametrize("batch", [(0, 512), (300, 301), (700, 1000)])
+def test_neighbor_pairs_match_brute_force(globular_atoms, batch):
+    atoms, radii = globular_atoms
+    radii = radii + 1.4
+    first, last = batch
+    last = min(last, len(atoms))
+    atoms_i, atoms_j = accessibility.neighbor_pairs(
+        atoms.coords, radii, first, last, accessibility.cell_grid(atoms.coords, radii))
+
+    distances = np.linalg.norm(atoms.coords[first:last, None] - atoms.coords[None], axis=2)
+    overlap = distances < radii[first:last, None] + radii[None]
+    overlap[np.arange(last - first), np.arange(first, last)] = False
+    expected_i, expected_j = np.nonzero(overlap)
+    assert (np.diff(atoms_i) >= 0).all()
+    assert sorted(zip(atoms_i, atoms_j)) == sorted(zip(expected_i + first, expected_j))
+
+
+def test_atoms_sasa_matches_brute_force(globular_atoms):
+    atoms, radii = globular_atoms
+    coords, radii = atoms.coords[:400], radii[:400]
+    unit_points = sphere.generate_points_on_sphere(50, hemisphere=False)
+    expanded = radii + 1.4
+    expected = np.empty(len(coords))
+    for atom, (center, radius) in enumerate(zip(coords, expanded)):
+        points = center + radius * unit_points
+        distances = np.linalg.norm(points[:, None] - coords[None], axis=2)
+        inside = distances < expanded[None]
+        inside[:, atom] = False
+        expected[atom] = 4 * np.pi * radius**2 * (~inside.any(axis=1)).sum() / 50
+
+    assert np.allclose(accessibility.atoms_sasa(coords, radii, 1.4, 50, batch_size=64), expected)
+    # An isolated atom is fully accessible
+    assert accessibility.atoms_sasa(coords[:1], radii[:1])[0] == \
+        pytest.approx(4 * np.pi * (radii[0] + 1.4)**2)
@@ -0,0 +1,22 @@
+"""Tests of the on-disk cache of the accessible residues"""
+
+import os
+
+import numpy as np
+import src.cache as cache
+from src.protein import Protein
+from src.vector import Vector
+
+
+def test_evict_keeps_the_entries_being_written(tmp_path):
+    prot = Protein(np.zeros((2, 3)), np.zeros(2, dtype=np.int8), np.array(["A", "A"]),
+                   np.array([1, 2]), np.ones(2))
+    cache.store(str(tmp_path), "old", prot, Vector(0, 0, 0), max_size=1 << 20)
+    # Entry of a concurrent run, not renamed yet
+    writing = tmp_path / ("tmpentry" + cache.TMP_EXTENSION)
+    writing.write_bytes(b"\0" * 1000)
+
+    cache.evict(str(tmp_path), 0)
+
+    assert not os.path.exists(cache.entry_path(str(tmp_path), "old"))
+    assert writing.exists()
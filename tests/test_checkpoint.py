@@ -0,0 +1,59 @@
+"""Tests of the checkpointed scans"""
+
+import os
+import pickle
+
+import pytest
+import src.checkpoint as checkpoint
+import src.executors as executors
+import src.pipeline as pipeline
+import src.protein as protein
+import src.scales as scales
+import src.sphere as sphere
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+@pytest.fixture(scope="module")
+def globular():
+    prot, center_of_mass = pipeline.load_protein(os.path.join(DATA_DIR, "1uw3_globular.pdb"),
+                                                 "shrake-rupley")
+    return protein.scale_ca_coords(prot, center_of_mass)
+
+
+def candidates(lines, top_k):
+    return [[(candidate[0][1], candidate[1], candidate[2])
+             for candidate in protein.get_candidates(scale_lines, top_k)]
+            for scale_lines in lines]
+
+
+def test_resumed_scan_equals_uninterrupted_scan(globular, tmp_path):
+    sphere_points = sphere.generate_points_on_sphere(500)
+    scale_list = scales.get_scales("binary,kyte-doolittle")
+    top_k = 3
+    expected = candidates(executors.scan_scales(globular, 15, 5, sphere_points, scale_list,
+                                                top_k, "serial"), top_k)
+
+    lines, nb_resumed = checkpoint.checkpointed_scan(
+        globular, 15, 5, sphere_points, scale_list, str(tmp_path), top_k, "serial",
+        chunk_size=100, keep=True)
+    assert nb_resumed == 0
+    assert candidates(lines, top_k) == expected
+    path, = tmp_path.iterdir()
+
+    # Killed while writing the third range: the first two ranges are resumed
+    with open(path, "r+b") as file_out:
+        ends = []
+        for _ in range(5):
+            pickle.load(file_out)
+            ends.append(file_out.tell())
+        assert ends[-1] == path.stat().st_size
+        file_out.truncate((ends[1] + ends[2]) // 2)
+    lines, nb_resumed = checkpoint.checkpointed_scan(
+        globular, 15, 5, sphere_points, scale_list, str(tmp_path), top_k, "threads", jobs=2,
+        chunk_size=100)
+    assert nb_resumed == 200
+    assert candidates(lines, top_k) == expected
+    # The finished scan removes its checkpoint
+    assert not list(tmp_path.iterdir())
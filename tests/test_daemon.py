@@ -0,0 +1,68 @@
+"""Tests of the back-pressure, the timeouts and the validation of the daemon"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+
+import pytest
+import src.daemon as daemon
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+PDB_FILE = os.path.join(DATA_DIR, "1uw3_globular.pdb")
+SETTINGS = {"sasa_engine": "shrake-rupley", "naccess": None, "cache_dir": None,
+            "cache_size": 1, "per_chain": False}
+
+
+@pytest.fixture
+def pool():
+    pool = daemon.WarmPool(SETTINGS, processes=1, max_queue=1, timeout=60)
+    try:
+        yield pool
+    finally:
+        pool.close()
+
+
+def wait_until(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_invalid_jobs_are_rejected(pool):
+    for request in ({"file": PDB_FILE, "scale": "nope"},
+                    {"file": PDB_FILE, "points": 0},
+                    {"file": PDB_FILE, "timeout": -1},
+                    {"file": os.path.join(DATA_DIR, "missing.pdb")},
+                    {"points": 10},
+                    {"pdb_base64": "not base64!"}):
+        code, record = daemon.answer(pool, request)
+        assert code == 400, request
+        assert record["status"] == "error"
+    assert pool.status()["done"] == pool.status()["errors"] == 0
+
+
+def test_full_queue_and_timeout(pool):
+    slow = {"file": PDB_FILE, "points": 1000000, "resolution": 0.5, "timeout": 0.5}
+    fast = {"file": PDB_FILE, "points": 50}
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        slow_answer = executor.submit(daemon.answer, pool, slow)
+        # The worker runs the slow job, and the fast one fills the queue
+        wait_until(lambda: pool.jobs.unfinished_tasks == 1 and pool.jobs.qsize() == 0)
+        queued_answer = executor.submit(daemon.answer, pool, fast)
+        wait_until(lambda: pool.jobs.qsize() == 1)
+
+        code, record = daemon.answer(pool, fast)
+        assert code == 503 and record["status"] == "busy"
+
+        code, record = slow_answer.result()
+        assert code == 504 and record["status"] == "timeout"
+        # The stalled worker was replaced: the queued job runs
+        code, record = queued_answer.result()
+        assert code == 200 and record["status"] == "ok"
+
+    assert daemon.answer(pool, fast)[0] == 200
+    status = pool.status()
+    assert (status["done"], status["timeouts"], status["errors"], status["rejected"]) == \
+        (2, 1, 0, 1)
@@ -0,0 +1,52 @@
+"""Tests of the backends of the scan"""
+
+import os
+
+import pytest
+import src.executors as executors
+import src.pipeline as pipeline
+import src.protein as protein
+import src.scales as scales
+import src.sphere as sphere
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+@pytest.fixture(scope="module")
+def globular():
+    prot, center_of_mass = pipeline.load_protein(os.path.join(DATA_DIR, "1uw3_globular.pdb"),
+                                                 "shrake-rupley")
+    return protein.scale_ca_coords(prot, center_of_mass)
+
+
+def line_values(lines):
+    values = []
+    for scale_lines in lines:
+        for block in scale_lines:
+            for line in block:
+                point, hydrophobicity = line["line_average_hydro"]
+                values.append((point.x, point.y, point.z, hydrophobicity, line["nb_steps"],
+                               line["shortest_distance"], line["slice_hydro"].tolist()))
+    return values
+
+
+@pytest.mark.parametrize("chunk_size", [None, 37])
+def test_backends_give_the_same_lines(globular, chunk_size):
+    sphere_points = sphere.generate_points_on_sphere(400)
+    scale_list = scales.get_scales("binary,kyte-doolittle")
+    serial = executors.scan_scales(globular, 15, 5, sphere_points, scale_list, 3, "serial")
+    assert len(line_values(serial)) >= 2 * 3
+
+    for backend in ("threads", "processes"):
+        lines = executors.scan_scales(globular, 15, 5, sphere_points, scale_list, 3, backend,
+                                      jobs=2, chunk_size=chunk_size)
+        assert line_values(lines) == line_values(serial), backend
+
+
+def test_threads_are_never_chosen():
+    for nb_residues in (10, 1000, 100000):
+        for nb_lines in (10, 1000, 100000):
+            assert executors.choose_backend(nb_residues, nb_lines, 4) in ("serial", "processes")
+    assert executors.choose_backend(100000, 100000, 1) == "serial"
+    assert executors.choose_backend(100000, 100000, 4) == "processes"
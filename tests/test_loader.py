@@ -0,0 +1,102 @@
+"""Tests of the parsing of the PDB and mmCIF structures"""
+
+import bz2
+import gzip
+import io
+import os
+import shutil
+
+import numpy as np
+import pytest
+import src.loader as loader
+from conftest import write_mmcif
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+FIELDS = ("coords", "names", "elements", "res_names", "chains", "res_ids", "icodes", "hetero")
+
+
+def assert_same_atoms(atoms, expected):
+    assert len(atoms) == len(expected)
+    for field in FIELDS:
+        if field == "coords":
+            assert np.allclose(atoms.coords, expected.coords, atol=1e-3)
+        else:
+            assert (getattr(atoms, field) == getattr(expected, field)).all(), field
+
+
+def test_pdb_and_mmcif_give_the_same_atoms(mmcif_copy):
+    atoms = loader.load_structure(os.path.join(DATA_DIR, "1uw3_globular.pdb"))
+    assert atoms.hetero.any() and not atoms.hetero.all()
+
+    assert_same_atoms(loader.load_structure(mmcif_copy("1uw3_globular.pdb")), atoms)
+    # Without the extension, the format is guessed from the first line
+    assert_same_atoms(loader.load_structure(mmcif_copy("1uw3_globular.pdb", ".txt")), atoms)
+
+
+def test_alternate_locations_keep_the_first_one():
+    atoms = loader.load_structure(os.path.join(DATA_DIR, "1uw3_globular.pdb"))
+    keys = list(zip(atoms.chains, atoms.res_ids, atoms.icodes, atoms.names))
+    assert len(keys) == len(set(keys))
+    first = (atoms.chains == "A") & (atoms.res_ids == 164) & (atoms.names == "CG")
+    assert np.allclose(atoms.coords[first], [[43.022, 7.682, 23.768]])
+
+
+def test_quoted_mmcif_values():
+    text = ("data_x\nloop_\n_atom_site.group_PDB\n_atom_site.label_atom_id\n"
+            "_atom_site.label_comp_id\n_atom_site.auth_asym_id\n_atom_site.auth_seq_id\n"
+            "_atom_site.Cartn_x\n_atom_site.Cartn_y\n_atom_site.Cartn_z\n"
+            "HETATM \"O5'\" 'A B' A 1 1.0 2.0 3.0\n"
+            "ATOM CA ALA A 2 4.0 5.0 6.0\n#\n")
+    atoms = loader.load_structure(io.StringIO(text))
+    assert list(atoms.names) == ["O5'", "CA"]
+    assert list(atoms.res_names) == ["A B", "ALA"]
+    assert list(atoms.hetero) == [True, False]
+    assert np.allclose(atoms.coords, [[1, 2, 3], [4, 5, 6]])
+
+
+@pytest.mark.parametrize("compress", [gzip.open, bz2.open])
+@pytest.mark.parametrize("suffix", ["", ".txt"])
+def test_compressed_files_load_as_plain_files(tmp_path, compress, suffix):
+    pdb_file = os.path.join(DATA_DIR, "1uw3_globular.pdb")
+    # The compression is detected from the content, not from the extension
+    compressed_file = str(tmp_path / ("1uw3.pdb" + suffix))
+    with open(pdb_file, "rb") as file_in, compress(compressed_file, "wb") as file_out:
+        shutil.copyfileobj(file_in, file_out)
+    atoms = loader.load_structure(pdb_file)
+
+    assert_same_atoms(loader.load_structure(compressed_file), atoms)
+    with open(compressed_file, "rb") as stream:
+        assert_same_atoms(loader.load_structure(stream), atoms)
+
+
+def two_models(pdb_file):
+    atoms = loader.load_structure(pdb_file)
+    moved = loader.Atoms(atoms.coords + 1, atoms.names, atoms.elements, atoms.res_names,
+                         atoms.chains, atoms.res_ids, atoms.icodes, atoms.hetero)
+    return atoms, moved
+
+
+def test_multi_model_files_give_every_model(tmp_path):
+    models = two_models(os.path.join(DATA_DIR, "1uw3_globular.pdb"))
+    pdb_text = io.StringIO()
+    for number, atoms in enumerate(models, start=1):
+        pdb_text.write("MODEL     {:4d}\n".format(number))
+        loader.write_pdb_atoms(atoms, pdb_text)
+        pdb_text.write("ENDMDL\n")
+    cif_text = io.StringIO()
+    write_mmcif(models, cif_text)
+    pdb_file, cif_file = str(tmp_path / "models.pdb.gz"), str(tmp_path / "models.cif")
+    with gzip.open(pdb_file, "wt") as file_out:
+        file_out.write(pdb_text.getvalue())
+    with open(cif_file, "w") as file_out:
+        file_out.write(cif_text.getvalue())
+
+    for source in (pdb_file, cif_file, io.BytesIO(pdb_text.getvalue().encode())):
+        read = list(loader.iter_models(source))
+        assert len(read) == 2
+        for atoms, expected in zip(read, models):
+            assert_same_atoms(atoms, expected)
+    assert_same_atoms(loader.load_structure(cif_file, model=1), models[1])
+    with pytest.raises(ValueError):
+        loader.load_structure(pdb_file, model=2)
@@ -0,0 +1,41 @@
+"""Tests of the checks of the command line arguments"""
+
+import main
+import pytest
+import src.options as options
+from docopt import docopt
+
+
+def check(*argv):
+    return options.check_arguments(docopt(main.__doc__, list(argv)))
+
+
+def test_default_arguments_are_valid():
+    assert check("data/1uaz_tm.pdb") is None
+    assert check("data/1uaz_tm.pdb", "--scale", "types,kyte-doolittle") is None
+    assert check("--trajectory", "frames.pdb", "--scale", "kyte-doolittle") is None
+
+
+@pytest.mark.parametrize("scale", ["types,kyte-doolittle", "binary, types"])
+def test_trajectory_takes_one_scale(scale):
+    assert check("--trajectory", "frames.pdb", "--scale", scale) == \
+        "--trajectory takes one hydrophobicity scale: " + scale
+
+
+def test_unknown_scale():
+    assert check("data/1uaz_tm.pdb", "--scale", "types,nope").startswith(
+        "Unknown hydrophobicity scale: nope")
+
+
+@pytest.mark.parametrize("option, value", [("--resolution", "nan"), ("--slice", "inf"),
+                                           ("--precision", "-inf"), ("--cache-size", "NaN")])
+def test_numbers_are_finite(option, value):
+    assert check("data/1uaz_tm.pdb", option, value) == \
+        "{} should be a finite number: {}".format(option, value)
+
+
+@pytest.mark.parametrize("option, value", [("--resolution", "0"), ("--slice", "-5"),
+                                           ("--points", "0"), ("--rescan-drop", "-0.1")])
+def test_numbers_are_positive(option, value):
+    assert "should be" in check("data/1uaz_tm.pdb", option, value)
+    assert check("data/1uaz_tm.pdb", "--rescan-drop", "0") is None
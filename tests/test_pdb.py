@@ -0,0 +1,48 @@
+"""Tests of the PDB files with the membranes"""
+
+import gzip
+import os
+import shutil
+
+import numpy as np
+import src.loader as loader
+import src.pdb as pdb
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def membranes():
+    return np.zeros((3, 3)), np.ones((2, 3))
+
+
+def test_pdb_input_is_copied(tmp_path):
+    pdb_file = os.path.join(DATA_DIR, "1uw3_globular.pdb")
+    new_pdb_file = pdb.write_pdb(pdb_file, *membranes(), str(tmp_path / "new.pdb"))
+
+    with open(pdb_file) as original, open(new_pdb_file) as written:
+        original, written = original.read(), written.read()
+    assert written.startswith(original)
+    assert written[len(original):].count("DUM") == 5
+
+
+def test_mmcif_input_is_written_as_pdb(tmp_path, mmcif_copy):
+    cif_file = mmcif_copy("1uw3_globular.pdb")
+    compressed_file = cif_file + ".gz"
+    with open(cif_file, "rb") as file_in, gzip.open(compressed_file, "wb") as file_out:
+        shutil.copyfileobj(file_in, file_out)
+    atoms = loader.load_structure(cif_file)
+
+    for source in (cif_file, compressed_file):
+        new_pdb_file = pdb.output_paths(source)[0]
+        assert new_pdb_file == str(tmp_path / "1uw3_globular_new.pdb")
+        pdb.write_pdb(source, *membranes(), new_pdb_file)
+
+        with open(new_pdb_file) as written:
+            assert written.readline().startswith("ATOM")
+        new_atoms = loader.load_structure(new_pdb_file)
+        assert len(new_atoms) == len(atoms) + 5
+        assert np.allclose(new_atoms.coords[:len(atoms)], atoms.coords)
+        assert (new_atoms.names[:len(atoms)] == atoms.names).all()
+        assert (new_atoms.res_ids[:len(atoms)] == atoms.res_ids).all()
+        assert (new_atoms.res_names[len(atoms):] == "DUM").all()
@@ -0,0 +1,43 @@
+"""Tests of the instrumentation of the stages"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+import src.profiling as profiling
+
+
+def test_the_profilers_of_the_threads_are_not_shared():
+    def predict(name):
+        profiler = profiling.enable()
+        with profiling.current().stage(name):
+            pass
+        profiling.current().count("lines", 1)
+        try:
+            return profiler
+        finally:
+            profiling.disable()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        profilers = list(executor.map(predict, ["a", "b", "c", "d"]))
+
+    assert len({id(profiler) for profiler in profilers}) == 4
+    for name, profiler in zip("abcd", profilers):
+        assert [stage["stage"] for stage in profiler.stages] == [name]
+        assert profiler.counters == {"lines": 1}
+    assert not profiling.current().enabled
+
+
+@pytest.mark.skipif(profiling.resource is None, reason="no getrusage")
+def test_stages_record_the_increase_of_the_peak_rss():
+    profiler = profiling.Profiler()
+    with profiler.stage("large"):
+        np.ones(200 * 1024**2 // 8).sum()
+    with profiler.stage("small"):
+        np.ones(20 * 1024**2 // 8).sum()
+
+    large, small = profiler.stages
+    assert large["peak_rss_increase_kb"] > 100 * 1024
+    # Below the peak of the previous stage
+    assert small["peak_rss_increase_kb"] == 0
+    assert small["process_peak_rss_kb"] == large["process_peak_rss_kb"]
@@ -0,0 +1,52 @@
+"""Tests of the reduction of the scanned lines to the candidate orientations"""
+
+import os
+
+import pytest
+import src.executors as executors
+import src.pipeline as pipeline
+import src.protein as protein
+import src.scales as scales
+import src.scan as scan
+import src.sphere as sphere
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+@pytest.fixture(scope="module")
+def globular():
+    prot, center_of_mass = pipeline.load_protein(os.path.join(DATA_DIR, "1uw3_globular.pdb"),
+                                                 "shrake-rupley")
+    return protein.scale_ca_coords(prot, center_of_mass)
+
+
+def candidate_values(candidates):
+    return [candidate[0][1] for candidate in candidates]
+
+
+@pytest.mark.parametrize("scale_name", ["binary", "types", "kyte-doolittle"])
+@pytest.mark.parametrize("top_k", [3, 5])
+def test_streamed_candidates_match_full_scan(globular, scale_name, top_k):
+    scale = scales.get_scale(scale_name)
+    sphere_points = sphere.generate_points_on_sphere(1000)
+    full = protein.get_candidates([scan.scan_lines(globular, 15, 5, sphere_points, scale)], top_k)
+
+    streamed = protein.get_candidates(
+        pipeline.scan_protein(globular, 15, 5, sphere_points, top_k, scale), top_k)
+    assert candidate_values(streamed) == candidate_values(full)
+
+    # Ranges reduced separately and merged, as by the workers and the checkpoints
+    ranges = [(first, min(first + 128, 1000)) for first in range(0, 1000, 128)]
+    merged = executors.serial_scan_scales(globular, 15, 5, sphere_points, [scale], top_k,
+                                          ranges)[0]
+    assert candidate_values(protein.get_candidates(merged, top_k)) == candidate_values(full)
+
+
+def test_top_lines_pool_is_bounded(globular):
+    sphere_points = sphere.generate_points_on_sphere(5000)
+    reducer = protein.TopLines(3)
+    reducer.extend(scan.scan_lines(globular, 15, 5, sphere_points, scales.get_scale("binary")))
+    reducer.prune()
+    assert len(reducer.pool) < 5000
+    assert len(reducer.lines) == 3
@@ -0,0 +1,26 @@
+"""Tests of the histograms of the vectorized scan"""
+
+import numpy as np
+import pytest
+import src.scales as scales
+import src.scan as scan
+
+
+@pytest.mark.parametrize("thickness, resolution", [(15.013, 4.993), (14.99, 3.07), (10.001, 0.3)])
+def test_bin_width_is_bounded_for_non_round_lengths(thickness, resolution):
+    width = scan.bin_width(thickness, resolution)
+    assert width >= 1 / scan.MAX_BINS_PER_ANGSTROM
+    # The slices still start and end on bin edges of the rounded lengths
+    for length in (thickness, resolution):
+        assert abs(round(length / width) * width - length) <= 0.5 / scan.MAX_BINS_PER_ANGSTROM
+
+    # A line of 100 angströms has at most MAX_BINS_PER_ANGSTROM bins per angström
+    distances = np.random.default_rng(0).uniform(400, 500, 300)
+    weights = scales.get_scale("types").weights(np.zeros(300, dtype=np.int8))
+    cumulative_counts, _, _ = scan.line_histogram(distances, weights, width)
+    assert len(cumulative_counts) - 1 <= 100 * scan.MAX_BINS_PER_ANGSTROM + 1
+
+
+def test_bin_width_of_round_lengths():
+    assert scan.bin_width(15, 5) == 5
+    assert scan.bin_width(15, 0.5) == 0.5